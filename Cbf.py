@@ -1,57 +1,140 @@
 import xml.etree.ElementTree as ElementTree
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import gzip
+import hashlib
+import http.client
+import io
+import itertools
 import json
-import urllib.request
-from typing import Tuple, Dict, List, Optional, Self
+import logging
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+import urllib.error
+import urllib.parse
+from typing import Tuple, Dict, List, Optional, Self, Callable, Iterable, \
+    Iterator, BinaryIO, TypeVar, Hashable, Awaitable, Set
 from datetime import datetime
 import pytz
-import sys
-
-cbf_api_endpoint = "https://www.cbf.cz/xml/"
-
-
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# overridable e.g. to run against a stand-in upstream (see benchmarks)
+cbf_api_endpoint = os.environ.get('CBF_API_ENDPOINT', "https://www.cbf.cz/xml/")
+cbf_api_v2_endpoint = cbf_api_endpoint + "api/"
+# upstream dates and times are local to Prague
+cz_timezone = pytz.timezone("Europe/Prague")
+
+# concurrency used by the fetchers unless told otherwise, max_workers=1
+# falls back to the plain serial behaviour
+default_max_workers = 8
+# upstream connections are shared by all fetchers (see http_client)
+default_max_connections_per_host = 8
+default_connect_timeout = 5
+default_read_timeout = 20
+default_retries = 2
+default_retry_backoff = 0.25
+default_max_retry_backoff = 4
+
+# how long (in seconds) are responses of given endpoint considered fresh
+default_cache_ttls: Dict[str, float] = {
+    'seasonList.php': 24 * 60 * 60,
+    'divs.php': 6 * 60 * 60,
+    'table.php': 30 * 60,
+    'sched.php': 30 * 60,
+    'team.php': 15 * 60,
+    'game.php': 15 * 60,
+}
+default_cache_ttl = 15 * 60
+# ttl of schedules and games with a match being played today
+match_day_cache_ttl = 2 * 60
+default_cache_max_bytes = 64 * 1024 * 1024
+# expired responses are still served (while revalidated in the background)
+# for this long, and for stale_if_error when upstream fails
+default_stale_while_revalidate = 5 * 60
+default_stale_if_error = 24 * 60 * 60
+default_background_revalidations = 4
+# consecutive failures opening the circuit of an endpoint, and for how long
+default_circuit_failure_threshold = 5
+default_circuit_reset_timeout = 30
+
+upstream_request_seconds = metrics.registry.histogram(
+    'cbf_upstream_request_duration_seconds',
+    'Latency of upstream requests (including retries)', ['endpoint'])
+upstream_errors = metrics.registry.counter(
+    'cbf_upstream_errors_total', 'Upstream requests that failed', ['endpoint'])
+upstream_retries = metrics.registry.counter(
+    'cbf_upstream_retries_total', 'Retried upstream requests', ['endpoint'])
+upstream_in_flight = metrics.registry.gauge(
+    'cbf_upstream_requests_in_flight', 'Upstream requests being made')
+coalesced_calls = metrics.registry.counter(
+    'cbf_fetch_calls_total',
+    'Fetch calls by operation, result being executed or coalesced (waited '
+    'for an identical call in flight)', ['operation', 'result'])
+circuit_rejections = metrics.registry.counter(
+    'cbf_circuit_breaker_rejections_total',
+    'Upstream requests failed fast by an open circuit', ['endpoint'])
+parse_seconds = metrics.registry.histogram(
+    'cbf_parse_duration_seconds', 'Time spent parsing upstream responses',
+    ['endpoint'])
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+# the match records are immutable and hashable, equal teams/referees (and
+# locations) are shared within a fetcher via Interner
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
 class Referee:
-    def __init__(self, ref_id: int, first_name: str, last_name: str):
-        self.id = ref_id
-        self.first_name = first_name
-        self.last_name = last_name
+    id: int
+    first_name: str
+    last_name: str
 
 
+@dataclasses.dataclass(frozen=True, slots=True)
 class Team:
-    def __init__(self, team_id: int, team_name: str, abbr: str):
-        self.id = team_id
-        self.name = team_name
-        self.abbr = abbr
+    id: int
+    name: str
+    abbr: str
 
 
+@dataclasses.dataclass(frozen=True, slots=True)
 class Match:
+    @dataclasses.dataclass(frozen=True, slots=True)
     class Result:
-        def __init__(self, pts: Tuple[int, int], score: Tuple[int, int],
-                     partials: Dict[str, Tuple[int, int]], url_live: str):
-            self.pts = pts
-            self.score = score
-            self.partials = partials
-            self.url_live = url_live
+        pts: Tuple[int, int]
+        score: Tuple[int, int]
+        # (quarter, (a, b)) pairs in order
+        partials: Tuple[Tuple[str, Tuple[int, int]], ...]
+        url_live: str
 
+    @dataclasses.dataclass(frozen=True, slots=True)
     class Location:
-        def __init__(self, place: str, city: str,
-                     coordinates: Optional[Tuple[float, float]] = None):
-            self.place = place
-            self.city = city
-            self.coordinates = coordinates
+        place: str
+        city: str
+        coordinates: Optional[Tuple[float, float]] = None
 
     # possible addition - round
-    def __init__(self, id: int, home_team: Team, visiting_team: Team,
-                 start: Optional[datetime], location: Location,
-                 refs: List[Referee], supervisor: Optional[Referee],
-                 result: Optional[Result]):
-        self.id = id
-        self.home_team = home_team
-        self.visiting_team = visiting_team
-        self.start = start
-        self.location = location
-        self.refs = refs
-        self.supervisor = supervisor
-        self.result = result
+    id: int
+    home_team: Team
+    visiting_team: Team
+    start: Optional[datetime]
+    location: Location
+    refs: Tuple[Referee, ...]
+    supervisor: Optional[Referee]
+    result: Optional[Result]
 
 
 class Schedule:
@@ -60,20 +143,18 @@ class Schedule:
         self.matches = matches
 
 
+@dataclasses.dataclass(frozen=True, slots=True)
 class TeamStanding:
-    def __init__(self, team_id: int, team_name: str, abbr: str, position: int,
-                 games_played: int, games_won: int, games_lost: int,
-                 points_scored: int, points_allowed: int, points: str):
-        self.id = team_id
-        self.name = team_name
-        self.abbr = abbr
-        self.position = position
-        self.games_played = games_played
-        self.games_won = games_won
-        self.games_lost = games_lost
-        self.points_scored = points_scored
-        self.points_allowed = points_allowed
-        self.points = points
+    id: int
+    name: str
+    abbr: str
+    position: int
+    games_played: int
+    games_won: int
+    games_lost: int
+    points_scored: int
+    points_allowed: int
+    points: str
 
 
 class Standings:
@@ -82,14 +163,76 @@ class Standings:
         self.team_standings = team_standings
 
 
+# parts of a phase that are loaded from upstream
+phase_parts = ('schedule', 'standings')
+
+_not_loaded = object()
+# threads where loading phase parts on access (blocking) is an error, like
+# the thread of cbf_async.upstream_loop
+_nonblocking = threading.local()
+
+
+def forbid_blocking_loads() -> None:
+    """Makes the current thread raise on phase parts not loaded ahead."""
+    _nonblocking.active = True
+
+
+def _check_blocking_load(part: str) -> None:
+    if getattr(_nonblocking, 'active', False):
+        raise RuntimeError(f'Phase {part} not loaded ahead, loading it here '
+                           'would block the event loop (await prefetch)')
+
+
 class Phase:
+    """
+    Phase of a division. When created with a fetcher instead of the data,
+    the schedule and standings are fetched on first access and kept (None
+    if upstream fails to provide them).
+    """
+
     # possible additions - type, offset
     def __init__(self, phase_id: int, phase_name: str,
-                 schedule: Schedule, standings: Standings):
+                 schedule: Optional[Schedule] = None,
+                 standings: Optional[Standings] = None,
+                 fetcher: Optional['CbfApiFetcher_v1'] = None,
+                 division_name: str = ''):
         self.id = phase_id
         self.name = phase_name
-        self.schedule = schedule
-        self.standings = standings
+        self.division_name = division_name
+        self._fetcher = fetcher
+        self._schedule = _not_loaded \
+            if schedule is None and fetcher is not None else schedule
+        self._standings = _not_loaded \
+            if standings is None and fetcher is not None else standings
+        # reentrant, standings may be derived from the schedule
+        self._lock = threading.RLock()
+
+    @property
+    def schedule(self) -> Optional[Schedule]:
+        if self._schedule is _not_loaded:
+            with self._lock:
+                if self._schedule is _not_loaded:
+                    _check_blocking_load('schedule')
+                    self._schedule = self._fetcher.fetch_schedule(self.id)
+        return self._schedule
+
+    @property
+    def standings(self) -> Optional[Standings]:
+        if self._standings is _not_loaded:
+            with self._lock:
+                if self._standings is _not_loaded:
+                    _check_blocking_load('standings')
+                    self._standings = self._fetcher.fetch_phase_standings(
+                        self)
+        return self._standings
+
+    def is_loaded(self, part: str) -> bool:
+        return getattr(self, '_' + part) is not _not_loaded
+
+    def store(self, part: str, value) -> None:
+        """Keeps given part loaded elsewhere (e.g. asynchronously)."""
+        with self._lock:
+            setattr(self, '_' + part, value)
 
 
 class Division:
@@ -117,10 +260,164 @@ class Division:
         self.phases = phases
 
 
+class FetchError:
+    """Describes a part of the season (phase or division) that was skipped."""
+
+    def __init__(self, phase_id: Optional[int], message: str):
+        self.phase_id = phase_id
+        self.message = message
+
+
 class Season:
-    def __init__(self, year: int, divisions: List[Division]):
+    def __init__(self, year: int, divisions: List[Division],
+                 errors: Optional[List[FetchError]] = None):
         self.year = year
         self.divisions = divisions
+        self.errors = errors if errors is not None else []
+
+
+def match_to_dict(match: Match) -> dict:
+    """JSON compatible form of the match (see match_from_dict)."""
+    data = dataclasses.asdict(match)
+    data['start'] = match.start.astimezone(pytz.utc).isoformat() \
+        if match.start is not None else None
+    return data
+
+
+def match_from_dict(data: dict) -> Match:
+    """Match stored by match_to_dict, the start being in Prague time."""
+    def referee(ref: Optional[dict]) -> Optional[Referee]:
+        return Referee(**ref) if ref is not None else None
+
+    location = data['location']
+    result = data['result']
+    return Match(
+        data['id'], Team(**data['home_team']), Team(**data['visiting_team']),
+        datetime.fromisoformat(data['start']).astimezone(cz_timezone)
+        if data['start'] is not None else None,
+        Match.Location(location['place'], location['city'],
+                       tuple(location['coordinates'])
+                       if location['coordinates'] is not None else None),
+        tuple(referee(ref) for ref in data['refs']),
+        referee(data['supervisor']),
+        Match.Result(tuple(result['pts']), tuple(result['score']),
+                     tuple((quarter, tuple(points))
+                           for quarter, points in result['partials']),
+                     result['url_live'])
+        if result is not None else None)
+
+
+def content_hash(data) -> str:
+    """Hash of JSON compatible data, independent of the order of the keys."""
+    return hashlib.sha256(json.dumps(
+        data, ensure_ascii=False, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def match_hash(match: Match) -> str:
+    return content_hash(match_to_dict(match))
+
+
+def standings_hash(standings: Standings) -> str:
+    return content_hash([dataclasses.asdict(team_standing)
+                         for team_standing in standings.team_standings])
+
+
+# divisions ranked by rules the results do not tell (Kooperativa NBL ranks
+# by win %, see parse_team_standing), their standings are always fetched
+upstream_standings_divisions = re.compile(r'\bNBL\b')
+
+
+def is_played(match: Match) -> bool:
+    """Whether the match has a result, unplayed ones are listed as 0:0."""
+    return match.result is not None and match.result.score != (0, 0)
+
+
+def has_local_standings(phase: Phase) -> bool:
+    """Whether standings of the phase may be derived by compute_standings."""
+    return not upstream_standings_divisions.search(phase.division_name)
+
+
+@dataclasses.dataclass(slots=True)
+class _TeamRecord:
+    team: Team
+    games_won: int = 0
+    games_lost: int = 0
+    points_scored: int = 0
+    points_allowed: int = 0
+    points: int = 0
+
+
+def compute_standings(schedule: Schedule) -> Optional[Standings]:
+    """
+    Standings derived from the results in the schedule, as table.php ranks
+    them - by points (pts of the results), teams level on points by their
+    games against each other (points, point difference, points scored),
+    then by the overall point difference and points scored. Teams yet to
+    play are listed with zeros. None when the results do not tell the
+    winner (draws, pts not following the score) and table.php is needed.
+    """
+    records: Dict[int, _TeamRecord] = {}
+    played = []
+    for match in schedule.matches:
+        for team in (match.home_team, match.visiting_team):
+            if team.id not in records:
+                records[team.id] = _TeamRecord(team)
+        if not is_played(match):
+            continue
+        (home_pts, visiting_pts) = match.result.pts
+        (home_score, visiting_score) = match.result.score
+        if home_score == visiting_score or \
+                (home_pts > visiting_pts) != (home_score > visiting_score):
+            return None
+        played.append(match)
+        for team, pts, scored, allowed in (
+                (match.home_team, home_pts, home_score, visiting_score),
+                (match.visiting_team, visiting_pts, visiting_score, home_score)):
+            record = records[team.id]
+            if scored > allowed:
+                record.games_won += 1
+            else:
+                record.games_lost += 1
+            record.points_scored += scored
+            record.points_allowed += allowed
+            record.points += pts
+
+    def head_to_head(team_ids: Set[int]) -> Dict[int, Tuple[int, int, int]]:
+        """Points, point difference and points scored in mutual games."""
+        totals = {team_id: (0, 0, 0) for team_id in team_ids}
+        for match in played:
+            home_id, visiting_id = match.home_team.id, match.visiting_team.id
+            if home_id not in team_ids or visiting_id not in team_ids:
+                continue
+            for team_id, pts, scored, allowed in (
+                    (home_id, match.result.pts[0], *match.result.score),
+                    (visiting_id, match.result.pts[1],
+                     *reversed(match.result.score))):
+                points, difference, total_scored = totals[team_id]
+                totals[team_id] = (points + pts, difference + scored - allowed,
+                                   total_scored + scored)
+        return totals
+
+    ranked: List[_TeamRecord] = []
+    by_points = sorted(records.values(), key=lambda record: -record.points)
+    for _, level in itertools.groupby(by_points,
+                                      key=lambda record: record.points):
+        level = list(level)
+        mutual = head_to_head({record.team.id for record in level}) \
+            if len(level) > 1 else {}
+        level.sort(key=lambda record: (
+            tuple(-value for value in mutual.get(record.team.id, ())),
+            record.points_allowed - record.points_scored,
+            -record.points_scored, record.team.name))
+        ranked.extend(level)
+    return Standings(schedule.phase_id, [
+        TeamStanding(record.team.id, record.team.name, record.team.abbr,
+                     position, record.games_won + record.games_lost,
+                     record.games_won, record.games_lost,
+                     record.points_scored, record.points_allowed,
+                     str(record.points))
+        for position, record in enumerate(ranked, 1)])
 
 
 areas: Dict[str, int] = {
@@ -153,75 +450,1324 @@ class SeasonDescription:
                    bool(int(xml.findtext('current', ''))))
 
 
-class CbfApiFetcher_v1:
-    def __init__(self, api_url: str):
-        self.api_url = api_url
+class Interner:
+    """
+    Hands out one shared instance for equal records, so that e.g. a team
+    playing many matches is held only once.
+    """
+
+    def __init__(self):
+        self._records: dict = {}
+
+    def __call__(self, record: T) -> T:
+        return self._records.setdefault(record, record)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class UpstreamResponse:
+    """Status, headers (by lower-cased name) and body of a response."""
+
+    def __init__(self, status: int, headers: Iterable[Tuple[str, str]],
+                 body: bytes):
+        self.status = status
+        self.headers = {name.lower(): value for name, value in headers}
+        self.body = body
+
+
+class LatencyStats:
+    __slots__ = ('requests', 'errors', 'retries', 'total_seconds',
+                 'max_seconds')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'mean_seconds': self.total_seconds / self.requests
+            if self.requests else 0.0,
+            'max_seconds': self.max_seconds,
+        }
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the rate of requests - rate per second on average,
+    bursts of up to burst at once. Thread safe, requests over the budget
+    wait their turn.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.waited_seconds = 0.0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token (possibly ahead), returns how long to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited_seconds += delay
+            return delay
+
+    def acquire(self) -> None:
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _HostPool:
+    def __init__(self, scheme: str, host: str, max_connections: int):
+        self.scheme = scheme
+        self.host = host
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.idle: List[http.client.HTTPConnection] = []
+        self.lock = threading.Lock()
+
+
+class HttpClient:
+    """
+    Transport to the upstream shared by the fetchers. Keeps persistent
+    (keep-alive) connections pooled per host, at most max_connections_per_host
+    of them in use at once. Requests have connect and read timeouts, transient
+    failures (network errors, 429 and 5xx) are retried with bounded
+    exponential backoff and responses are gzip compressed when possible.
+    Error responses are raised as urllib.error.HTTPError, like urlopen does.
+    With rate_limiter every request (retries included) takes its budget.
+    """
+
+    transient_statuses = (429, 500, 502, 503, 504)
+    redirect_statuses = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    def __init__(self,
+                 max_connections_per_host: int = default_max_connections_per_host,
+                 connect_timeout: float = default_connect_timeout,
+                 read_timeout: float = default_read_timeout,
+                 retries: int = default_retries,
+                 retry_backoff: float = default_retry_backoff,
+                 max_retry_backoff: float = default_max_retry_backoff,
+                 rate_limiter: Optional[RateLimiter] = None):
+        self.max_connections_per_host = max_connections_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.rate_limiter = rate_limiter
+        self._pools: Dict[Tuple[str, str], _HostPool] = {}
+        self._stats: Dict[str, LatencyStats] = \
+            collections.defaultdict(LatencyStats)
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme: str, host: str) -> _HostPool:
+        with self._lock:
+            pool = self._pools.get((scheme, host))
+            if pool is None:
+                pool = _HostPool(scheme, host, self.max_connections_per_host)
+                self._pools[(scheme, host)] = pool
+        return pool
+
+    def _connect(self, pool: _HostPool) -> http.client.HTTPConnection:
+        if pool.scheme == 'https':
+            connection = http.client.HTTPSConnection(
+                pool.host, timeout=self.connect_timeout)
+        else:
+            connection = http.client.HTTPConnection(
+                pool.host, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection
+
+    def _send(self, pool: _HostPool, path: str, headers: Dict[str, str]) \
+            -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """
+        Sends the request over an idle connection of the pool (or a new one),
+        the caller must hold a slot of the pool and give the connection back.
+        """
+        with pool.lock:
+            connection = pool.idle.pop() if pool.idle else None
+        if connection is not None:
+            try:
+                connection.request('GET', path, headers=headers)
+                return connection, connection.getresponse()
+            except (OSError, http.client.HTTPException):
+                # the server has closed the idle connection meanwhile
+                connection.close()
+        connection = self._connect(pool)
+        try:
+            connection.request('GET', path, headers=headers)
+            return connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    @staticmethod
+    def _release(pool: _HostPool, connection: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse) -> None:
+        if response.isclosed() and not response.will_close:
+            with pool.lock:
+                pool.idle.append(connection)
+        else:
+            connection.close()
+        pool.slots.release()
+
+    def _backoff(self, attempt: int) -> None:
+        delay = min(self.max_retry_backoff, self.retry_backoff * 2 ** attempt)
+        time.sleep(delay * random.uniform(0.5, 1))
+
+    @contextlib.contextmanager
+    def open(self, request_url: str,
+             headers: Optional[Dict[str, str]] = None) \
+            -> Iterator[Tuple[http.client.HTTPResponse, BinaryIO]]:
+        """
+        Opens the response for reading (decompressed) as it arrives. Errors
+        before the response starts are retried, the read itself is not.
+        """
+        upstream_in_flight.inc()
+        try:
+            with self._open(request_url, headers) as opened:
+                yield opened
+        finally:
+            upstream_in_flight.dec()
+
+    @contextlib.contextmanager
+    def _open(self, request_url: str, headers: Optional[Dict[str, str]]) \
+            -> Iterator[Tuple[http.client.HTTPResponse, BinaryIO]]:
+        request_headers = {'Accept-Encoding': 'gzip'}
+        request_headers.update(headers or {})
+        endpoint = urllib.parse.urlsplit(request_url).path.rsplit('/', 1)[-1]
+        started = time.monotonic()
+        attempt = 0
+        redirects = 0
+        while True:
+            url = urllib.parse.urlsplit(request_url)
+            path = url.path + ('?' + url.query if url.query else '')
+            pool = self._pool(url.scheme, url.netloc)
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            pool.slots.acquire()
+            try:
+                connection, response = self._send(pool, path, request_headers)
+            except (OSError, http.client.HTTPException):
+                pool.slots.release()
+                if attempt >= self.retries:
+                    self._record(endpoint, started, attempt, error=True)
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            if response.status in self.redirect_statuses and \
+                    redirects < self.max_redirects:
+                response.read()
+                self._release(pool, connection, response)
+                request_url = urllib.parse.urljoin(
+                    request_url, response.getheader('Location', ''))
+                redirects += 1
+                continue
+            if response.status in self.transient_statuses and \
+                    attempt < self.retries:
+                response.read()
+                self._release(pool, connection, response)
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            try:
+                if response.status in self.redirect_statuses:
+                    body = response.read()
+                    raise urllib.error.HTTPError(
+                        request_url, response.status, 'Too many redirects',
+                        response.headers, io.BytesIO(body))
+                if response.status >= 400:
+                    body = response.read()
+                    raise urllib.error.HTTPError(
+                        request_url, response.status, response.reason,
+                        response.headers, io.BytesIO(body))
+                stream: BinaryIO = response
+                if response.getheader('Content-Encoding') == 'gzip':
+                    stream = gzip.GzipFile(fileobj=response)
+                yield response, stream
+                # leftovers would break the next request on this connection
+                if not response.isclosed():
+                    response.read()
+            except BaseException:
+                self._record(endpoint, started, attempt, error=True)
+                connection.close()
+                pool.slots.release()
+                raise
+            self._record(endpoint, started, attempt, error=False)
+            self._release(pool, connection, response)
+            return
+
+    def get(self, request_url: str,
+            headers: Optional[Dict[str, str]] = None) -> UpstreamResponse:
+        with self.open(request_url, headers) as (response, stream):
+            return UpstreamResponse(response.status,
+                                    response.headers.items(), stream.read())
+
+    def _record(self, endpoint: str, started: float, retries: int,
+                error: bool) -> None:
+        elapsed = time.monotonic() - started
+        upstream_request_seconds.observe(elapsed, endpoint=endpoint)
+        metrics.record_timing('upstream', elapsed)
+        if retries:
+            upstream_retries.inc(retries, endpoint=endpoint)
+        if error:
+            upstream_errors.inc(endpoint=endpoint)
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.requests += 1
+            stats.retries += retries
+            stats.errors += error
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per endpoint request count, errors, retries and latency."""
+        with self._lock:
+            return {endpoint: stats.as_dict()
+                    for endpoint, stats in self._stats.items()}
+
+    def close(self) -> None:
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            with pool.lock:
+                for connection in pool.idle:
+                    connection.close()
+                pool.idle.clear()
+
+
+# shared by all fetchers, so that connections are reused across requests
+http_client = HttpClient()
+
+
+class CacheEntry:
+    __slots__ = ('body', 'stored_at', 'expires_at', 'etag', 'last_modified')
+
+    def __init__(self, body: bytes, stored_at: float, expires_at: float,
+                 etag: Optional[str], last_modified: Optional[str]):
+        self.body = body
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (time.monotonic() if now is None else now) < self.expires_at
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Seconds since upstream last provided (or confirmed) the body."""
+        return (time.monotonic() if now is None else now) - self.stored_at
+
+    def validators(self) -> Dict[str, str]:
+        """Headers making the request conditional on this entry."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    In-process cache of raw upstream responses keyed by endpoint and
+    parameters. Entries are fresh for the ttl of their endpoint, stale ones
+    are kept for conditional revalidation and the least recently used ones
+    are evicted once the cached bodies exceed max_bytes. Expired entries may
+    still be served for stale_while_revalidate seconds (while revalidated in
+    the background) and for stale_if_error seconds when upstream fails.
+    """
+
+    def __init__(self, max_bytes: int = default_cache_max_bytes,
+                 ttls: Optional[Dict[str, float]] = None,
+                 default_ttl: float = default_cache_ttl,
+                 stale_while_revalidate: float = default_stale_while_revalidate,
+                 stale_if_error: float = default_stale_if_error):
+        self.max_bytes = max_bytes
+        self.ttls = dict(default_cache_ttls if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self._entries: collections.OrderedDict[str, CacheEntry] = \
+            collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._revalidating: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(request_url: str) -> str:
+        url = urllib.parse.urlsplit(request_url)
+        params = urllib.parse.urlencode(
+            sorted(urllib.parse.parse_qsl(url.query)))
+        return url.path.rsplit('/', 1)[-1] + '?' + params
+
+    def ttl_for(self, request_url: str) -> float:
+        endpoint = urllib.parse.urlsplit(request_url).path.rsplit('/', 1)[-1]
+        return self.ttls.get(endpoint, self.default_ttl)
+
+    def lookup(self, request_url: str) -> Optional[CacheEntry]:
+        """
+        Returns the entry for given url, fresh or stale (counting it as hit or
+        miss respectively), None if there is none.
+        """
+        key = self.key(request_url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.is_fresh():
+                self.misses += 1
+            else:
+                self.hits += 1
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, request_url: str, body: bytes,
+              headers: Dict[str, str]) -> None:
+        now = time.monotonic()
+        # header names are case-insensitive
+        headers = {name.lower(): value for name, value in headers.items()}
+        entry = CacheEntry(body, now, now + self.ttl_for(request_url),
+                           headers.get('etag'), headers.get('last-modified'))
+        key = self.key(request_url)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.body)
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+                self.evictions += 1
+
+    def revalidated(self, request_url: str, entry: CacheEntry) -> None:
+        """Marks entry fresh again after upstream answered 304."""
+        now = time.monotonic()
+        with self._lock:
+            self.revalidations += 1
+            entry.stored_at = now
+            entry.expires_at = now + self.ttl_for(request_url)
+
+    def serves_stale(self, entry: CacheEntry, on_error: bool = False) -> bool:
+        """Whether the expired entry may still be served."""
+        limit = self.stale_if_error if on_error else self.stale_while_revalidate
+        return time.monotonic() - entry.expires_at <= limit
+
+    def served_stale(self, entry: CacheEntry) -> None:
+        """Counts the entry served stale (into the request's staleness too)."""
+        with self._lock:
+            self.stale_hits += 1
+        add_staleness(entry.age())
+
+    def begin_revalidation(self, request_url: str) -> bool:
+        """Claims the background revalidation, False if one is running."""
+        key = self.key(request_url)
+        with self._lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            return True
+
+    def end_revalidation(self, request_url: str) -> None:
+        with self._lock:
+            self._revalidating.discard(self.key(request_url))
+
+    def limit_ttl(self, request_url: str, ttl: float) -> None:
+        with self._lock:
+            entry = self._entries.get(self.key(request_url))
+            if entry is not None:
+                entry.expires_at = min(entry.expires_at, entry.stored_at + ttl)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+
+class Staleness:
+    """Age of the oldest stale upstream data a request was served from."""
+
+    def __init__(self):
+        self.age: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, age: float) -> None:
+        with self._lock:
+            self.age = age if self.age is None else max(self.age, age)
+
+
+_staleness: contextvars.ContextVar[Optional[Staleness]] = \
+    contextvars.ContextVar('staleness', default=None)
+
+
+def start_staleness_tracking() -> Tuple[Staleness, contextvars.Token]:
+    staleness = Staleness()
+    return staleness, _staleness.set(staleness)
+
+
+def stop_staleness_tracking(token: contextvars.Token) -> None:
+    _staleness.reset(token)
+
+
+def add_staleness(age: Optional[float]) -> None:
+    """Records stale data of given age (if any) served to the request."""
+    staleness = _staleness.get()
+    if staleness is not None and age is not None:
+        staleness.add(age)
+
+
+@contextlib.contextmanager
+def tracking_staleness() -> Iterator[Staleness]:
+    """
+    Tracks the stale data served within on its own, so that the caller can
+    tell, adding it to the staleness of the request as well.
+    """
+    outer = _staleness.get()
+    staleness, token = start_staleness_tracking()
+    try:
+        yield staleness
+    finally:
+        stop_staleness_tracking(token)
+        if outer is not None and staleness.age is not None:
+            outer.add(staleness.age)
+
+
+# shared by all fetchers (unless given other cache), so that responses are
+# reused across requests of the app
+response_cache = ResponseCache()
+
+
+# parsed data shared by all processes of the app (a shared_cache.SharedCache),
+# None unless installed
+shared_cache = None
+
+
+def _response_cache_metrics() -> List[metrics.Metric]:
+    stats = response_cache.stats()
+    collected: List[metrics.Metric] = []
+    for name in ('hits', 'misses', 'stale_hits', 'revalidations',
+                 'evictions'):
+        counter = metrics.Counter('cbf_response_cache_' + name + '_total',
+                                  'Upstream response cache ' + name)
+        counter.inc(stats[name])
+        collected.append(counter)
+    for name in ('entries', 'bytes'):
+        gauge = metrics.Gauge('cbf_response_cache_' + name,
+                              'Upstream response cache ' + name)
+        gauge.set(stats[name])
+        collected.append(gauge)
+    ratio = metrics.Gauge('cbf_response_cache_hit_ratio',
+                          'Share of lookups served fresh from the cache')
+    lookups = stats['hits'] + stats['misses']
+    ratio.set(stats['hits'] / lookups if lookups else 0)
+    collected.append(ratio)
+    return collected
+
+
+metrics.registry.add_collector(_response_cache_metrics)
+
+
+class _Abandoned(Exception):
+    """The call in flight was cancelled, its waiters have to call on their own."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with equal keys - while one is running, the
+    others wait for it and get its result (or exception) instead of running
+    again. Nothing is kept once the call finishes, that is up to the caches.
+    Stale data the call served is recorded for the waiters as well. Works
+    for threads (do) and for coroutines of any event loop (do_async).
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def _join(self, key: Hashable,
+              operation: str) -> Tuple[bool, concurrent.futures.Future]:
+        """Future of the call in flight, and whether the caller should run it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = concurrent.futures.Future()
+                # running, so that waiters giving up can not cancel it
+                flight.set_running_or_notify_cancel()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        coalesced_calls.inc(operation=operation,
+                            result='executed' if leader else 'coalesced')
+        return leader, flight
+
+    def _land(self, key: Hashable) -> None:
+        with self._lock:
+            del self._flights[key]
+
+    def do(self, key: Hashable, function: Callable[[], R],
+           operation: str = '') -> R:
+        leader, flight = self._join(key, operation)
+        if not leader:
+            try:
+                result = flight.result()
+            except _Abandoned:
+                return self.do(key, function, operation)
+            add_staleness(flight.stale_age)
+            return result
+        try:
+            with tracking_staleness() as staleness:
+                result = function()
+        except BaseException as error:
+            self._land(key)
+            flight.set_exception(error)
+            raise
+        self._land(key)
+        flight.stale_age = staleness.age
+        flight.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable,
+                       function: Callable[[], Awaitable[R]],
+                       operation: str = '') -> R:
+        leader, flight = self._join(key, operation)
+        if not leader:
+            try:
+                result = await asyncio.wrap_future(flight)
+            except _Abandoned:
+                return await self.do_async(key, function, operation)
+            add_staleness(flight.stale_age)
+            return result
+        try:
+            with tracking_staleness() as staleness:
+                result = await function()
+        except asyncio.CancelledError:
+            self._land(key)
+            flight.set_exception(_Abandoned())
+            raise
+        except BaseException as error:
+            self._land(key)
+            flight.set_exception(error)
+            raise
+        self._land(key)
+        flight.stale_age = staleness.age
+        flight.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced,
+                    'in_flight': len(self._flights)}
+
+
+# shared by all fetchers, so that concurrent requests coalesce
+single_flight = SingleFlight()
+
 
-    def fetch_season(self, year: int) -> Optional[Season]:
+class UpstreamUnavailable(ConnectionError):
+    """Request not made, the circuit of the endpoint is open."""
+
+
+def _endpoint(request_url: str) -> str:
+    return urllib.parse.urlsplit(request_url).path.rsplit('/', 1)[-1]
+
+
+# OSErrors of local files, never caused by upstream
+local_errors = (FileNotFoundError, FileExistsError, PermissionError,
+                IsADirectoryError, NotADirectoryError)
+
+
+def is_outage(error: BaseException) -> bool:
+    """Whether the error means upstream is down (or overloaded)."""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500 or error.code == 429
+    if isinstance(error, local_errors):
+        return False
+    return isinstance(error, (OSError, EOFError, http.client.HTTPException))
+
+
+class _Circuit:
+    __slots__ = ('failures', 'opened_at', 'probed_at')
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probed_at: Optional[float] = None
+
+
+class CircuitBreaker:
+    """
+    Fails requests to an endpoint fast (raising UpstreamUnavailable) once
+    failure_threshold of them failed in a row. After reset_timeout seconds
+    one probe request at a time is let through (half-open), the first one
+    to succeed closes the circuit again. A probe that never reports back
+    is replaced after another reset_timeout.
+    """
+
+    def __init__(self,
+                 failure_threshold: int = default_circuit_failure_threshold,
+                 reset_timeout: float = default_circuit_reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits: Dict[str, _Circuit] = \
+            collections.defaultdict(_Circuit)
+        self._lock = threading.Lock()
+
+    def allow(self, endpoint: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits[endpoint]
+            if circuit.opened_at is None:
+                return
+            if now - circuit.opened_at >= self.reset_timeout and \
+                    (circuit.probed_at is None or
+                     now - circuit.probed_at >= self.reset_timeout):
+                circuit.probed_at = now
+                return
+        circuit_rejections.inc(endpoint=endpoint)
+        raise UpstreamUnavailable(f'Circuit of {endpoint} is open')
+
+    def record(self, endpoint: str, failed: bool) -> None:
+        with self._lock:
+            circuit = self._circuits[endpoint]
+            if not failed:
+                circuit.failures = 0
+                circuit.opened_at = circuit.probed_at = None
+                return
+            circuit.failures += 1
+            if circuit.failures >= self.failure_threshold:
+                if circuit.opened_at is None:
+                    logger.warning('Opening circuit of %s after %d failures',
+                                   endpoint, circuit.failures)
+                circuit.opened_at = time.monotonic()
+                circuit.probed_at = None
+
+    def state(self, endpoint: str) -> str:
+        """closed, open or half-open"""
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None or circuit.opened_at is None:
+                return 'closed'
+            if time.monotonic() - circuit.opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def stats(self) -> Dict[str, str]:
+        with self._lock:
+            endpoints = list(self._circuits)
+        return {endpoint: self.state(endpoint) for endpoint in endpoints}
+
+    @contextlib.contextmanager
+    def guard(self, request_url: str) -> Iterator[None]:
+        """Lets the request through (or raises) and records how it went."""
+        endpoint = _endpoint(request_url)
+        self.allow(endpoint)
+        try:
+            yield
+        except BaseException as error:
+            if is_outage(error):
+                self.record(endpoint, True)
+            elif isinstance(error, Exception):
+                # upstream answered, just not as wanted
+                self.record(endpoint, False)
+            raise
+        self.record(endpoint, False)
+
+
+# shared by all fetchers, so that all of them back off an upstream outage
+circuit_breaker = CircuitBreaker()
+
+
+def _circuit_breaker_metrics() -> List[metrics.Metric]:
+    gauge = metrics.Gauge('cbf_circuit_breaker_open',
+                          'Whether the circuit of the endpoint is open '
+                          '(1) or half-open (0.5)', ['endpoint'])
+    for endpoint, state in circuit_breaker.stats().items():
+        gauge.set({'closed': 0, 'half-open': 0.5, 'open': 1}[state],
+                  endpoint=endpoint)
+    return [gauge]
+
+
+metrics.registry.add_collector(_circuit_breaker_metrics)
+
+# refreshes stale cached responses in the background
+_revalidation_executor = concurrent.futures.ThreadPoolExecutor(
+    default_background_revalidations, thread_name_prefix='cbf-revalidate')
+
+
+def _revalidate(cache: ResponseCache, http: HttpClient,
+                circuit_breaker: Optional[CircuitBreaker], request_url: str,
+                entry: Optional[CacheEntry]) -> bytes:
+    """
+    Downloads the response into cache (unless it still is the cached entry),
+    through circuit_breaker when there is one.
+    """
+    headers = entry.validators() if entry is not None else {}
+    if circuit_breaker is None:
+        response = http.get(request_url, headers)
+    else:
+        with circuit_breaker.guard(request_url):
+            response = http.get(request_url, headers)
+    if response.status == 304 and entry is not None:
+        cache.revalidated(request_url, entry)
+        return entry.body
+    cache.store(request_url, response.body, response.headers)
+    return response.body
+
+
+def _revalidate_later(cache: ResponseCache, http: HttpClient,
+                      circuit_breaker: Optional[CircuitBreaker],
+                      request_url: str, entry: CacheEntry) -> None:
+    """Revalidates the cached response in the background (once at a time)."""
+    if not cache.begin_revalidation(request_url):
+        return
+
+    def revalidate() -> None:
+        try:
+            _revalidate(cache, http, circuit_breaker, request_url, entry)
+        except Exception as error:
+            logger.info('Revalidating %s failed: %s', request_url, error)
+        finally:
+            cache.end_revalidation(request_url)
+
+    _revalidation_executor.submit(revalidate)
+
+
+def _coalesced(method: Callable[..., R]) -> Callable[..., R]:
+    """
+    Makes concurrent calls of a fetch method with equal arguments (on equally
+    set up fetchers) share one run, see SingleFlight.
+    """
+    @functools.wraps(method)
+    def coalesced(self, *args, **kwargs) -> R:
+        if self.single_flight is None:
+            return method(self, *args, **kwargs)
+        key = (method.__qualname__, self.api_url, self.refresh,
+               id(self.cache), id(self.http), args,
+               tuple(sorted(kwargs.items())))
+        return self.single_flight.do(
+            key, lambda: method(self, *args, **kwargs), method.__name__)
+    return coalesced
+
+
+def _shared_key(api_url: str, args: tuple) -> str:
+    return api_url + ' ' + ' '.join(map(str, args))
+
+
+def _shared(kind: str) -> Callable[[Callable[..., R]], Callable[..., R]]:
+    """
+    Makes the fetch method read its (parsed) result from the cache shared by
+    the processes, and store it there, when there is one (see shared_cache).
+    Results parsed from stale responses are not stored, the processes would
+    take them for fresh.
+    """
+    def decorate(method: Callable[..., R]) -> Callable[..., R]:
+        @functools.wraps(method)
+        def shared(self, *args) -> R:
+            store = self.shared_cache
+            if store is None:
+                return method(self, *args)
+            key = _shared_key(self.api_url, args)
+            value = store.get(kind, key, self.refresh)
+            if value is None:
+                with tracking_staleness() as staleness:
+                    value = method(self, *args)
+                if value is not None and staleness.age is None:
+                    store.put(kind, key, value)
+            return value
+        return shared
+    return decorate
+
+
+def is_match_day(matches: Iterable[Match]) -> bool:
+    """Whether any of the matches is played today (in Prague)."""
+    today = datetime.now(cz_timezone).date()
+    return any(match.start is not None and
+               match.start.astimezone(cz_timezone).date() == today
+               for match in matches)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_start(gdate: str, gtime: str) -> Optional[datetime]:
+    """
+    Localized start of a match from upstream date (YYYY-MM-DD) and time
+    (HH:MM:SS), None when not scheduled yet. The fixed format is decoded
+    directly, anything else goes through strptime (raising ValueError).
+    Matches of a season share few kick-off times, hence the cache.
+    """
+    if not gdate or not gtime or gdate == '0000-00-00':
+        return None
+    digits = gdate[:4] + gdate[5:7] + gdate[8:] + \
+        gtime[:2] + gtime[3:5] + gtime[6:]
+    if len(gdate) == 10 and len(gtime) == 8 and \
+            gdate[4] == gdate[7] == '-' and gtime[2] == gtime[5] == ':' and \
+            digits.isascii() and digits.isdigit():
+        start = datetime(int(gdate[:4]), int(gdate[5:7]), int(gdate[8:]),
+                         int(gtime[:2]), int(gtime[3:5]), int(gtime[6:]))
+    else:
+        start = datetime.strptime(gdate + ' ' + gtime, '%Y-%m-%d %H:%M:%S')
+    return cz_timezone.localize(start)
+
+
+def _child_texts(xml: ElementTree.Element) -> Dict[str, str]:
+    """Texts of the first child with each tag, same as findtext would give."""
+    texts = {}
+    for child in xml:
+        if child.tag not in texts:
+            texts[child.tag] = child.text or ''
+    return texts
+
+
+class CbfApiFetcher:
+    """
+    Common base of the api fetchers, taking care of the (possibly concurrent)
+    downloading. At most `max_workers` requests are made in parallel over the
+    given http client (pooling the connections). Responses are kept in given
+    cache (the shared one by default), None disables caching. With refresh
+    set, even fresh cached responses are revalidated with upstream. Identical
+    fetches running at the same time are coalesced through single_flight
+    (the shared one by default), None disables that. Upstream requests go
+    through circuit_breaker (the shared one by default, None for none) and
+    when they fail, cached responses are served stale as the cache allows.
+    """
+
+    def __init__(self, max_workers: int = default_max_workers,
+                 cache: Optional[ResponseCache] = response_cache,
+                 http: Optional[HttpClient] = None, refresh: bool = False,
+                 single_flight: Optional[SingleFlight] = single_flight,
+                 circuit_breaker: Optional[CircuitBreaker] = circuit_breaker):
+        self.cache = cache
+        self.single_flight = single_flight
+        self.circuit_breaker = circuit_breaker
+        # the shared client and cache (looked up now, so that they can be
+        # replaced)
+        self.http = http if http is not None else http_client
+        self.shared_cache = shared_cache
+        self.refresh = refresh
+        # records are interned for the whole life of the fetcher
+        self.intern = Interner()
+        self.max_workers = max_workers
+
+    def _guard(self, request_url: str) -> contextlib.AbstractContextManager:
+        if self.circuit_breaker is None:
+            return contextlib.nullcontext()
+        return self.circuit_breaker.guard(request_url)
+
+    def _download(self, request_url: str,
+                  headers: Dict[str, str]) -> UpstreamResponse:
+        with self._guard(request_url):
+            return self.http.get(request_url, headers)
+
+    def _read(self, request_url: str) -> bytes:
+        if self.cache is None:
+            return self._download(request_url, {}).body
+        entry = self.cache.lookup(request_url)
+        if entry is not None and not self.refresh:
+            if entry.is_fresh():
+                return entry.body
+            if self.cache.serves_stale(entry):
+                self.cache.served_stale(entry)
+                _revalidate_later(self.cache, self.http, self.circuit_breaker,
+                                  request_url, entry)
+                return entry.body
+        try:
+            return _revalidate(self.cache, self.http, self.circuit_breaker,
+                               request_url, entry)
+        except Exception as error:
+            if entry is None or not is_outage(error) or \
+                    not self.cache.serves_stale(entry, on_error=True):
+                raise
+            logger.warning('Serving cached %s: %s', request_url, error)
+            if not entry.is_fresh():
+                self.cache.served_stale(entry)
+            return entry.body
+
+    @contextlib.contextmanager
+    def _stream(self, request_url: str) -> Iterator[BinaryIO]:
+        """
+        Opens the response for incremental reading. A fresh cached body is
+        reused, otherwise the response is streamed from upstream and (as it
+        is never held whole) not cached.
+        """
+        if self.cache is not None:
+            entry = self.cache.lookup(request_url)
+            if entry is not None and entry.is_fresh():
+                yield io.BytesIO(entry.body)
+                return
+            if entry is not None and self.cache.serves_stale(entry):
+                self.cache.served_stale(entry)
+                _revalidate_later(self.cache, self.http, self.circuit_breaker,
+                                  request_url, entry)
+                yield io.BytesIO(entry.body)
+                return
+        with self._guard(request_url), \
+                self.http.open(request_url) as (_, stream):
+            yield stream
+
+    def _limit_cache_on_match_day(self, request_url: str,
+                                  matches: Iterable[Match]) -> None:
+        if self.cache is not None and is_match_day(matches):
+            self.cache.limit_ttl(request_url, match_day_cache_ttl)
+
+    def _map(self, function: Callable[[T], R], items: Iterable[T]) -> List[R]:
+        """Applies function to all items, keeping the order of results."""
+        items = list(items)
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        # workers run in a copy of the callers context (request timings)
+        contexts = [contextvars.copy_context() for _ in items]
+        with concurrent.futures.ThreadPoolExecutor(
+                min(self.max_workers, len(items))) as executor:
+            return list(executor.map(
+                lambda context, item: context.run(function, item),
+                contexts, items))
+
+
+class CbfApiFetcher_v1(CbfApiFetcher):
+    def __init__(self, api_url: str = cbf_api_endpoint,
+                 max_workers: int = default_max_workers,
+                 cache: Optional[ResponseCache] = response_cache,
+                 http: Optional[HttpClient] = None, refresh: bool = False,
+                 single_flight: Optional[SingleFlight] = single_flight,
+                 circuit_breaker: Optional[CircuitBreaker] = circuit_breaker,
+                 local_standings: bool = False):
+        super().__init__(max_workers, cache, http, refresh, single_flight,
+                         circuit_breaker)
+        self.api_url = api_url
+        # standings of phases are derived from their schedules (see
+        # fetch_phase_standings)
+        self.local_standings = local_standings
+
+    def fetch_season_xml(self, year: int,
+                         area: Optional[int] = None) -> Optional[ElementTree.Element]:
+        """
+        Fetches the list of divisions and their phases (without schedules or
+        standings). Area is one of `areas` values, none (or 0) being the
+        default national listing.
+        """
         request_url = self.api_url + 'divs.php?s=' + str(year)
-        with urllib.request.urlopen(request_url) as response:
-            raw_xml = response.read()
+        if area:
+            request_url += '&a=' + str(area)
+        raw_xml = self._read(request_url)
         try:
-            xml = ElementTree.fromstring(raw_xml)
-            return self.parse_season(xml, year)
+            with metrics.timed('parse', parse_seconds, endpoint='divs.php'):
+                return ElementTree.fromstring(raw_xml)
         except ElementTree.ParseError:
             return None
 
+    def fetch_season(self, year: int, area: Optional[int] = None,
+                     prefetch: Iterable[str] = phase_parts) -> Optional[Season]:
+        """
+        Fetches the season with given parts of all phases prefetched, the rest
+        is loaded lazily on access (so prefetch=() fetches just the division
+        list). Phases whose prefetched parts fail are left out.
+        """
+        xml = self.fetch_season_xml(year, area)
+        if xml is None:
+            return None
+        return self.parse_season(xml, year, prefetch)
+
+    def prefetch(self, phases: Iterable[Phase],
+                 parts: Iterable[str] = phase_parts,
+                 errors: Optional[List[FetchError]] = None) -> List[Phase]:
+        """
+        Loads given parts (see phase_parts) of the phases in bulk, using the
+        worker pool. Returns the phases having all of them, reasons for the
+        others are appended to errors.
+        """
+        phases = list(phases)
+        parts = list(parts)
+        for part in parts:
+            if part not in phase_parts:
+                raise ValueError('Unknown phase part ' + repr(part))
+
+        def load(task: Tuple[Phase, str]) -> Optional[FetchError]:
+            phase, part = task
+            try:
+                loaded = getattr(phase, part) is not None
+            except (OSError, ValueError) as error:
+                return FetchError(phase.id, str(error))
+            if not loaded:
+                return FetchError(phase.id, 'Failed to fetch ' + part)
+            return None
+
+        tasks = [(phase, part) for phase in phases for part in parts
+                 if not phase.is_loaded(part)]
+        failed = set()
+        for (phase, _), error in zip(tasks, self._map(load, tasks)):
+            if error:
+                failed.add(id(phase))
+                if errors is not None:
+                    errors.append(error)
+        return [phase for phase in phases if id(phase) not in failed and
+                all(getattr(phase, part) is not None for part in parts)]
+
+    @_shared('schedule')
+    @_coalesced
     def fetch_schedule(self, phase_id: int) -> Optional[Schedule]:
         request_url = self.api_url + 'sched.php?p=' + str(phase_id)
-        with urllib.request.urlopen(request_url) as response:
-            raw_xml = response.read()
+        raw_xml = self._read(request_url)
         try:
-            xml = ElementTree.fromstring(raw_xml)
-            return self.parse_schedule(xml, phase_id)
+            with metrics.timed('parse', parse_seconds, endpoint='sched.php'):
+                schedule = Schedule(phase_id, list(
+                    self.parse_schedule_stream(io.BytesIO(raw_xml))))
         except ElementTree.ParseError:
             return None
-
+        if schedule:
+            self._limit_cache_on_match_day(request_url, schedule.matches)
+        return schedule
+
+    def fetch_schedules(self, phase_ids: Iterable[int]) -> Dict[int, Optional[Schedule]]:
+        """
+        Schedules of the phases by phase id, each distinct phase fetched once
+        (concurrently, using the worker pool).
+        """
+        phase_ids = list(dict.fromkeys(phase_ids))
+        return dict(zip(phase_ids, self._map(self.fetch_schedule, phase_ids)))
+
+    @_shared('standings')
+    @_coalesced
     def fetch_standings(self, phase_id: int) -> Optional[Standings]:
         request_url = self.api_url + 'table.php?p=' + str(phase_id)
-        with urllib.request.urlopen(request_url) as response:
-            raw_xml = response.read()
+        raw_xml = self._read(request_url)
         try:
-            xml = ElementTree.fromstring(raw_xml)
-            return self.parse_standings(xml, phase_id)
+            with metrics.timed('parse', parse_seconds, endpoint='table.php'):
+                return Standings(phase_id, list(
+                    self.parse_standings_stream(io.BytesIO(raw_xml))))
         except ElementTree.ParseError:
             return None
 
-    def parse_season(self, xml: ElementTree.Element,
-                     year: int) -> Optional[Season]:
+    def fetch_phase_standings(self, phase: Phase) -> Optional[Standings]:
+        """
+        Standings of the phase. With local_standings they are derived from
+        its schedule (see compute_standings), so crawling a phase takes just
+        sched.php. Phases with special rules (see has_local_standings) or
+        results not telling the ranking get them from table.php.
+        """
+        if self.local_standings and has_local_standings(phase):
+            schedule = phase.schedule
+            standings = compute_standings(schedule) \
+                if schedule is not None else None
+            if standings is not None:
+                return standings
+        return self.fetch_standings(phase.id)
+
+    def iter_schedule(self, phase_id: int) -> Iterator[Match]:
+        """
+        Streams the matches of the phase as they are parsed from the response,
+        without holding the whole document. Raises ElementTree.ParseError on
+        malformed response.
+        """
+        request_url = self.api_url + 'sched.php?p=' + str(phase_id)
+        with self._stream(request_url) as stream:
+            yield from self.parse_schedule_stream(stream)
+
+    def iter_standings(self, phase_id: int) -> Iterator[TeamStanding]:
+        """Streaming counterpart of fetch_standings, see iter_schedule."""
+        request_url = self.api_url + 'table.php?p=' + str(phase_id)
+        with self._stream(request_url) as stream:
+            yield from self.parse_standings_stream(stream)
+
+    def iter_season(self, year: int, area: Optional[int] = None,
+                    errors: Optional[List[FetchError]] = None,
+                    prefetch: Iterable[str] = phase_parts) -> Iterator[Division]:
+        """
+        Streams the divisions of the season, each yielded as soon as given
+        parts of its phases are fetched. Skipped parts are appended to errors.
+        """
+        prefetch = list(prefetch)
+        if errors is None:
+            errors = []
+        request_url = self.api_url + 'divs.php?s=' + str(year)
+        if area:
+            request_url += '&a=' + str(area)
+        # the listing is read whole before prefetching, its connection would
+        # otherwise hold a slot of the pool the phases are fetched through
+        with self._stream(request_url) as stream:
+            division_xmls = list(_iter_root_children(stream, 'div'))
+        for division_xml in division_xmls:
+            phases = self._parse_phases(
+                [(division_xml.findtext('name', ''), phase_xml)
+                 for phase_xml in division_xml.findall('phases/phase')],
+                errors, prefetch)
+            try:
+                yield self._build_division(division_xml, phases)
+            except ValueError as error:
+                errors.append(FetchError(
+                    None, 'Failed to parse division: ' + str(error)))
+
+    def search_teams(self, year: int, team_name: str,
+                     area: Optional[int] = None,
+                     errors: Optional[List[FetchError]] = None) \
+            -> Iterator[Tuple[Division, Phase, TeamStanding]]:
+        """
+        Streams teams of the season whose name contains team_name (see
+        find_team). Standings of the phases (of all divisions) are fetched
+        concurrently and their teams yielded as soon as they are in. Phases
+        that failed to load are appended to errors, closing the generator
+        cancels the phases not started yet.
+        """
+        if errors is None:
+            errors = []
+        season = self.fetch_season(year, area, prefetch=())
+        if season is None:
+            errors.append(FetchError(None, f'Failed to fetch season {year}'))
+            return
+        errors.extend(season.errors)
+        search_name = normalize_team_name(team_name)
+        phases = [(division, phase) for division in season.divisions
+                  for phase in division.phases]
+
+        def scan(division: Division,
+                 phase: Phase) -> List[Tuple[Division, Phase, TeamStanding]]:
+            try:
+                standings = phase.standings
+            except Exception as error:
+                if not is_outage(error):
+                    raise
+                standings = None
+            if standings is None:
+                errors.append(FetchError(phase.id, 'Failed to fetch standings'))
+                return []
+            return [(division, phase, team_standing)
+                    for team_standing in standings.team_standings
+                    if search_name in normalize_team_name(team_standing.name)]
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max(1, min(self.max_workers, len(phases))))
+        try:
+            scans = [executor.submit(contextvars.copy_context().run,
+                                     scan, division, phase)
+                     for division, phase in phases]
+            for scanned in concurrent.futures.as_completed(scans):
+                yield from scanned.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def parse_schedule_stream(self, stream: BinaryIO) -> Iterator[Match]:
+        """Incremental parse_schedule over a file-like object."""
+        for match_xml in _iter_root_children(stream, 'game'):
+            match = self.parse_match(match_xml)
+            if match:
+                yield match
+
+    def parse_standings_stream(self, stream: BinaryIO) -> Iterator[TeamStanding]:
+        """Incremental parse_standings over a file-like object."""
+        for team_standing_xml in _iter_root_children(stream, 'team'):
+            team_standing = self.parse_team_standing(team_standing_xml)
+            if team_standing:
+                yield team_standing
+
+    def parse_season(self, xml: ElementTree.Element, year: int,
+                     prefetch: Iterable[str] = phase_parts) -> Optional[Season]:
+        errors: List[FetchError] = []
+        division_xmls = xml.findall('div')
+        # phases of all divisions are prefetched at once, so the whole season
+        # shares the worker pool
+        phase_xmls = [division_xml.findall('phases/phase')
+                      for division_xml in division_xmls]
+        phases = self._parse_phases(
+            [(division_xml.findtext('name', ''), phase_xml)
+             for division_xml, division_phase_xmls
+             in zip(division_xmls, phase_xmls)
+             for phase_xml in division_phase_xmls], errors, prefetch)
         divisions = []
-        for div in xml.findall('div'):
-            parsed_division = self.parse_division(div)
-            if parsed_division is None:
-                print("Failed to parse division", file=sys.stderr)
+        offset = 0
+        for division_xml, division_phase_xmls in zip(division_xmls, phase_xmls):
+            division_phases = phases[offset:offset + len(division_phase_xmls)]
+            offset += len(division_phase_xmls)
+            try:
+                parsed_division = self._build_division(
+                    division_xml, division_phases)
+            except ValueError as error:
+                errors.append(FetchError(
+                    None, 'Failed to parse division: ' + str(error)))
                 continue
             divisions.append(parsed_division)
-        return Season(year, divisions)
+        return Season(year, divisions, errors)
 
-    def parse_phase(self, xml: ElementTree.Element) -> Optional[Phase]:
+    def parse_phase(self, xml: ElementTree.Element,
+                    division_name: str = '') -> Optional[Phase]:
+        """Phase loading its schedule and standings on demand."""
         phase_id = int(xml.findtext('id', ''))
         phase_name = xml.findtext('name', '')
-
-        schedule = self.fetch_schedule(phase_id)
-        if not schedule:
-            return None
-
-        standings = self.fetch_standings(phase_id)
-        if not standings:
-            return None
-
-        return Phase(phase_id, phase_name, schedule, standings)
-
-    def parse_division(self, xml: ElementTree.Element) -> Optional[Division]:
+        return Phase(phase_id, phase_name, fetcher=self,
+                     division_name=division_name)
+
+    def _parse_phases(self,
+                      phase_xmls: List[Tuple[str, ElementTree.Element]],
+                      errors: List[FetchError],
+                      prefetch: Iterable[str] = phase_parts) -> List[Optional[Phase]]:
+        """
+        Parses given phases (with the names of their divisions) and
+        prefetches their parts using the worker pool. Phases that fail are
+        None in the result and the reason is appended to errors.
+        """
+        phases: List[Optional[Phase]] = []
+        for division_name, phase_xml in phase_xmls:
+            try:
+                phases.append(self.parse_phase(phase_xml, division_name))
+            except ValueError as error:
+                errors.append(FetchError(
+                    None, 'Failed to parse phase: ' + str(error)))
+                phases.append(None)
+        loaded = {id(phase) for phase in self.prefetch(
+            [phase for phase in phases if phase], prefetch, errors)}
+        return [phase if id(phase) in loaded else None for phase in phases]
+
+    def _build_division(self, xml: ElementTree.Element,
+                        phases: List[Optional[Phase]]) -> Division:
         division_id = int(xml.findtext('id', ''))
         division_name = xml.findtext('name', '')
-        phases = []
-        for phase_xml in xml.findall('phases/phase'):
-            phase = self.parse_phase(phase_xml)
-            if not phase:
-                continue
-            phases.append(phase)
-        return Division(division_id, division_name, phases)
+        return Division(division_id, division_name,
+                        [phase for phase in phases if phase])
+
+    def parse_division(self, xml: ElementTree.Element,
+                       errors: Optional[List[FetchError]] = None,
+                       prefetch: Iterable[str] = phase_parts) -> Optional[Division]:
+        phases = self._parse_phases(
+            [(xml.findtext('name', ''), phase_xml)
+             for phase_xml in xml.findall('phases/phase')],
+            errors if errors is not None else [], prefetch)
+        return self._build_division(xml, phases)
 
     def parse_schedule(self, xml: ElementTree.Element,
                        phase_id: int) -> Optional[Schedule]:
@@ -259,82 +1805,141 @@ class CbfApiFetcher_v1:
                             games_played, games_won, games_lost,
                             points_scored, points_allowed, points)
 
+    # the match parsing below walks the children of each element once
+    # (instead of a findtext lookup per field), giving the same results
+
     def parse_team(self, xml: ElementTree.Element) -> Optional[Team]:
-        team_id = int(xml.findtext('id', ''))
-        team_name = xml.findtext('name', '')
-        abbr = xml.findtext('abbr', '')
-        return Team(team_id, team_name, abbr)
+        texts = _child_texts(xml)
+        return self.intern(Team(int(texts.get('id', '')),
+                                texts.get('name', ''), texts.get('abbr', '')))
 
     def parse_match_result(self, xml: ElementTree.Element) -> Optional[Match.Result]:
-        pts = (int(xml.findtext('pts/a', '')), int(xml.findtext('pts/b', '')))
-        score = (int(xml.findtext('score/a', '')),
-                 int(xml.findtext('score/b', '')))
+        # texts of (first) a and b within all the pts and score elements
+        pairs: Dict[str, Dict[str, str]] = {'pts': {}, 'score': {}}
         partials = dict()
-        for partial in xml.findall('partials/partial'):
-            partials[partial.get('ord', '')] = (
-                int(partial.findtext('a', '')),
-                int(partial.findtext('b', ''))
-            )
-        url_live = xml.findtext('urllive', '')
-        return Match.Result(pts, score, partials, url_live)
+        url_live = None
+        for child in xml:
+            tag = child.tag
+            if tag in pairs:
+                texts = pairs[tag]
+                for value in child:
+                    if value.tag not in texts:
+                        texts[value.tag] = value.text or ''
+            elif tag == 'partials':
+                for partial in child:
+                    if partial.tag == 'partial':
+                        texts = _child_texts(partial)
+                        partials[partial.get('ord', '')] = (
+                            int(texts.get('a', '')), int(texts.get('b', '')))
+            elif tag == 'urllive' and url_live is None:
+                url_live = child.text or ''
+        pts, score = pairs['pts'], pairs['score']
+        return Match.Result((int(pts.get('a', '')), int(pts.get('b', ''))),
+                            (int(score.get('a', '')), int(score.get('b', ''))),
+                            tuple(partials.items()),
+                            url_live or '')
 
     def parse_referee(self, xml: ElementTree.Element) -> Optional[Referee]:
-        ref_id: int = int(xml.findtext('id', ''))
-        first_name: str = xml.findtext('firstname', '')
-        last_name: str = xml.findtext('lastname', '')
-        return Referee(ref_id, first_name, last_name)
+        texts = _child_texts(xml)
+        return self.intern(Referee(int(texts.get('id', '')),
+                                   texts.get('firstname', ''),
+                                   texts.get('lastname', '')))
 
     def parse_match(self, xml: ElementTree.Element) -> Optional[Match]:
-        match_id = int(xml.findtext('id', ''))
-        gdate = xml.findtext('gdate', '')
-        gtime = xml.findtext('gtime', '')
-        start = None
-        if gdate and gtime and gdate != '0000-00-00':
-            cz = pytz.timezone("Europe/Prague")
-            start = cz.localize(datetime.strptime(gdate + ' ' + gtime,
-                                                  '%Y-%m-%d %H:%M:%S'))
+        texts: Dict[str, str] = {}
+        ref_elems = []
+        supervisor_elem = home_team_element = visiting_team_element = None
+        result_elem = None
+        for child in xml:
+            tag = child.tag
+            if tag == 'ref':
+                ref_elems.append(child)
+            elif tag == 'team':
+                guest = child.get('guest')
+                if guest == '0' and home_team_element is None:
+                    home_team_element = child
+                elif guest == '1' and visiting_team_element is None:
+                    visiting_team_element = child
+            elif tag == 'sup':
+                if supervisor_elem is None:
+                    supervisor_elem = child
+            elif tag == 'result':
+                if result_elem is None:
+                    result_elem = child
+            elif tag not in texts:
+                texts[tag] = child.text or ''
+
+        match_id = int(texts.get('id', ''))
+        start = _parse_start(texts.get('gdate', ''), texts.get('gtime', ''))
         if not start:
             return None
-        place = xml.findtext('place', '')
-        city = xml.findtext('city', '')
-        refs = []
-        for ref_elem in xml.findall('ref'):
-            ref = self.parse_referee(ref_elem)
-            if not ref:
-                continue
-            refs.append(ref)
+        refs = tuple(self.parse_referee(ref_elem) for ref_elem in ref_elems)
+        # elements without children hold no data
         supervisor = None
-        supervisor_elem = xml.find('sup')
-        if supervisor_elem:
+        if supervisor_elem is not None and len(supervisor_elem):
             supervisor = self.parse_referee(supervisor_elem)
-        home_team_element = xml.find('team[@guest="0"]')
-        if not home_team_element:
+        if home_team_element is None or not len(home_team_element):
             return None
         home_team = self.parse_team(home_team_element)
-        if not home_team:
-            return None
-
-        visiting_team_element = xml.find('team[@guest="1"]')
-        if not visiting_team_element:
+        if visiting_team_element is None or not len(visiting_team_element):
             return None
         visiting_team = self.parse_team(visiting_team_element)
-        if not visiting_team:
-            return None
-
-        result = None
-        result_elem = xml.find('result')
-        if not result_elem:
+        if result_elem is None or not len(result_elem):
             return None
         result = self.parse_match_result(result_elem)
-        return Match(match_id, home_team, visiting_team,
-                     start, Match.Location(place, city),
-                     refs, supervisor,
-                     result)
+        return Match(match_id, home_team, visiting_team, start,
+                     self.intern(Match.Location(texts.get('place', ''),
+                                                texts.get('city', ''))),
+                     refs, supervisor, result)
 
 
-class CbfApiFetcher_v2:
-    def __init__(self):
-        pass
+def _iter_root_children(stream: BinaryIO,
+                        tag: str) -> Iterator[ElementTree.Element]:
+    """
+    Yields the complete children of the document root with given tag while
+    the document is being parsed. Every child is dropped once processed, so
+    only one of them is held at a time.
+    """
+    root = None
+    depth = 0
+    for event, element in ElementTree.iterparse(stream, ('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if element.tag == tag:
+                yield element
+            root.clear()
+
+
+class CbfApiFetcher_v2(CbfApiFetcher):
+    # gameInfo fields read by parse_match, match rows of team.php that have
+    # all of them are parsed directly instead of fetching game.php
+    game_info_fields = (
+        'IDgame', 'gdate', 'gtime',
+        'u1id', 'u1n1', 'u1n2', 'u2id', 'u2n1', 'u2n2', 'u3id', 'u3n1', 'u3n2',
+        'commisarid', 'commisarn1', 'commisarn2',
+        'url_live', 'points_home', 'points_guest', 'score_home', 'score_guest',
+        'score_quarter',
+        'taidteam', 'taname', 'taabbr', 'tbidteam', 'tbname', 'tbabbr',
+        'place', 'city', 'lat', 'lon',
+    )
+    # (id, first name, last name) fields of the referees
+    referee_fields = (('u1id', 'u1n1', 'u1n2'), ('u2id', 'u2n1', 'u2n2'),
+                      ('u3id', 'u3n1', 'u3n2'))
+
+    def __init__(self, api_url: str = cbf_api_v2_endpoint,
+                 max_workers: int = default_max_workers,
+                 cache: Optional[ResponseCache] = response_cache,
+                 http: Optional[HttpClient] = None, refresh: bool = False,
+                 single_flight: Optional[SingleFlight] = single_flight,
+                 circuit_breaker: Optional[CircuitBreaker] = circuit_breaker):
+        super().__init__(max_workers, cache, http, refresh, single_flight,
+                         circuit_breaker)
+        self.api_url = api_url
 
     def parse_match(self, match: dict) -> Optional[Match]:
         if not isinstance(match, dict):
@@ -344,62 +1949,30 @@ class CbfApiFetcher_v2:
         if not isinstance(match_game_info, dict):
             return None
 
-        gdate = match_game_info['gdate']
-        gtime = match_game_info['gtime']
-        start = None
-        if gdate and gtime and gdate != '0000-00-00':
-            cz = pytz.timezone("Europe/Prague")
-            start = cz.localize(
-                datetime.strptime(
-                    gdate + ' ' + gtime,
-                    '%Y-%m-%d %H:%M:%S'
-                )).astimezone(pytz.utc)
+        start = _parse_start(match_game_info['gdate'],
+                             match_game_info['gtime'])
         if not start:
             return None
+        start = start.astimezone(pytz.utc)
 
-        refs = list[Referee]()
-        if match_game_info['u1id'] is not None and \
-                match_game_info['u1n1'] is not None and \
-                match_game_info['u1n2'] is not None:
-            refs.append(
-                Referee(
-                    match_game_info['u1id'],
-                    match_game_info['u1n1'],
-                    match_game_info['u1n2']
-                )
-            )
-
-        if match_game_info['u2id'] is not None and \
-                match_game_info['u2n1'] is not None and \
-                match_game_info['u2n2'] is not None:
-            refs.append(
-                Referee(
-                    match_game_info['u2id'],
-                    match_game_info['u2n1'],
-                    match_game_info['u2n2']
-                )
-            )
-
-        if match_game_info['u3id'] is not None and \
-                match_game_info['u3n1'] is not None and \
-                match_game_info['u3n2'] is not None:
-            refs.append(
-                Referee(
-                    match_game_info['u3id'],
-                    match_game_info['u3n1'],
-                    match_game_info['u3n2']
-                )
-            )
+        refs = []
+        for ref_id, first_name, last_name in self.referee_fields:
+            if match_game_info[ref_id] is not None and \
+                    match_game_info[first_name] is not None and \
+                    match_game_info[last_name] is not None:
+                refs.append(self.intern(Referee(match_game_info[ref_id],
+                                                match_game_info[first_name],
+                                                match_game_info[last_name])))
 
         commisar: Optional[Referee] = None
         if match_game_info['commisarid'] is not None and \
                 match_game_info['commisarn1'] is not None and \
                 match_game_info['commisarn2'] is not None:
-            commisar = Referee(
+            commisar = self.intern(Referee(
                 match_game_info['commisarid'],
                 match_game_info['commisarn1'],
                 match_game_info['commisarn2']
-            )
+            ))
 
         match_result: Optional[Match.Result] = None
         live_url: Optional[str] = match_game_info['url_live']
@@ -424,87 +1997,139 @@ class CbfApiFetcher_v2:
                     match_game_info['score_home'],
                     match_game_info['score_guest']
                 ),
-                partials,
+                tuple(partials.items()),
                 "" if live_url is None else live_url
             )
 
         return Match(
             match_game_info['IDgame'],
-            Team(int(match_game_info['taidteam']),
-                 match_game_info['taname'],
-                 match_game_info['taabbr']),
-            Team(int(match_game_info['tbidteam']),
-                 match_game_info['tbname'],
-                 match_game_info['tbabbr']),
+            self.intern(Team(int(match_game_info['taidteam']),
+                             match_game_info['taname'],
+                             match_game_info['taabbr'])),
+            self.intern(Team(int(match_game_info['tbidteam']),
+                             match_game_info['tbname'],
+                             match_game_info['tbabbr'])),
             start,
-            Match.Location(
+            self.intern(Match.Location(
                 match_game_info['place'],
                 match_game_info['city'],
                 (match_game_info['lat'], match_game_info['lon'])
-            ),
-            refs,
+            )),
+            tuple(refs),
             commisar,  # Supervisor
             match_result
         )
 
+    @_shared('match')
+    @_coalesced
     def fetch_match(self, match_id: int) -> Optional[Match]:
-        with urllib.request.urlopen(
-                'https://cbf.cz/xml/api/game.php?json=1&game=' + str(match_id)
-        ) as reponse:
-            raw_json = reponse.read()
-        try:
-            match = json.loads(raw_json)
-        except json.JSONDecodeError:
+        request_url = self.api_url + 'game.php?json=1&game=' + str(match_id)
+        raw_json = self._read(request_url)
+        with metrics.timed('parse', parse_seconds, endpoint='game.php'):
+            try:
+                match = json.loads(raw_json)
+            except json.JSONDecodeError:
+                return None
+            parsed_match = self.parse_match(match)
+        if parsed_match:
+            self._limit_cache_on_match_day(request_url, [parsed_match])
+        return parsed_match
+
+    @_coalesced
+    def fetch_team_schedule_for_competition(self, team_id: int, comp_id: int) -> Optional[List[Match]]:
+        listed_games = self.fetch_team_listing(team_id, comp_id)
+        if listed_games is None:
             return None
-        return self.parse_match(match)
 
-    def fetch_team_schedule_for_competition(self, team_id: int, comp_id: int) -> Optional[List[Match]]:
-        with urllib.request.urlopen(
-            f'https://cbf.cz/xml/api/team.php?json=1&id={
-                team_id}&competition={comp_id}'
-        ) as response:
-            raw_json = response.read()
+        def load_match(game_id) -> Optional[Match]:
+            listed_game = listed_games[game_id]
+            if self.is_complete_listing(listed_game):
+                return self.parse_listed_match(listed_game)
+            return self.fetch_match(game_id)
+
+        return [match for match in self._map(load_match, listed_games) if match]
+
+    def fetch_team_listing(self, team_id: int,
+                           comp_id: int) -> Optional[Dict[int, dict]]:
+        """The team.php listing rows by game id, see listed_games."""
+        raw_json = self._read(
+            self.api_url + 'team.php?json=1&id=' + str(team_id) +
+            '&competition=' + str(comp_id))
         try:
-            team_info = json.loads(raw_json)
+            with metrics.timed('parse', parse_seconds, endpoint='team.php'):
+                team_info = json.loads(raw_json)
         except json.JSONDecodeError:
             return None
-        matches: list[Match] = []
+        return self.listed_games(team_info, team_id)
+
+    def parse_listed_match(self, listed_game: dict) -> Optional[Match]:
+        """Match of a complete (see is_complete_listing) listing row."""
+        with metrics.timed('parse', parse_seconds, endpoint='team.php'):
+            return self.parse_match({'gameInfo': [listed_game]})
+
+    @staticmethod
+    def listed_games(team_info: dict, team_id: int) -> Dict[int, dict]:
+        """Rows of the team.php listing by game id, in order, each game once."""
+        listed_games: dict = {}
         for match in team_info['match']:
             idTeam = match['IDteam']
             if (idTeam is not None and int(match['IDteam']) != team_id):
                 continue
-            parsed_match = self.fetch_match(match['gid'])
-            if (parsed_match):
-                matches.append(parsed_match)
-        return matches
-
-
-def fetch_season_list() -> list[SeasonDescription]:
-    with urllib.request.urlopen(
-        'http://cbf.cz/xml/api/seasonList.php'
-    ) as response:
-        raw_xml = response.read()
-    season_descriptions: list[SeasonDescription] = []
+            listed_games.setdefault(match['gid'], match)
+        return listed_games
+
+    def is_complete_listing(self, listed_game: dict) -> bool:
+        """Whether the listing row can be parsed without fetching game.php."""
+        return all(field in listed_game for field in self.game_info_fields)
+
+
+def fetch_season_list(cache: Optional[ResponseCache] = response_cache,
+                      http: Optional[HttpClient] = None) -> list[SeasonDescription]:
+    request_url = cbf_api_v2_endpoint + 'seasonList.php'
+    if shared_cache is not None:
+        season_descriptions = shared_cache.get('season_list', request_url)
+        if season_descriptions is not None:
+            return season_descriptions
+    raw_xml = CbfApiFetcher(cache=cache, http=http)._read(request_url)
+    season_descriptions = []
     try:
-        xml = ElementTree.fromstring(raw_xml)
+        with metrics.timed('parse', parse_seconds, endpoint='seasonList.php'):
+            xml = ElementTree.fromstring(raw_xml)
         for season_description in xml.findall('season'):
             season_descriptions.append(
                 SeasonDescription.from_xml(season_description))
     except ElementTree.ParseError:
         pass
+    if season_descriptions and shared_cache is not None:
+        shared_cache.put('season_list', request_url, season_descriptions)
     return season_descriptions
 
 
+def normalize_team_name(name: str) -> str:
+    """
+    Name used for searching - case and diacritics insensitive
+    ('Sokol Třebíč' -> 'sokol trebic').
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed
+                       if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
 def find_team(year: int, team_name: str) -> List[Tuple[int, int]]:
-    lower_team_name = team_name.lower()
+    """
+    Crawls the season and returns (phase id, team id) of all teams whose name
+    contains team_name. See team_index for the cached variant.
+    """
+    search_name = normalize_team_name(team_name)
     team_id_and_phases: List[Tuple[int, int]] = []
     fetcher = CbfApiFetcher_v1(cbf_api_endpoint)
-    season = fetcher.fetch_season(year)
+    season = fetcher.fetch_season(year, prefetch=('standings',))
     if not season:
         return []
     for division in season.divisions:
         for phase in division.phases:
             for team_standing in phase.standings.team_standings:
-                if team_standing.name.lower() == lower_team_name:
+                if search_name in normalize_team_name(team_standing.name):
                     team_id_and_phases.append((phase.id, team_standing.id))
     return team_id_and_phases
@@ -1,76 +1,205 @@
 #!/usr/bin/env python3
 
+import asyncio
+import collections
 import distutils.util
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.error
 from datetime import datetime, timedelta
-from flask import Flask, Response, request, url_for, redirect, render_template
+from typing import Collection, Dict, Iterator, List, Optional, Set, Tuple
+from flask import Flask, Response, request, url_for, redirect, \
+    render_template, g, abort, stream_with_context
 import icalendar
 import Cbf
+import cbf_async
+import metrics
+import referee_index
+import shared_cache
+import snapshot
+import team_index
+from refresh_scheduler import RefreshScheduler
 
 app = Flask(__name__)
+# keep the most polled calendars warm from a background thread
+app.config.setdefault('REFRESH_SCHEDULER', True)
+# most (phase, team) pairs a club calendar can combine
+app.config.setdefault('MAX_CLUB_TEAMS', 64)
+# seconds the calendar routes wait for upstream data, None for no limit
+app.config.setdefault('UPSTREAM_DEADLINE', 30)
+# serve calendars, team search and season list from this snapshot (see
+# snapshot.py) without calling upstream at all
+app.config.setdefault('SNAPSHOT_PATH', os.environ.get('CBF_SNAPSHOT'))
+# share parsed upstream data with the other processes of the app through
+# this file (see shared_cache.py), e.g. with several mod_wsgi processes
+app.config.setdefault('SHARED_CACHE_PATH', os.environ.get('CBF_SHARED_CACHE'))
+if app.config['SHARED_CACHE_PATH']:
+    # installed once for all fetchers of the process, threads included
+    Cbf.shared_cache = shared_cache.SharedCache(
+        app.config['SHARED_CACHE_PATH'])
 
+request_seconds = metrics.registry.histogram(
+    'cbf_request_duration_seconds', 'Latency of the app routes', ['route'])
+requests_in_flight = metrics.registry.gauge(
+    'cbf_requests_in_flight', 'Requests being handled by the app')
+render_seconds = metrics.registry.histogram(
+    'cbf_calendar_render_duration_seconds',
+    'Time spent rendering (serializing) calendars', ['route'])
+calendar_cache_lookups = metrics.registry.counter(
+    'cbf_calendar_cache_lookups_total',
+    'Rendered calendar lookups, result being hit or miss', ['route', 'result'])
 
-@app.route('/cbf/ical/<int:phase_id>/<int:team_id>')
-@app.route('/cbf/ical/<int:phase_id>/<int:team_id>.ics')
-def get_matches(phase_id: int, team_id: int):
-    use_emoji = request.args.get(
-        'use-emoji', True, type=distutils.util.strtobool)
-    calendar_name = request.args.get('calendar-name', 'ČBF - rozpis zápasů')
-    calendar = icalendar.Calendar()
-    calendar['version'] = '2.0'
-    calendar['prodid'] = '-//CBF//NONSGML//EN'
-    calendar.add('X-WR-CALNAME', calendar_name)
-    fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint)
-    schedule = fetcher.fetch_schedule(phase_id)
-    if not schedule:
-        return ''
-    for match in schedule.matches:
-        if match.home_team.id == team_id or match.visiting_team.id == team_id:
-            event = icalendar.Event()
-            event['uid'] = str(match.id)
-            event.add('dtstart', match.start)
-            event.add('duration', timedelta(hours=1, minutes=30))
-            event.add('dtstamp', datetime.utcnow())
-            if match.home_team.id == team_id:
-                # home match
-                summary = "vs. " + match.visiting_team.abbr
-            else:
-                # away/road game
-                summary = " @  " + match.home_team.abbr
-            event.add('summary', ('🏀' + ' ' if use_emoji else '') + summary)
-            event.add('location', match.location.place +
-                      ', ' + match.location.city)
-            description = match.home_team.name + ' vs. ' + match.visiting_team.name
-            if match.result and match.result.score != (0, 0):
-                description += ' (' + str(match.result.score[0]) + ':' + str(
-                    match.result.score[1]) + ')'
-            event.add('description', description)
-            calendar.add_component(event)
-    r = Response(response=calendar.to_ical(), status=200,
-                 content_type='text/calendar; charset=utf-8')
-    return r
 
+@app.before_request
+def start_request_timing():
+    requests_in_flight.inc()
+    g.timings, g.timings_token = metrics.start_timings()
+    g.staleness, g.staleness_token = Cbf.start_staleness_tracking()
 
-@app.route('/cbf/ical/v2/<int:phase_id>/<int:team_id>')
-@app.route('/cbf/ical/v2/<int:phase_id>/<int:team_id>.ics')
-def get_matches_v2(phase_id: int, team_id: int):
-    use_emoji = request.args.get(
-        'use-emoji', True, type=distutils.util.strtobool)
-    calendar_name = request.args.get('calendar-name', 'ČBF - rozpis zápasů')
+
+@app.after_request
+def add_server_timing(response: Response) -> Response:
+    timings = g.get('timings')
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing()
+        request_seconds.observe(time.perf_counter() - timings.started,
+                                route=request.endpoint or 'unmatched')
+    staleness = g.get('staleness')
+    if staleness is not None and staleness.age is not None:
+        # served from cached data upstream failed (or was slow) to refresh
+        response.headers['Age'] = str(int(staleness.age))
+        response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
+
+
+@app.teardown_request
+def stop_request_timing(exception: Optional[BaseException]) -> None:
+    # called once more when a streamed (stream_with_context) response ends
+    if 'timings_token' not in g:
+        return
+    requests_in_flight.dec()
+    metrics.stop_timings(g.pop('timings_token'))
+    Cbf.stop_staleness_tracking(g.pop('staleness_token'))
+
+
+def _upstream_unavailable() -> Response:
+    """
+    Answer when there is no (even stale) data to serve - an empty calendar
+    would make the clients delete all events.
+    """
+    response = Response('ČBF is not available, try again later', status=503,
+                        content_type='text/plain; charset=utf-8')
+    response.headers['Retry-After'] = str(
+        int(Cbf.circuit_breaker.reset_timeout))
+    return response
+
+
+@app.errorhandler(OSError)
+@app.errorhandler(http.client.HTTPException)
+def upstream_failed(error: Exception) -> Response:
+    if Cbf.is_outage(error):
+        # network errors, timeouts, 5xx answers and open circuits of upstream
+        app.logger.warning('Upstream failed: %r', error)
+        return _upstream_unavailable()
+    if isinstance(error, urllib.error.HTTPError):
+        # upstream does not know the requested phase, team or game
+        app.logger.info('Upstream refused: %r', error)
+        return Response('Not found in ČBF', status=404,
+                        content_type='text/plain; charset=utf-8')
+    # local files and the like, not a matter of ČBF
+    app.logger.error('Request failed', exc_info=error)
+    return Response('Internal server error', status=500,
+                    content_type='text/plain; charset=utf-8')
+
+
+class RenderedCalendar:
+    def __init__(self, fingerprint: str, body: bytes, etag: str):
+        self.fingerprint = fingerprint
+        self.body = body
+        self.etag = etag
+
+
+class CalendarCache:
+    """
+    Serialized calendars by (route, calendar id, use-emoji, calendar-name),
+    least recently used ones are dropped above max_entries.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._calendars: collections.OrderedDict[tuple, RenderedCalendar] = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[RenderedCalendar]:
+        with self._lock:
+            calendar = self._calendars.get(key)
+            if calendar is not None:
+                self._calendars.move_to_end(key)
+            return calendar
+
+    def put(self, key: tuple, calendar: RenderedCalendar) -> None:
+        with self._lock:
+            self._calendars[key] = calendar
+            self._calendars.move_to_end(key)
+            while len(self._calendars) > self.max_entries:
+                self._calendars.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._calendars.clear()
+
+
+calendar_cache = CalendarCache()
+
+
+def _matches_fingerprint(matches: List[Cbf.Match]) -> str:
+    """Hash of everything from the matches that ends up in the calendar."""
+    digest = hashlib.sha256()
+    for match in matches:
+        digest.update(repr((
+            match.id,
+            match.start.isoformat(),
+            match.home_team.id, match.home_team.name, match.home_team.abbr,
+            match.visiting_team.id, match.visiting_team.name,
+            match.visiting_team.abbr,
+            match.location.place, match.location.city,
+            match.location.coordinates,
+            match.result.score if match.result else None,
+        )).encode())
+    return digest.hexdigest()
+
+
+def _calendar_etag(body: bytes) -> str:
+    """Content hash of the calendar, leaving out the volatile DTSTAMPs."""
+    digest = hashlib.sha256()
+    for line in body.splitlines():
+        if not line.startswith(b'DTSTAMP'):
+            digest.update(line)
+    return digest.hexdigest()
+
+
+def _build_calendar(matches: List[Cbf.Match], team_ids: Collection[int],
+                    use_emoji: bool, calendar_name: str) -> icalendar.Calendar:
     calendar = icalendar.Calendar()
     calendar['version'] = '2.0'
     calendar['prodid'] = '-//CBF//NONSGML//EN'
     calendar.add('X-WR-CALNAME', calendar_name)
-    fetcher = Cbf.CbfApiFetcher_v2()
-    matches = fetcher.fetch_team_schedule_for_competition(team_id, phase_id)
-    if not matches:
-        return ''
     for match in matches:
         event = icalendar.Event()
         event['uid'] = str(match.id)
         event.add('dtstart', match.start)
         event.add('duration', timedelta(hours=1, minutes=30))
         event.add('dtstamp', datetime.utcnow())
-        if match.home_team.id == team_id:
+        if not team_ids:
+            # neutral (e.g. referee) calendar
+            summary = match.home_team.abbr + " vs. " + \
+                match.visiting_team.abbr
+        elif match.home_team.id in team_ids:
             # home match
             summary = "vs. " + match.visiting_team.abbr
         else:
@@ -79,12 +208,11 @@ def get_matches_v2(phase_id: int, team_id: int):
         event.add('summary', ('🏀' + ' ' if use_emoji else '') + summary)
         location = match.location.place + ', ' + match.location.city
         if (match.location.coordinates is not None):
-            event.add('geo',
-                      (match.location.coordinates[0], match.location.coordinates[1]))
+            latitude, longitude = match.location.coordinates
+            event.add('geo', (latitude, longitude))
             event.add(
                 "X-APPLE-STRUCTURED-LOCATION",
-                f"geo:{match.location.coordinates[0]},{
-                    match.location.coordinates[1]}",
+                f"geo:{latitude},{longitude}",
                 parameters={
                     "VALUE": "URI",
                     "X-ADDRESS": location,
@@ -97,16 +225,354 @@ def get_matches_v2(phase_id: int, team_id: int):
                 match.result.score[1]) + ')'
         event.add('description', description)
         calendar.add_component(event)
-    r = Response(response=calendar.to_ical(), status=200,
+    return calendar
+
+
+def _calendar_response(route: str, calendar_id: tuple,
+                       team_ids: Collection[int],
+                       matches: List[Cbf.Match]) -> Response:
+    """
+    Calendar of given matches (from the point of view of given teams),
+    rendered again only when the matches changed, so that unchanged
+    calendars keep their body and ETag.
+    """
+    use_emoji = request.args.get(
+        'use-emoji', True, type=distutils.util.strtobool)
+    calendar_name = request.args.get('calendar-name', 'ČBF - rozpis zápasů')
+    key = (route, calendar_id, bool(use_emoji), calendar_name)
+    fingerprint = _matches_fingerprint(matches)
+    rendered = calendar_cache.get(key)
+    if rendered is None or rendered.fingerprint != fingerprint:
+        calendar_cache_lookups.inc(route=route, result='miss')
+        with metrics.timed('render', render_seconds, route=route):
+            body = _build_calendar(matches, team_ids, use_emoji,
+                                   calendar_name).to_ical()
+        rendered = RenderedCalendar(fingerprint, body, _calendar_etag(body))
+        calendar_cache.put(key, rendered)
+    else:
+        calendar_cache_lookups.inc(route=route, result='hit')
+    r = Response(response=rendered.body, status=200,
                  content_type='text/calendar; charset=utf-8')
-    return r
+    r.set_etag(rendered.etag)
+    return r.make_conditional(request)
+
+
+def _team_matches(schedule: Optional[Cbf.Schedule],
+                  team_ids: Collection[int]) -> Optional[List[Cbf.Match]]:
+    if not schedule:
+        return None
+    return [match for match in schedule.matches
+            if match.home_team.id in team_ids or
+            match.visiting_team.id in team_ids]
+
+
+_snapshot_stores: Dict[str, snapshot.SnapshotStore] = {}
+
+
+def _snapshot_store() -> Optional[snapshot.SnapshotStore]:
+    """The snapshot served instead of upstream, None unless in snapshot mode."""
+    path = app.config['SNAPSHOT_PATH']
+    if not path:
+        return None
+    store = _snapshot_stores.get(path)
+    if store is None:
+        store = _snapshot_stores.setdefault(path, snapshot.SnapshotStore(path))
+    return store
+
+
+def _snapshot_schedule(phase_id: int) -> Optional[Cbf.Schedule]:
+    """Schedule of the phase (empty if not in the snapshot), None if no snapshot."""
+    current = _snapshot_store().current()
+    if current is None:
+        return None
+    return current.schedule(phase_id) or Cbf.Schedule(phase_id, [])
+
+
+# the routes load the matches asynchronously on the upstream loop of the
+# process (sharing its connections), the refresh scheduler (running in its
+# own thread) with the synchronous fetchers
+
+def _load_matches(phase_id: int, team_id: Optional[int],
+                  refresh: bool = False) -> Optional[List[Cbf.Match]]:
+    """Matches of the team, or of the whole phase for team_id None."""
+    fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint, refresh=refresh)
+    schedule = fetcher.fetch_schedule(phase_id)
+    if team_id is None:
+        return schedule.matches if schedule else None
+    return _team_matches(schedule, {team_id})
+
+
+def _load_matches_v2(phase_id: int, team_id: int,
+                     refresh: bool = False) -> Optional[List[Cbf.Match]]:
+    fetcher = Cbf.CbfApiFetcher_v2(Cbf.cbf_api_v2_endpoint, refresh=refresh)
+    return fetcher.fetch_team_schedule_for_competition(team_id, phase_id)
+
+
+async def _load_matches_async(phase_id: int,
+                              team_id: int) -> Optional[List[Cbf.Match]]:
+    if _snapshot_store() is not None:
+        return _team_matches(_snapshot_schedule(phase_id), {team_id})
+
+    async def load() -> Optional[Cbf.Schedule]:
+        async with cbf_async.AsyncCbfApiFetcher_v1(
+                Cbf.cbf_api_endpoint) as fetcher:
+            return await fetcher.fetch_schedule(
+                phase_id, deadline=app.config['UPSTREAM_DEADLINE'])
+
+    return _team_matches(await cbf_async.upstream_loop.run(load()), {team_id})
+
+
+async def _load_matches_v2_async(phase_id: int,
+                                 team_id: int) -> Optional[List[Cbf.Match]]:
+    if _snapshot_store() is not None:
+        # the competition of v2 is the phase of v1
+        return _team_matches(_snapshot_schedule(phase_id), {team_id})
+
+    async def load() -> Optional[List[Cbf.Match]]:
+        async with cbf_async.AsyncCbfApiFetcher_v2(
+                Cbf.cbf_api_v2_endpoint) as fetcher:
+            return await fetcher.fetch_team_schedule_for_competition(
+                team_id, phase_id, deadline=app.config['UPSTREAM_DEADLINE'])
+
+    return await cbf_async.upstream_loop.run(load())
+
+
+async def _load_club_matches(
+        teams: List[Tuple[int, int]]) -> Optional[List[Cbf.Match]]:
+    """
+    Matches of all given (phase id, team id) pairs, ordered by start. Every
+    phase schedule is fetched once, matches of teams playing each other are
+    listed once.
+    """
+    team_ids_by_phase: Dict[int, Set[int]] = collections.defaultdict(set)
+    for phase_id, team_id in teams:
+        team_ids_by_phase[phase_id].add(team_id)
+    if _snapshot_store() is not None:
+        schedules = {phase_id: _snapshot_schedule(phase_id)
+                     for phase_id in team_ids_by_phase}
+    else:
+        async def load() -> Dict[int, Optional[Cbf.Schedule]]:
+            async with cbf_async.AsyncCbfApiFetcher_v1(
+                    Cbf.cbf_api_endpoint) as fetcher:
+                async with asyncio.timeout(app.config['UPSTREAM_DEADLINE']):
+                    return await fetcher.fetch_schedules(team_ids_by_phase)
+
+        schedules = await cbf_async.upstream_loop.run(load())
+    if not any(schedules.values()):
+        return None
+    matches: Dict[int, Cbf.Match] = {}
+    for phase_id, schedule in schedules.items():
+        for match in _team_matches(schedule, team_ids_by_phase[phase_id]) or []:
+            matches.setdefault(match.id, match)
+    return sorted(matches.values(), key=lambda match: match.start)
+
+
+def _club_teams() -> List[Tuple[int, int]]:
+    """
+    (phase id, team id) pairs of a club calendar, given as teams=phase:team
+    (comma separated or repeated) and/or club (name) and year to look up in
+    the team index.
+    """
+    teams = []
+    for value in request.args.getlist('teams'):
+        for pair in value.split(','):
+            phase_id, _, team_id = pair.partition(':')
+            if not phase_id.strip().isdigit() or not team_id.strip().isdigit():
+                abort(400, f'Invalid team {pair!r}, expected phase_id:team_id')
+            teams.append((int(phase_id), int(team_id)))
+    club = request.args.get('club')
+    if club:
+        year = request.args.get('year', type=int)
+        if year is None:
+            abort(400, 'Searching teams of a club needs the year')
+        teams.extend(_find_team(year, club))
+    teams = list(dict.fromkeys(teams))
+    if len(teams) > app.config['MAX_CLUB_TEAMS']:
+        abort(400, f"At most {app.config['MAX_CLUB_TEAMS']} teams are allowed")
+    return teams
+
+
+refresh_scheduler = RefreshScheduler({
+    'v1': _load_matches,
+    'v2': _load_matches_v2,
+})
+
+
+def _record_poll(route: str, phase_id: int, team_id: Optional[int],
+                 matches: Optional[List[Cbf.Match]]) -> None:
+    if _snapshot_store() is not None:
+        # nothing to refresh
+        return
+    refresh_scheduler.record((route, phase_id, team_id), matches)
+    if app.config['REFRESH_SCHEDULER']:
+        refresh_scheduler.start()
+
+
+@app.route('/cbf/ical/<int:phase_id>/<int:team_id>')
+@app.route('/cbf/ical/<int:phase_id>/<int:team_id>.ics')
+async def get_matches(phase_id: int, team_id: int):
+    matches = await _load_matches_async(phase_id, team_id)
+    if matches is None:
+        return _upstream_unavailable()
+    _record_poll('v1', phase_id, team_id, matches)
+    return _calendar_response('v1', (phase_id, team_id), {team_id}, matches)
+
+
+@app.route('/cbf/ical/v2/<int:phase_id>/<int:team_id>')
+@app.route('/cbf/ical/v2/<int:phase_id>/<int:team_id>.ics')
+async def get_matches_v2(phase_id: int, team_id: int):
+    matches = await _load_matches_v2_async(phase_id, team_id)
+    if matches is None:
+        return _upstream_unavailable()
+    if not matches:
+        return ''
+    _record_poll('v2', phase_id, team_id, matches)
+    return _calendar_response('v2', (phase_id, team_id), {team_id}, matches)
+
+
+@app.route('/cbf/ical/club')
+@app.route('/cbf/ical/club.ics')
+async def get_club_matches():
+    teams = _club_teams()
+    if not teams:
+        return ''
+    matches = await _load_club_matches(teams)
+    if matches is None:
+        return _upstream_unavailable()
+    for phase_id in dict.fromkeys(phase_id for phase_id, _ in teams):
+        # the phase schedules are kept warm like those of single calendars
+        _record_poll('v1', phase_id, None, None)
+    return _calendar_response('club', tuple(sorted(teams)),
+                              {team_id for _, team_id in teams}, matches)
+
+
+_referee_indexes: Dict[str, referee_index.RefereeIndex] = {}
+
+
+def _referee_index() -> referee_index.RefereeIndex:
+    """The referee index, opened once per process."""
+    path = referee_index.default_referee_index_path
+    index = _referee_indexes.get(path)
+    if index is None:
+        index = _referee_indexes.setdefault(
+            path, referee_index.RefereeIndex(path))
+    return index
+
+
+@app.route('/cbf/ical/referee/<int:referee_id>')
+@app.route('/cbf/ical/referee/<int:referee_id>.ics')
+def get_referee_matches(referee_id: int):
+    year: Optional[int] = request.args.get('year', type=int)
+    matches = _referee_index().matches(referee_id, year)
+    if not matches:
+        return ''
+    return _calendar_response('referee', (referee_id, year), (), matches)
+
+
+_team_indexes: Dict[str, team_index.TeamIndex] = {}
+
+
+def _team_index() -> team_index.TeamIndex:
+    """The team index, opened once per process."""
+    path = team_index.default_team_index_path
+    index = _team_indexes.get(path)
+    if index is None:
+        index = _team_indexes.setdefault(path, team_index.TeamIndex(path))
+    return index
+
+
+def _find_team(year: int, team_name: str) -> List[Tuple[int, int]]:
+    store = _snapshot_store()
+    if store is None:
+        return team_index.find_team(year, team_name, index=_team_index())
+    current = store.current()
+    return current.find_team(year, team_name) if current is not None else []
 
 
 @app.route('/cbf/find_team')
 def find_team():
     year: int = request.args.get('year', type=int)
     team_name: str = request.args.get('name')
-    return str(Cbf.find_team(year, team_name))
+    return str(_find_team(year, team_name))
+
+
+def _search_teams(year: int, team_name: str, area: int,
+                  errors: List[Cbf.FetchError]) -> Iterator[team_index.IndexedTeam]:
+    """
+    Teams found by name, all at once from the snapshot or from the team index
+    when it has the season, otherwise crawled division by division.
+    """
+    store = _snapshot_store()
+    if store is not None:
+        current = store.current()
+        if current is not None:
+            yield from current.search_teams(year, team_name, area)
+        return
+    index = _team_index()
+    if index.has_season(year, area):
+        yield from index.search(team_name, year, area)
+        return
+    fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint)
+    for division, phase, team_standing in fetcher.search_teams(
+            year, team_name, area, errors):
+        yield team_index.IndexedTeam(year, area, division.id, division.name,
+                                     phase.id, phase.name, team_standing.id,
+                                     team_standing.name)
+
+
+@app.route('/cbf/find_team/stream')
+def find_team_stream():
+    """
+    Teams found by name as they come, as newline delimited JSON or (asked
+    for by format=sse or the Accept header) server-sent events, ending with
+    a done record. The search stops when the client goes away.
+    """
+    year: Optional[int] = request.args.get('year', type=int)
+    team_name: str = request.args.get('name', '')
+    area: int = request.args.get('area', 0, type=int)
+    if year is None or not team_name.strip():
+        abort(400, 'Searching teams needs the year and name')
+    event_stream = request.args.get('format') == 'sse' or \
+        request.accept_mimetypes.best_match(
+            ['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+
+    def encode(event: str, data: dict) -> str:
+        line = json.dumps(data, ensure_ascii=False)
+        if event_stream:
+            return f'event: {event}\ndata: {line}\n\n'
+        return line + '\n'
+
+    def generate() -> Iterator[str]:
+        errors: List[Cbf.FetchError] = []
+        found = 0
+        for team in _search_teams(year, team_name, area, errors):
+            found += 1
+            yield encode('team', {
+                'season': team.season, 'area': team.area,
+                'division_id': team.division_id,
+                'division_name': team.division_name,
+                'phase_id': team.phase_id, 'phase_name': team.phase_name,
+                'team_id': team.team_id, 'team_name': team.team_name,
+                'calendar': url_for('get_matches', phase_id=team.phase_id,
+                                    team_id=team.team_id),
+            })
+        yield encode('done', {'done': True, 'found': found,
+                              'skipped_phases': len(errors)})
+
+    response = Response(
+        stream_with_context(generate()),
+        content_type='text/event-stream; charset=utf-8' if event_stream
+        else 'application/x-ndjson; charset=utf-8')
+    response.headers['Cache-Control'] = 'no-cache'
+    # let proxies pass the results through as they come
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/favicon.ico')
@@ -116,10 +582,16 @@ def favicon():
 
 @app.route('/team-finder')
 def team_finder():
+    store = _snapshot_store()
+    if store is None:
+        seasons = Cbf.fetch_season_list()
+    else:
+        current = store.current()
+        seasons = current.season_list() if current is not None else []
     return render_template(
         'team_finder.html',
         areas=Cbf.areas,
-        seasons=Cbf.fetch_season_list()
+        seasons=seasons
     )
 
 
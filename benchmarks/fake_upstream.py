@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the ČBF upstream, serving the (scaled) fixtures over HTTP with
+configurable latency, jitter and injected errors, so that the app can be
+load tested without network access. Point the app at it with
+CBF_API_ENDPOINT:
+
+    benchmarks/fake_upstream.py --port 8081 --latency 50 --jitter 30
+    CBF_API_ENDPOINT=http://127.0.0.1:8081/xml/ flask --app app run
+"""
+
+import argparse
+import collections
+import http.server
+import random
+import threading
+import time
+import urllib.parse
+from typing import Dict, Optional
+
+from run import FixtureUpstream
+
+season_list = ('<seasons><season><IDseason>1</IDseason><name>2023/2024</name>'
+               '<short_name>2023</short_name><current>1</current></season>'
+               '</seasons>').encode()
+
+
+class FakeUpstream:
+    """
+    Serves divs.php, sched.php, table.php, game.php, team.php and
+    seasonList.php (under any path, the v2 ones as well) on a background
+    thread. Every response is delayed by latency plus up to jitter seconds,
+    error_rate of them are answered by error_status instead. Requests are
+    counted per endpoint.
+    """
+
+    def __init__(self, games: int = 100, divisions: int = 3,
+                 latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503,
+                 port: int = 0, seed: Optional[int] = None):
+        self.payloads = dict(FixtureUpstream(games, divisions).payloads)
+        self.payloads['seasonList.php'] = season_list
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests: Dict[str, int] = collections.Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Endpoint to set as CBF_API_ENDPOINT."""
+        return f'http://127.0.0.1:{self._server.server_port}/xml/'
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                endpoint = urllib.parse.urlsplit(
+                    self.path).path.rsplit('/', 1)[-1]
+                delay, failed = upstream._respond_to(endpoint)
+                time.sleep(delay)
+                payload = upstream.payloads.get(endpoint)
+                if payload is None:
+                    self.send_error(404)
+                elif failed:
+                    self.send_error(upstream.error_status)
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+
+        return Handler
+
+    def _respond_to(self, endpoint: str):
+        """Counts the request, returns its delay and whether it fails."""
+        with self._lock:
+            self.requests[endpoint] += 1
+            return (self.latency + self._random.uniform(0, self.jitter),
+                    self._random.random() < self.error_rate)
+
+    def reset_counts(self) -> Dict[str, int]:
+        """Request counts since the last reset."""
+        with self._lock:
+            counts = dict(self.requests)
+            self.requests.clear()
+        return counts
+
+    def start(self) -> 'FakeUpstream':
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fake ČBF upstream')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--games', type=int, default=100,
+                        help='games of every schedule')
+    parser.add_argument('--divisions', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='delay of every response in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='random extra delay of up to this many '
+                             'milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests failing')
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.games, args.divisions, args.latency / 1000,
+                            args.jitter / 1000, args.error_rate,
+                            args.error_status, args.port).start()
+    print('serving', upstream.url)
+    try:
+        while True:
+            time.sleep(10)
+            print(dict(upstream.reset_counts()))
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
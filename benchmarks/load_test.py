@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the calendar routes, offline.
+
+The app is started (afresh for every route, so that each starts with cold
+caches) against the fake upstream (see fake_upstream.py), and calendar
+polls are replayed against it - many clients polling calendars of skewed
+popularity, part of them conditionally (If-None-Match). Throughput, latency
+percentiles and upstream requests per calendar request are reported per
+route, and can be written as JSON like run.py results:
+
+    benchmarks/load_test.py --latency 50 --jitter 30 --error-rate 0.01
+    benchmarks/load_test.py --routes v1,v2 --requests 2000 --output load.json
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, Tuple
+
+from fake_upstream import FakeUpstream
+from run import benchmarks_dir, git_commit, load_fixture
+
+repository_dir = os.path.dirname(benchmarks_dir)
+
+default_requests = 1000
+default_concurrency = 16
+default_calendars = 50
+# share of the polls sent with the ETag of the previous response
+default_conditional = 0.5
+# teams of a club calendar
+club_size = 3
+
+# (phase id, team id)
+Calendar = Tuple[int, int]
+
+
+def route_urls(route: str, calendars: List[Calendar]) -> List[str]:
+    """Calendar urls of the route, ordered by popularity."""
+    if route == 'v1':
+        return [f'/cbf/ical/{phase_id}/{team_id}.ics'
+                for phase_id, team_id in calendars]
+    if route == 'v2':
+        return [f'/cbf/ical/v2/{phase_id}/{team_id}.ics'
+                for phase_id, team_id in calendars]
+    if route == 'club':
+        return ['/cbf/ical/club.ics?teams=' + ','.join(
+            f'{phase_id}:{team_id}'
+            for phase_id, team_id in calendars[start:start + club_size])
+            for start in range(0, len(calendars), club_size)]
+    raise ValueError('Unknown route ' + repr(route))
+
+
+def fixture_calendars(upstream: FakeUpstream, count: int) -> List[Calendar]:
+    """Calendars of the teams and phases the fake upstream serves."""
+    phase_ids = [int(phase_id.text) for phase_id in ElementTree.fromstring(
+        upstream.payloads['divs.php']).iterfind('div/phases/phase/id')]
+    team_ids = sorted({int(team.text) for team in ElementTree.fromstring(
+        load_fixture('sched.xml')).iterfind('game/team/id')})
+    calendars = [(phase_id, team_id)
+                 for phase_id in phase_ids for team_id in team_ids]
+    return calendars[:count]
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+class AppProcess:
+    """The app served by the flask development server (threaded)."""
+
+    def __init__(self, upstream_url: str, workdir: str):
+        self.port = free_port()
+        env = dict(os.environ, CBF_API_ENDPOINT=upstream_url,
+                   CBF_TEAM_INDEX=os.path.join(workdir, 'team_index.sqlite'))
+        env.pop('CBF_SNAPSHOT', None)
+        env.pop('CBF_SHARED_CACHE', None)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'flask', '--app', 'app', 'run',
+             '--port', str(self.port), '--with-threads', '--no-reload'],
+            cwd=repository_dir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def wait_ready(self, timeout: float = 30) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('The app exited')
+            try:
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', self.port, timeout=1)
+                connection.request('GET', '/metrics')
+                if connection.getresponse().status == 200:
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('The app did not start in time')
+
+    def stop(self) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+
+def percentile(timings: List[float], percent: int) -> float:
+    if len(timings) < 2:
+        return timings[0] if timings else 0.0
+    return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1]
+
+
+def replay(app_url: str, urls: List[str], requests: int, concurrency: int,
+           conditional: float, seed: int) -> Dict[str, object]:
+    """
+    Sends requests polls of the urls, the n-th most popular polled 1/n as
+    often as the first one, concurrency at once.
+    """
+    generator = random.Random(seed)
+    polls = [(url, generator.random() < conditional) for url in
+             generator.choices(urls, [1 / rank for rank in
+                                      range(1, len(urls) + 1)], k=requests)]
+    app = urllib.parse.urlsplit(app_url)
+    etags: Dict[str, str] = {}
+    lock = threading.Lock()
+
+    def poll(task: Tuple[str, bool]) -> Tuple[float, int]:
+        url, conditionally = task
+        headers = {}
+        with lock:
+            if conditionally and url in etags:
+                headers['If-None-Match'] = etags[url]
+        started = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection(app.hostname, app.port,
+                                                    timeout=60)
+            connection.request('GET', url, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+        except (OSError, http.client.HTTPException):
+            return time.perf_counter() - started, 0
+        etag = response.getheader('ETag')
+        if etag:
+            with lock:
+                etags[url] = etag
+        return time.perf_counter() - started, response.status
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(poll, polls))
+    elapsed = time.perf_counter() - started
+    timings = [timing for timing, _ in results]
+    statuses: Dict[str, int] = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': requests,
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'statuses': statuses,
+        'errors': sum(count for status, count in statuses.items()
+                      if status == '0' or int(status) >= 500),
+    }
+
+
+def run_route(route: str, upstream: FakeUpstream, calendars: List[Calendar],
+              args: argparse.Namespace, workdir: str) -> Dict[str, object]:
+    app = None
+    app_url = args.app_url
+    if app_url is None:
+        app = AppProcess(upstream.url, workdir)
+    try:
+        if app is not None:
+            app.wait_ready()
+            app_url = app.url
+        upstream.reset_counts()
+        result = replay(app_url, route_urls(route, calendars), args.requests,
+                        args.concurrency, args.conditional, args.seed)
+        upstream_requests = upstream.reset_counts()
+    finally:
+        if app is not None:
+            app.stop()
+    result['upstream_requests'] = upstream_requests
+    result['amplification'] = \
+        sum(upstream_requests.values()) / max(1, args.requests)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--routes', type=lambda value: value.split(','),
+                        default=['v1', 'v2', 'club'],
+                        help='routes to test (v1, v2, club)')
+    parser.add_argument('--requests', type=int, default=default_requests,
+                        help='calendar polls per route')
+    parser.add_argument('--concurrency', type=int,
+                        default=default_concurrency)
+    parser.add_argument('--calendars', type=int, default=default_calendars,
+                        help='distinct calendars polled')
+    parser.add_argument('--conditional', type=float,
+                        default=default_conditional,
+                        help='share of polls revalidating the calendar')
+    parser.add_argument('--games', type=int, default=100,
+                        help='games of every upstream schedule')
+    parser.add_argument('--latency', type=float, default=20,
+                        help='upstream delay in milliseconds')
+    parser.add_argument('--jitter', type=float, default=10,
+                        help='random extra upstream delay of up to this many '
+                             'milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of upstream requests failing')
+    parser.add_argument('--upstream-port', type=int, default=0)
+    parser.add_argument('--app-url',
+                        help='test an app already running (with '
+                             'CBF_API_ENDPOINT pointing to --upstream-port) '
+                             'instead of starting one per route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the results to')
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.games, latency=args.latency / 1000,
+                            jitter=args.jitter / 1000,
+                            error_rate=args.error_rate,
+                            port=args.upstream_port, seed=args.seed).start()
+    calendars = fixture_calendars(upstream, args.calendars)
+    results = {}
+    try:
+        for route in args.routes:
+            with tempfile.TemporaryDirectory() as workdir:
+                result = results[route] = run_route(
+                    route, upstream, calendars, args, workdir)
+            print(f'{route:6} {result["requests_per_second"]:8.1f} req/s  '
+                  f'p50 {result["p50_ms"]:7.1f} ms  '
+                  f'p95 {result["p95_ms"]:7.1f} ms  '
+                  f'p99 {result["p99_ms"]:7.1f} ms  '
+                  f'errors {result["errors"]:4}  '
+                  f'upstream x{result["amplification"]:.3f} '
+                  f'{result["upstream_requests"]}')
+    finally:
+        upstream.stop()
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'commit': git_commit(),
+                'created': datetime.datetime.now(
+                    datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'settings': {key: value for key, value in vars(args).items()
+                             if key != 'output'},
+                'results': results,
+            }, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Offline microbenchmarks of parsing and calendar rendering.
+
+The payloads in fixtures/ are scaled up synthetically (games of a schedule,
+divisions of a season) and served to the fetchers instead of upstream.
+Results are written as JSON, so that runs of different commits can be
+compared:
+
+    benchmarks/run.py --output before.json
+    benchmarks/run.py --output after.json --compare before.json
+"""
+
+import argparse
+import copy
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from typing import Callable, Dict, List, Optional
+
+benchmarks_dir = os.path.dirname(os.path.realpath(__file__))
+fixtures_dir = os.path.join(benchmarks_dir, 'fixtures')
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+import Cbf  # noqa: E402
+
+default_sizes = [100, 1000, 10000]
+default_repeat = 5
+
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(fixtures_dir, name), 'rb') as fixture:
+        return fixture.read()
+
+
+def scale_children(raw_xml: bytes, count: int, id_step: int = 0) -> bytes:
+    """
+    Document with count children of the root, cycling through the recorded
+    ones. With id_step set, the ids of the copies are shifted to stay unique.
+    """
+    root = ElementTree.fromstring(raw_xml)
+    templates = list(root)
+    for child in templates:
+        root.remove(child)
+    for number in range(count):
+        child = copy.deepcopy(templates[number % len(templates)])
+        if id_step:
+            child.find('id').text = str(
+                int(child.findtext('id')) + id_step * (number // len(templates)))
+        root.append(child)
+    return ElementTree.tostring(root, encoding='utf-8')
+
+
+class FixtureUpstream:
+    """Serves (scaled) fixtures in place of HttpClient.get."""
+
+    def __init__(self, games: int, divisions: int = 3):
+        self.payloads = {
+            'sched.php': scale_children(load_fixture('sched.xml'), games, 1000),
+            'table.php': load_fixture('table.xml'),
+            'divs.php': scale_children(load_fixture('divs.xml'), divisions),
+            'game.php': load_fixture('game.json'),
+            'team.php': self._team_listing(games),
+        }
+
+    @staticmethod
+    def _team_listing(games: int) -> bytes:
+        listing = json.loads(load_fixture('team.json'))
+        template = listing['match']
+        listing['match'] = [
+            dict(template[number % len(template)], gid=504101 + number)
+            for number in range(games)]
+        return json.dumps(listing).encode()
+
+    def get(self, request_url: str,
+            headers: Optional[Dict[str, str]] = None) -> Cbf.UpstreamResponse:
+        endpoint = urllib.parse.urlsplit(request_url).path.rsplit('/', 1)[-1]
+        return Cbf.UpstreamResponse(200, (), self.payloads[endpoint])
+
+
+class AsyncFixtureUpstream:
+    """FixtureUpstream in place of cbf_async.AsyncHttpClient."""
+
+    def __init__(self, upstream: FixtureUpstream):
+        self.upstream = upstream
+
+    async def get(self, request_url: str,
+                  headers: Optional[Dict[str, str]] = None) -> Cbf.UpstreamResponse:
+        return self.upstream.get(request_url, headers)
+
+    async def aclose(self) -> None:
+        pass
+
+
+def measure(function: Callable[[], object], items: int,
+            repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    function()
+    blocks_after = sys.getallocatedblocks()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(timings)
+    return {
+        'items': items,
+        'best_seconds': best,
+        'median_seconds': statistics.median(timings),
+        'items_per_second': items / best if best else 0.0,
+        'peak_bytes': peak,
+        'retained_blocks': blocks_after - blocks_before,
+    }
+
+
+def benchmark_parsing(sizes: List[int], repeat: int) -> Dict[str, dict]:
+    results = {}
+    for games in sizes:
+        upstream = FixtureUpstream(games)
+        raw_schedule = upstream.payloads['sched.php']
+        fetcher = Cbf.CbfApiFetcher_v1('offline/', max_workers=1, cache=None,
+                                       http=upstream)
+        results[f'v1.parse_schedule[{games}]'] = measure(
+            lambda: fetcher.parse_schedule(
+                ElementTree.fromstring(raw_schedule), 1),
+            games, repeat)
+        results[f'v1.parse_schedule_stream[{games}]'] = measure(
+            lambda: list(fetcher.parse_schedule_stream(
+                io.BytesIO(raw_schedule))),
+            games, repeat)
+
+        game = json.loads(load_fixture('game.json'))
+        v2_fetcher = Cbf.CbfApiFetcher_v2('offline/', max_workers=1,
+                                          cache=None, http=upstream)
+        results[f'v2.parse_match[{games}]'] = measure(
+            lambda: [v2_fetcher.parse_match(game) for _ in range(games)],
+            games, repeat)
+
+    for divisions in (10, 100):
+        # phases with 100 games each, everything prefetched
+        upstream = FixtureUpstream(100, divisions)
+        fetcher = Cbf.CbfApiFetcher_v1('offline/', max_workers=1, cache=None,
+                                       http=upstream)
+        raw_season = upstream.payloads['divs.php']
+        phases = len(ElementTree.fromstring(raw_season).findall('div/phases/phase'))
+        results[f'v1.parse_season[{divisions} divisions]'] = measure(
+            lambda: fetcher.parse_season(ElementTree.fromstring(raw_season), 2023),
+            phases, repeat)
+    return results
+
+
+def benchmark_calendars(sizes: List[int], repeat: int) -> Dict[str, dict]:
+    import app
+    import cbf_async
+    app.app.config['REFRESH_SCHEDULER'] = False
+    client = app.app.test_client()
+    results = {}
+    for games in sizes:
+        upstream = FixtureUpstream(games)
+        original_http = Cbf.http_client
+        original_async_http = cbf_async.http_client_factory
+        Cbf.http_client = upstream
+        cbf_async.http_client_factory = lambda: AsyncFixtureUpstream(upstream)
+        # the calendar routes use the client of the upstream loop
+        original_loop_http = cbf_async.upstream_loop.http
+        cbf_async.upstream_loop.http = AsyncFixtureUpstream(upstream)
+        try:
+            for route, url in (('get_matches', '/cbf/ical/1/3101.ics'),
+                               ('get_matches_v2', '/cbf/ical/v2/1/3101.ics')):
+                def request_calendar():
+                    # measure fetching, parsing and rendering, not the caches
+                    app.calendar_cache.clear()
+                    Cbf.response_cache.clear()
+                    response = client.get(url)
+                    assert response.status_code == 200, response.status
+                results[f'app.{route}[{games}]'] = measure(
+                    request_calendar, games, repeat)
+        finally:
+            Cbf.http_client = original_http
+            cbf_async.http_client_factory = original_async_http
+            cbf_async.upstream_loop.http = original_loop_http
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=benchmarks_dir,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict],
+            threshold: float) -> List[str]:
+    """Prints the speed ratios, returns benchmarks slower than threshold."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['best_seconds'] / baseline[name]['best_seconds']
+        memory_ratio = result['peak_bytes'] / max(1, baseline[name]['peak_bytes'])
+        print(f'{name:45} time x{ratio:.2f}  peak memory x{memory_ratio:.2f}')
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=lambda value: [
+        int(size) for size in value.split(',')], default=default_sizes,
+        help='numbers of games to scale the schedules to')
+    parser.add_argument('--repeat', type=int, default=default_repeat)
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--compare', help='results of a previous run')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown reported as regression (with --compare)')
+    args = parser.parse_args()
+
+    results = benchmark_parsing(args.sizes, args.repeat)
+    results.update(benchmark_calendars(args.sizes, args.repeat))
+    report = {
+        'commit': git_commit(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('Regressions:', ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
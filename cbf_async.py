@@ -0,0 +1,726 @@
+"""
+Asyncio counterparts of the Cbf fetchers. The transport is plain asyncio
+streams, parsing is delegated to (and identical with) the synchronous
+fetchers, responses share the Cbf response cache and identical calls in
+flight are coalesced through Cbf.single_flight, across event loops.
+
+    async with AsyncCbfApiFetcher_v1() as fetcher:
+        schedule = await fetcher.fetch_schedule(phase_id, deadline=5)
+
+Code running in other threads or event loops (like async views of a WSGI
+app, each run in a loop of its own) makes the requests on upstream_loop,
+sharing its connections:
+
+    schedule = await upstream_loop.run(load_schedule(phase_id))
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import gzip
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+from typing import Awaitable, Callable, Coroutine, Dict, Iterable, List, \
+    Optional, Tuple, TypeVar
+from xml.etree import ElementTree
+import Cbf
+import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# (status, reason, headers, body)
+RawResponse = Tuple[int, str, http.client.HTTPMessage, bytes]
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class _AsyncHostPool:
+    def __init__(self, max_connections: int):
+        self.slots = asyncio.Semaphore(max_connections)
+        self.idle: List[Connection] = []
+
+
+class AsyncHttpClient:
+    """
+    Asyncio version of Cbf.HttpClient (keep-alive connections pooled per
+    host, timeouts, retries of transient failures with backoff, redirects,
+    gzip, error responses raised as urllib.error.HTTPError). The connections
+    belong to the event loop they were opened in, so the client is meant to
+    be used within one loop and closed (aclose) when done.
+    """
+
+    transient_statuses = Cbf.HttpClient.transient_statuses
+    redirect_statuses = Cbf.HttpClient.redirect_statuses
+    max_redirects = Cbf.HttpClient.max_redirects
+
+    def __init__(self,
+                 max_connections_per_host: int = Cbf.default_max_connections_per_host,
+                 connect_timeout: float = Cbf.default_connect_timeout,
+                 read_timeout: float = Cbf.default_read_timeout,
+                 retries: int = Cbf.default_retries,
+                 retry_backoff: float = Cbf.default_retry_backoff,
+                 max_retry_backoff: float = Cbf.default_max_retry_backoff):
+        self.max_connections_per_host = max_connections_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._pools: Dict[Tuple[str, str], _AsyncHostPool] = {}
+        self._stats: Dict[str, Cbf.LatencyStats] = \
+            collections.defaultdict(Cbf.LatencyStats)
+        self._lock = threading.Lock()
+
+    async def __aenter__(self) -> 'AsyncHttpClient':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    def _pool(self, scheme: str, host: str) -> _AsyncHostPool:
+        pool = self._pools.get((scheme, host))
+        if pool is None:
+            pool = self._pools[(scheme, host)] = \
+                _AsyncHostPool(self.max_connections_per_host)
+        return pool
+
+    async def _connect(self, url: urllib.parse.SplitResult) -> Connection:
+        https = url.scheme == 'https'
+        async with asyncio.timeout(self.connect_timeout):
+            return await asyncio.open_connection(
+                url.hostname, url.port or (443 if https else 80),
+                ssl=ssl.create_default_context() if https else None)
+
+    async def _exchange(self, connection: Connection, host: str, path: str,
+                        headers: Dict[str, str]) -> Tuple[RawResponse, bool]:
+        """Sends the request, returns the response and if the connection can be reused."""
+        reader, writer = connection
+        request = 'GET ' + path + ' HTTP/1.1\r\nHost: ' + host + '\r\n' + \
+            ''.join(name + ': ' + value + '\r\n'
+                    for name, value in headers.items()) + '\r\n'
+        writer.write(request.encode('latin-1'))
+        await writer.drain()
+        async with asyncio.timeout(self.read_timeout):
+            status_line = await reader.readline()
+            if not status_line:
+                raise http.client.RemoteDisconnected(
+                    'Remote end closed connection without response')
+            version, _, status_reason = \
+                status_line.decode('latin-1').rstrip('\r\n').partition(' ')
+            status_text, _, reason = status_reason.partition(' ')
+            if not version.startswith('HTTP/') or not status_text.isdigit():
+                raise http.client.BadStatusLine(status_line.decode('latin-1'))
+            status = int(status_text)
+            header_lines = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                header_lines.append(line)
+            response_headers = http.client.parse_headers(
+                io.BytesIO(b''.join(header_lines) + b'\r\n'))
+            reusable = version == 'HTTP/1.1' and \
+                response_headers.get('Connection', '').lower() != 'close'
+            if status in (204, 304) or 100 <= status < 200:
+                body = b''
+            elif 'chunked' in response_headers.get(
+                    'Transfer-Encoding', '').lower():
+                body = await self._read_chunked(reader)
+            elif response_headers.get('Content-Length') is not None:
+                body = await reader.readexactly(
+                    int(response_headers['Content-Length']))
+            else:
+                body = await reader.read()
+                reusable = False
+        if response_headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return (status, reason, response_headers, body), reusable
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            try:
+                size = int(size_line.split(b';', 1)[0], 16)
+            except ValueError:
+                raise http.client.IncompleteRead(b''.join(chunks)) from None
+            if size == 0:
+                # trailers up to the empty line
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def _send(self, pool: _AsyncHostPool, url: urllib.parse.SplitResult,
+                    path: str, headers: Dict[str, str]) -> RawResponse:
+        """
+        Sends the request over an idle connection of the pool (or a new one),
+        the caller must hold a slot of the pool.
+        """
+        if pool.idle:
+            connection = pool.idle.pop()
+            try:
+                response, reusable = await self._exchange(
+                    connection, url.netloc, path, headers)
+            except (OSError, EOFError, http.client.HTTPException):
+                # the server has closed the idle connection meanwhile
+                connection[1].close()
+            except BaseException:
+                connection[1].close()
+                raise
+            else:
+                return self._keep(pool, connection, response, reusable)
+        connection = await self._connect(url)
+        try:
+            response, reusable = await self._exchange(
+                connection, url.netloc, path, headers)
+        except BaseException:
+            connection[1].close()
+            raise
+        return self._keep(pool, connection, response, reusable)
+
+    @staticmethod
+    def _keep(pool: _AsyncHostPool, connection: Connection,
+              response: RawResponse, reusable: bool) -> RawResponse:
+        if reusable:
+            pool.idle.append(connection)
+        else:
+            connection[1].close()
+        return response
+
+    async def _backoff(self, attempt: int) -> None:
+        delay = min(self.max_retry_backoff, self.retry_backoff * 2 ** attempt)
+        await asyncio.sleep(delay * random.uniform(0.5, 1))
+
+    async def get(self, request_url: str,
+                  headers: Optional[Dict[str, str]] = None) -> Cbf.UpstreamResponse:
+        Cbf.upstream_in_flight.inc()
+        try:
+            return await self._get(request_url, headers)
+        finally:
+            Cbf.upstream_in_flight.dec()
+
+    async def _get(self, request_url: str,
+                   headers: Optional[Dict[str, str]]) -> Cbf.UpstreamResponse:
+        request_headers = {'Accept-Encoding': 'gzip'}
+        request_headers.update(headers or {})
+        endpoint = urllib.parse.urlsplit(request_url).path.rsplit('/', 1)[-1]
+        started = time.monotonic()
+        attempt = 0
+        redirects = 0
+        while True:
+            url = urllib.parse.urlsplit(request_url)
+            path = url.path + ('?' + url.query if url.query else '')
+            pool = self._pool(url.scheme, url.netloc)
+            try:
+                async with pool.slots:
+                    status, reason, response_headers, body = await self._send(
+                        pool, url, path, request_headers)
+            except (OSError, EOFError, http.client.HTTPException):
+                if attempt >= self.retries:
+                    self._record(endpoint, started, attempt, error=True)
+                    raise
+                await self._backoff(attempt)
+                attempt += 1
+                continue
+            if status in self.redirect_statuses and \
+                    redirects < self.max_redirects:
+                request_url = urllib.parse.urljoin(
+                    request_url, response_headers.get('Location', ''))
+                redirects += 1
+                continue
+            if status in self.transient_statuses and attempt < self.retries:
+                await self._backoff(attempt)
+                attempt += 1
+                continue
+            if status in self.redirect_statuses:
+                reason = 'Too many redirects'
+            if status >= 400 or status in self.redirect_statuses:
+                self._record(endpoint, started, attempt, error=True)
+                raise urllib.error.HTTPError(request_url, status, reason,
+                                             response_headers, io.BytesIO(body))
+            self._record(endpoint, started, attempt, error=False)
+            return Cbf.UpstreamResponse(status, response_headers.items(), body)
+
+    def _record(self, endpoint: str, started: float, retries: int,
+                error: bool) -> None:
+        elapsed = time.monotonic() - started
+        Cbf.upstream_request_seconds.observe(elapsed, endpoint=endpoint)
+        metrics.record_timing('upstream', elapsed)
+        if retries:
+            Cbf.upstream_retries.inc(retries, endpoint=endpoint)
+        if error:
+            Cbf.upstream_errors.inc(endpoint=endpoint)
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.requests += 1
+            stats.retries += retries
+            stats.errors += error
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per endpoint request count, errors, retries and latency."""
+        with self._lock:
+            return {endpoint: stats.as_dict()
+                    for endpoint, stats in self._stats.items()}
+
+    async def aclose(self) -> None:
+        writers = [writer for pool in self._pools.values()
+                   for _, writer in pool.idle]
+        for pool in self._pools.values():
+            pool.idle.clear()
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            with contextlib.suppress(OSError):
+                await writer.wait_closed()
+
+
+# makes the clients of fetchers not given one (replaceable, e.g. by a stub)
+http_client_factory: Callable[[], AsyncHttpClient] = AsyncHttpClient
+
+
+class UpstreamLoop:
+    """
+    Event loop of the process running in a daemon thread, with one http
+    client whose (keep-alive) connections all the coroutines run on it
+    share. Fetchers created on the loop use that client. Coroutines are run
+    in the context of the caller (staleness and timing of its request) and
+    phase parts are never loaded on access there (see Cbf.Phase), that
+    would block the loop. The loop is started on first use, anew in a
+    forked process.
+    """
+
+    def __init__(self):
+        self.http: Optional[AsyncHttpClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                if self._pid is not None:
+                    # forked, the connections of the parent are not ours
+                    self.http = None
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+
+                def run() -> None:
+                    asyncio.set_event_loop(loop)
+                    Cbf.forbid_blocking_loads()
+                    started.set()
+                    loop.run_forever()
+
+                threading.Thread(target=run, name='cbf-upstream-loop',
+                                 daemon=True).start()
+                started.wait()
+                self._loop = loop
+                self._pid = os.getpid()
+            if self.http is None:
+                self.http = http_client_factory()
+            return self._loop
+
+    def is_current(self) -> bool:
+        """Whether called from a coroutine running on the loop."""
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def submit(self, coroutine: Coroutine[object, object, R]) \
+            -> concurrent.futures.Future:
+        """Runs the coroutine on the loop, cancelling the future cancels it."""
+        loop = self._start()
+        context = contextvars.copy_context()
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        def start() -> None:
+            if future.cancelled():
+                coroutine.close()
+                return
+            task = loop.create_task(coroutine, context=context)
+
+            def done(task: asyncio.Task) -> None:
+                if future.cancelled():
+                    return
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+
+            task.add_done_callback(done)
+            future.add_done_callback(
+                lambda _: future.cancelled() and
+                loop.call_soon_threadsafe(task.cancel))
+
+        loop.call_soon_threadsafe(start)
+        return future
+
+    async def run(self, coroutine: Coroutine[object, object, R]) -> R:
+        """Awaits the coroutine run on the loop, from another event loop."""
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+
+# shared by the calendar routes of the app
+upstream_loop = UpstreamLoop()
+
+
+def _coalesced(method: Callable[..., Awaitable[R]]) -> Callable[..., Awaitable[R]]:
+    """Async version of Cbf._coalesced (see Cbf.SingleFlight)."""
+    @functools.wraps(method)
+    async def coalesced(self, *args, **kwargs) -> R:
+        if self.single_flight is None:
+            return await method(self, *args, **kwargs)
+        key = (method.__qualname__, self.api_url, self.refresh,
+               id(self.cache), args, tuple(sorted(kwargs.items())))
+        return await self.single_flight.do_async(
+            key, lambda: method(self, *args, **kwargs), method.__name__)
+    return coalesced
+
+
+def _shared(kind: str) -> Callable[[Callable[..., Awaitable[R]]],
+                                   Callable[..., Awaitable[R]]]:
+    """Async version of Cbf._shared (see shared_cache)."""
+    def decorate(method: Callable[..., Awaitable[R]]) -> Callable[..., Awaitable[R]]:
+        @functools.wraps(method)
+        async def shared(self, *args) -> R:
+            store = self.shared_cache
+            if store is None:
+                return await method(self, *args)
+            key = Cbf._shared_key(self.api_url, args)
+            value = store.get(kind, key, self.refresh)
+            if value is None:
+                with Cbf.tracking_staleness() as staleness:
+                    value = await method(self, *args)
+                if value is not None and staleness.age is None:
+                    store.put(kind, key, value)
+            return value
+        return shared
+    return decorate
+
+
+def _with_deadline(method: Callable[..., Awaitable[R]]) -> Callable[..., Awaitable[R]]:
+    """
+    Adds the deadline keyword argument - seconds the call may take before it
+    is cancelled with TimeoutError (no limit by default).
+    """
+    @functools.wraps(method)
+    async def with_deadline(self, *args, deadline: Optional[float] = None,
+                            **kwargs) -> R:
+        async with asyncio.timeout(deadline):
+            return await method(self, *args, **kwargs)
+    return with_deadline
+
+
+class AsyncCbfApiFetcher:
+    """
+    Common base of the async fetchers, see Cbf.CbfApiFetcher. At most
+    `max_workers` requests of one call are made concurrently. Without given
+    http client the fetcher uses the one of upstream_loop when created on
+    it, otherwise it opens its own, closed when leaving its context (async
+    with) or by aclose. Stale cached responses are revalidated in the
+    background by the synchronous fetchers.
+    """
+
+    def __init__(self, max_workers: int = Cbf.default_max_workers,
+                 cache: Optional[Cbf.ResponseCache] = Cbf.response_cache,
+                 http: Optional[AsyncHttpClient] = None, refresh: bool = False,
+                 single_flight: Optional[Cbf.SingleFlight] = Cbf.single_flight,
+                 circuit_breaker: Optional[Cbf.CircuitBreaker] = Cbf.circuit_breaker):
+        self.max_workers = max_workers
+        self.cache = cache
+        if http is None and upstream_loop.is_current():
+            http = upstream_loop.http
+        self._owns_http = http is None
+        self.http = http if http is not None else http_client_factory()
+        self.refresh = refresh
+        self.single_flight = single_flight
+        self.circuit_breaker = circuit_breaker
+        self.shared_cache = Cbf.shared_cache
+
+    async def __aenter__(self) -> 'AsyncCbfApiFetcher':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._owns_http:
+            await self.http.aclose()
+
+    async def _download(self, request_url: str,
+                        headers: Dict[str, str]) -> Cbf.UpstreamResponse:
+        if self.circuit_breaker is None:
+            return await self.http.get(request_url, headers)
+        with self.circuit_breaker.guard(request_url):
+            return await self.http.get(request_url, headers)
+
+    async def _read(self, request_url: str) -> bytes:
+        """See Cbf.CbfApiFetcher._read."""
+        if self.cache is None:
+            return (await self._download(request_url, {})).body
+        entry = self.cache.lookup(request_url)
+        if entry is not None and not self.refresh:
+            if entry.is_fresh():
+                return entry.body
+            if self.cache.serves_stale(entry):
+                self.cache.served_stale(entry)
+                # in the background, over the synchronous client
+                Cbf._revalidate_later(self.cache, Cbf.http_client,
+                                      self.circuit_breaker, request_url, entry)
+                return entry.body
+        try:
+            response = await self._download(
+                request_url, entry.validators() if entry is not None else {})
+        except Exception as error:
+            if entry is None or not Cbf.is_outage(error) or \
+                    not self.cache.serves_stale(entry, on_error=True):
+                raise
+            logger.warning('Serving cached %s: %s', request_url, error)
+            if not entry.is_fresh():
+                self.cache.served_stale(entry)
+            return entry.body
+        if response.status == 304 and entry is not None:
+            self.cache.revalidated(request_url, entry)
+            return entry.body
+        self.cache.store(request_url, response.body, response.headers)
+        return response.body
+
+    def _limit_cache_on_match_day(self, request_url: str,
+                                  matches: Iterable[Cbf.Match]) -> None:
+        if self.cache is not None and Cbf.is_match_day(matches):
+            self.cache.limit_ttl(request_url, Cbf.match_day_cache_ttl)
+
+    async def _map(self, function: Callable[[T], Awaitable[R]],
+                   items: Iterable[T]) -> List[R]:
+        """Awaits function of all items (max_workers at once), in order."""
+        slots = asyncio.Semaphore(max(1, self.max_workers))
+
+        async def run(item: T) -> R:
+            async with slots:
+                return await function(item)
+
+        return list(await asyncio.gather(*(run(item) for item in items)))
+
+
+class AsyncCbfApiFetcher_v1(AsyncCbfApiFetcher):
+    def __init__(self, api_url: str = Cbf.cbf_api_endpoint,
+                 max_workers: int = Cbf.default_max_workers,
+                 cache: Optional[Cbf.ResponseCache] = Cbf.response_cache,
+                 http: Optional[AsyncHttpClient] = None, refresh: bool = False,
+                 single_flight: Optional[Cbf.SingleFlight] = Cbf.single_flight,
+                 circuit_breaker: Optional[Cbf.CircuitBreaker] = Cbf.circuit_breaker,
+                 local_standings: bool = False):
+        super().__init__(max_workers, cache, http, refresh, single_flight,
+                         circuit_breaker)
+        self.api_url = api_url
+        # parses the responses, phase parts not prefetched are loaded by it
+        # (synchronously) on access
+        self.parser = Cbf.CbfApiFetcher_v1(api_url, max_workers, cache,
+                                           refresh=refresh,
+                                           local_standings=local_standings)
+
+    @_with_deadline
+    async def fetch_season(self, year: int, area: Optional[int] = None,
+                           prefetch: Iterable[str] = Cbf.phase_parts) \
+            -> Optional[Cbf.Season]:
+        """See Cbf.CbfApiFetcher_v1.fetch_season."""
+        request_url = self.api_url + 'divs.php?s=' + str(year)
+        if area:
+            request_url += '&a=' + str(area)
+        raw_xml = await self._read(request_url)
+        try:
+            with metrics.timed('parse', Cbf.parse_seconds, endpoint='divs.php'):
+                xml = ElementTree.fromstring(raw_xml)
+        except ElementTree.ParseError:
+            return None
+        season = self.parser.parse_season(xml, year, prefetch=())
+        phases = [phase for division in season.divisions
+                  for phase in division.phases]
+        loaded = {id(phase) for phase in await self.prefetch(
+            phases, prefetch, season.errors)}
+        for division in season.divisions:
+            division.phases = [phase for phase in division.phases
+                               if id(phase) in loaded]
+        return season
+
+    async def prefetch(self, phases: Iterable[Cbf.Phase],
+                       parts: Iterable[str] = Cbf.phase_parts,
+                       errors: Optional[List[Cbf.FetchError]] = None) \
+            -> List[Cbf.Phase]:
+        """See Cbf.CbfApiFetcher_v1.prefetch."""
+        phases = list(phases)
+        fetchers = {'schedule': lambda phase: self.fetch_schedule(phase.id),
+                    'standings': self.fetch_phase_standings}
+
+        async def load(task: Tuple[Cbf.Phase, str]) -> Optional[Cbf.FetchError]:
+            phase, part = task
+            try:
+                value = await fetchers[part](phase)
+            except (OSError, ValueError) as error:
+                return Cbf.FetchError(phase.id, str(error))
+            phase.store(part, value)
+            if value is None:
+                return Cbf.FetchError(phase.id, 'Failed to fetch ' + part)
+            return None
+
+        tasks = [(phase, part) for phase in phases for part in parts
+                 if not phase.is_loaded(part)]
+        failed = set()
+        for (phase, _), error in zip(tasks, await self._map(load, tasks)):
+            if error:
+                failed.add(id(phase))
+                if errors is not None:
+                    errors.append(error)
+        return [phase for phase in phases if id(phase) not in failed and
+                all(phase.is_loaded(part) and getattr(phase, part) is not None
+                    for part in parts)]
+
+    @_with_deadline
+    @_shared('schedule')
+    @_coalesced
+    async def fetch_schedule(self, phase_id: int) -> Optional[Cbf.Schedule]:
+        request_url = self.api_url + 'sched.php?p=' + str(phase_id)
+        raw_xml = await self._read(request_url)
+        try:
+            with metrics.timed('parse', Cbf.parse_seconds, endpoint='sched.php'):
+                schedule = Cbf.Schedule(phase_id, list(
+                    self.parser.parse_schedule_stream(io.BytesIO(raw_xml))))
+        except ElementTree.ParseError:
+            return None
+        self._limit_cache_on_match_day(request_url, schedule.matches)
+        return schedule
+
+    async def fetch_schedules(self, phase_ids: Iterable[int]) \
+            -> Dict[int, Optional[Cbf.Schedule]]:
+        """See Cbf.CbfApiFetcher_v1.fetch_schedules."""
+        phase_ids = list(dict.fromkeys(phase_ids))
+        return dict(zip(phase_ids,
+                        await self._map(self.fetch_schedule, phase_ids)))
+
+    async def fetch_phase_standings(self, phase: Cbf.Phase) \
+            -> Optional[Cbf.Standings]:
+        """See Cbf.CbfApiFetcher_v1.fetch_phase_standings."""
+        if self.parser.local_standings and Cbf.has_local_standings(phase):
+            if not phase.is_loaded('schedule'):
+                phase.store('schedule', await self.fetch_schedule(phase.id))
+            schedule = phase.schedule
+            standings = Cbf.compute_standings(schedule) \
+                if schedule is not None else None
+            if standings is not None:
+                return standings
+        return await self.fetch_standings(phase.id)
+
+    @_with_deadline
+    @_shared('standings')
+    @_coalesced
+    async def fetch_standings(self, phase_id: int) -> Optional[Cbf.Standings]:
+        request_url = self.api_url + 'table.php?p=' + str(phase_id)
+        raw_xml = await self._read(request_url)
+        try:
+            with metrics.timed('parse', Cbf.parse_seconds, endpoint='table.php'):
+                return Cbf.Standings(phase_id, list(
+                    self.parser.parse_standings_stream(io.BytesIO(raw_xml))))
+        except ElementTree.ParseError:
+            return None
+
+
+class AsyncCbfApiFetcher_v2(AsyncCbfApiFetcher):
+    def __init__(self, api_url: str = Cbf.cbf_api_v2_endpoint,
+                 max_workers: int = Cbf.default_max_workers,
+                 cache: Optional[Cbf.ResponseCache] = Cbf.response_cache,
+                 http: Optional[AsyncHttpClient] = None, refresh: bool = False,
+                 single_flight: Optional[Cbf.SingleFlight] = Cbf.single_flight,
+                 circuit_breaker: Optional[Cbf.CircuitBreaker] = Cbf.circuit_breaker):
+        super().__init__(max_workers, cache, http, refresh, single_flight,
+                         circuit_breaker)
+        self.api_url = api_url
+        self.parser = Cbf.CbfApiFetcher_v2(api_url, max_workers, cache,
+                                           refresh=refresh)
+
+    @_with_deadline
+    @_shared('match')
+    @_coalesced
+    async def fetch_match(self, match_id: int) -> Optional[Cbf.Match]:
+        request_url = self.api_url + 'game.php?json=1&game=' + str(match_id)
+        raw_json = await self._read(request_url)
+        with metrics.timed('parse', Cbf.parse_seconds, endpoint='game.php'):
+            try:
+                match = json.loads(raw_json)
+            except json.JSONDecodeError:
+                return None
+            parsed_match = self.parser.parse_match(match)
+        if parsed_match:
+            self._limit_cache_on_match_day(request_url, [parsed_match])
+        return parsed_match
+
+    @_with_deadline
+    @_coalesced
+    async def fetch_team_schedule_for_competition(
+            self, team_id: int, comp_id: int) -> Optional[List[Cbf.Match]]:
+        raw_json = await self._read(
+            self.api_url + 'team.php?json=1&id=' + str(team_id) +
+            '&competition=' + str(comp_id))
+        try:
+            with metrics.timed('parse', Cbf.parse_seconds, endpoint='team.php'):
+                team_info = json.loads(raw_json)
+        except json.JSONDecodeError:
+            return None
+        listed_games = self.parser.listed_games(team_info, team_id)
+
+        async def load_match(game_id) -> Optional[Cbf.Match]:
+            listed_game = listed_games[game_id]
+            if self.parser.is_complete_listing(listed_game):
+                with metrics.timed('parse', Cbf.parse_seconds,
+                                   endpoint='team.php'):
+                    return self.parser.parse_match({'gameInfo': [listed_game]})
+            return await self.fetch_match(game_id)
+
+        return [match for match in await self._map(load_match, listed_games)
+                if match]
+
+
+async def fetch_season_list(cache: Optional[Cbf.ResponseCache] = Cbf.response_cache,
+                            http: Optional[AsyncHttpClient] = None) \
+        -> List[Cbf.SeasonDescription]:
+    """See Cbf.fetch_season_list."""
+    request_url = Cbf.cbf_api_v2_endpoint + 'seasonList.php'
+    if Cbf.shared_cache is not None:
+        season_descriptions = Cbf.shared_cache.get('season_list', request_url)
+        if season_descriptions is not None:
+            return season_descriptions
+    async with AsyncCbfApiFetcher(cache=cache, http=http) as fetcher:
+        raw_xml = await fetcher._read(request_url)
+    season_descriptions = []
+    try:
+        with metrics.timed('parse', Cbf.parse_seconds,
+                           endpoint='seasonList.php'):
+            xml = ElementTree.fromstring(raw_xml)
+        for season_description in xml.findall('season'):
+            season_descriptions.append(
+                Cbf.SeasonDescription.from_xml(season_description))
+    except ElementTree.ParseError:
+        pass
+    if season_descriptions and Cbf.shared_cache is not None:
+        Cbf.shared_cache.put('season_list', request_url, season_descriptions)
+    return season_descriptions
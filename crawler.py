@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Bulk crawling of the schedules and standings of whole seasons in all (or
+given) areas into a local SQLite store, e.g. refreshing the whole country
+nightly. Workers crawl the phases concurrently within one requests per
+second budget toward upstream, and the crawl is checkpointed - an
+interrupted (or time limited) crawl resumes where it stopped, listing just
+the seasons and crawling just the phases it has not stored yet. The stored
+seasons are read back as Cbf.Season (see CrawlStore.season), e.g. by
+snapshot.py export.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import Cbf
+import shared_cache
+from sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+default_crawl_store_path = os.environ.get(
+    'CBF_CRAWL_STORE',
+    os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                 'cbf_crawl.sqlite'))
+default_requests_per_second = 5
+default_workers = 4
+# unfinished crawls started longer ago are not resumed, but started over
+default_max_resume_age = 12 * 60 * 60
+
+# (season, area)
+SeasonKey = Tuple[int, int]
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seasons TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+-- seasons of a run, listed_at is NULL until listed by the run
+CREATE TABLE IF NOT EXISTS run_seasons (
+    run_id INTEGER NOT NULL,
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    listed_at REAL,
+    PRIMARY KEY (run_id, season, area)
+);
+CREATE TABLE IF NOT EXISTS seasons (
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    listed_at REAL NOT NULL,
+    PRIMARY KEY (season, area)
+);
+-- position keeps the order of the divisions and phases in the listing,
+-- crawled_at is NULL until the phase is stored
+CREATE TABLE IF NOT EXISTS phases (
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    division_id INTEGER NOT NULL,
+    division_name TEXT NOT NULL,
+    phase_id INTEGER NOT NULL,
+    phase_name TEXT NOT NULL,
+    crawled_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    schedule TEXT,
+    standings TEXT,
+    PRIMARY KEY (season, area, phase_id)
+);
+CREATE INDEX IF NOT EXISTS phases_by_id ON phases (phase_id);
+'''
+
+
+class CrawlReport:
+    def __init__(self, run_id: int, resumed: bool):
+        self.run_id = run_id
+        self.resumed = resumed
+        self.crawled = 0
+        self.failed = 0
+        # seasons not listed yet and phases not crawled yet
+        self.unlisted = 0
+        self.remaining = 0
+        self.errors: List[Cbf.FetchError] = []
+        self.elapsed = 0.0
+        self.requests = 0
+        self.rate_limited_seconds = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.remaining == 0
+
+
+class CrawlStore(SqliteStore):
+    """
+    Persistent (SQLite) store of crawled seasons. Every crawl is a run over
+    a list of seasons and areas; seasons listed by the run and phases
+    stored since it started are done, so that resuming the run lists and
+    crawls only the others (the failed ones again).
+    """
+
+    schema = schema
+
+    def __init__(self, path: str = default_crawl_store_path):
+        super().__init__(path)
+
+    def _start_run(self, seasons: List[SeasonKey], restart: bool,
+                   max_resume_age: float) -> Tuple[int, float, bool]:
+        """Unfinished run over the same seasons, or a new one."""
+        listed = json.dumps(sorted(seasons))
+        now = time.time()
+        with self._connect() as connection:
+            row = None if restart else connection.execute(
+                'SELECT run_id, started_at FROM runs WHERE seasons = ? AND '
+                'finished_at IS NULL AND started_at > ? '
+                'ORDER BY run_id DESC LIMIT 1',
+                (listed, now - max_resume_age)).fetchone()
+            if row is not None:
+                return row[0], row[1], True
+            cursor = connection.execute(
+                'INSERT INTO runs (seasons, started_at) VALUES (?, ?)',
+                (listed, now))
+            connection.executemany(
+                'INSERT INTO run_seasons (run_id, season, area) '
+                'VALUES (?, ?, ?)',
+                [(cursor.lastrowid, year, area) for year, area in seasons])
+            return cursor.lastrowid, now, False
+
+    def _unlisted(self, run_id: int) -> List[SeasonKey]:
+        """Seasons of the run it has not listed yet."""
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT season, area FROM run_seasons WHERE run_id = ? '
+                'AND listed_at IS NULL ORDER BY season, area',
+                (run_id,)).fetchall()
+
+    def _list_season(self, fetcher: Cbf.CbfApiFetcher_v1, run_id: int,
+                     year: int, area: int) -> Optional[Cbf.FetchError]:
+        """Stores the divisions and phases of the season, keeping the data."""
+        try:
+            season = fetcher.fetch_season(year, area, prefetch=())
+        except (OSError, ValueError) as error:
+            season = None
+            logger.warning('Listing season %d area %d failed: %s',
+                           year, area, error)
+        if season is None:
+            return Cbf.FetchError(
+                None, f'Failed to fetch season {year} of area {area}')
+        listed = [(position, division, phase) for position, (division, phase)
+                  in enumerate((division, phase)
+                               for division in season.divisions
+                               for phase in division.phases)]
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT INTO phases (season, area, position, division_id, '
+                'division_name, phase_id, phase_name) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (season, area, phase_id) DO UPDATE SET '
+                'position = excluded.position, '
+                'division_id = excluded.division_id, '
+                'division_name = excluded.division_name, '
+                'phase_name = excluded.phase_name',
+                [(year, area, position, division.id, division.name, phase.id,
+                  phase.name) for position, division, phase in listed])
+            connection.execute(
+                'DELETE FROM phases WHERE season = ? AND area = ? AND '
+                'phase_id NOT IN (SELECT value FROM json_each(?))',
+                (year, area, json.dumps([phase.id for _, _, phase in listed])))
+            now = time.time()
+            connection.execute(
+                'INSERT OR REPLACE INTO seasons VALUES (?, ?, ?)',
+                (year, area, now))
+            connection.execute(
+                'UPDATE run_seasons SET listed_at = ? WHERE run_id = ? AND '
+                'season = ? AND area = ?', (now, run_id, year, area))
+        return None
+
+    def _pending(self, run_id: int,
+                 started_at: float) -> List[Tuple[int, str, str]]:
+        """
+        Phase ids (with their names and division names) of the seasons
+        listed by the run, left to crawl.
+        """
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT phase_id, phase_name, division_name FROM phases '
+                'JOIN run_seasons USING (season, area) WHERE run_id = ? AND '
+                'listed_at IS NOT NULL AND '
+                '(crawled_at IS NULL OR crawled_at < ?) '
+                'ORDER BY season, area, position',
+                (run_id, started_at)).fetchall()
+
+    def _store_phase(self, phase: Cbf.Phase) -> Optional[Cbf.FetchError]:
+        """Crawls the schedule and standings of the phase and stores them."""
+        try:
+            schedule, standings = phase.schedule, phase.standings
+            error = None if schedule is not None and standings is not None \
+                else 'Failed to fetch ' + \
+                ('schedule' if schedule is None else 'standings')
+        except (OSError, ValueError) as fetch_error:
+            error = str(fetch_error)
+        with self._connect() as connection:
+            if error is not None:
+                connection.execute(
+                    'UPDATE phases SET attempts = attempts + 1, error = ? '
+                    'WHERE phase_id = ?', (error, phase.id))
+                return Cbf.FetchError(phase.id, error)
+            connection.execute(
+                'UPDATE phases SET crawled_at = ?, attempts = 0, '
+                'error = NULL, schedule = ?, standings = ? WHERE phase_id = ?',
+                (time.time(), self._encode('schedule', schedule),
+                 self._encode('standings', standings), phase.id))
+        return None
+
+    @staticmethod
+    def _encode(kind: str, value) -> str:
+        return json.dumps(shared_cache.kinds[kind][1](value),
+                          ensure_ascii=False)
+
+    @staticmethod
+    def _decode(kind: str, data: Optional[str]):
+        return shared_cache.kinds[kind][2](json.loads(data)) \
+            if data is not None else None
+
+    def crawl(self, seasons: List[SeasonKey],
+              fetcher: Optional[Cbf.CbfApiFetcher_v1] = None,
+              requests_per_second: float = default_requests_per_second,
+              workers: int = default_workers,
+              time_limit: Optional[float] = None, restart: bool = False,
+              max_resume_age: float = default_max_resume_age,
+              local_standings: bool = False) -> CrawlReport:
+        """
+        Crawls (or resumes crawling) given seasons and areas. Without a
+        fetcher one is made with its own client, limited to
+        requests_per_second. Nothing is started after time_limit seconds,
+        the rest is left for resuming. The run is finished once all its
+        seasons are listed and all their phases stored.
+        """
+        seasons = list(dict.fromkeys(seasons))
+        started = time.monotonic()
+        rate_limiter = None
+        if fetcher is None:
+            rate_limiter = Cbf.RateLimiter(requests_per_second)
+            # the workers crawl the phases, a fetcher loads its phase alone
+            fetcher = Cbf.CbfApiFetcher_v1(
+                Cbf.cbf_api_endpoint, max_workers=1, cache=None,
+                http=Cbf.HttpClient(max_connections_per_host=workers,
+                                    rate_limiter=rate_limiter),
+                single_flight=None, local_standings=local_standings)
+        run_id, run_started_at, resumed = self._start_run(
+            seasons, restart, max_resume_age)
+        report = CrawlReport(run_id, resumed)
+        report_lock = threading.Lock()
+
+        def out_of_time() -> bool:
+            return time_limit is not None and \
+                time.monotonic() - started > time_limit
+
+        def list_season(season: SeasonKey) -> Optional[Cbf.FetchError]:
+            if out_of_time():
+                return None
+            return self._list_season(fetcher, run_id, *season)
+
+        def crawl_phase(pending: Tuple[int, str, str]) -> None:
+            if out_of_time():
+                return
+            phase_id, phase_name, division_name = pending
+            error = self._store_phase(Cbf.Phase(
+                phase_id, phase_name, fetcher=fetcher,
+                division_name=division_name))
+            with report_lock:
+                if error is None:
+                    report.crawled += 1
+                else:
+                    report.failed += 1
+                    report.errors.append(error)
+
+        with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as executor:
+            for error in executor.map(list_season, self._unlisted(run_id)):
+                if error is not None:
+                    report.errors.append(error)
+            list(executor.map(crawl_phase,
+                              self._pending(run_id, run_started_at)))
+
+        report.unlisted = len(self._unlisted(run_id))
+        report.remaining = report.unlisted + \
+            len(self._pending(run_id, run_started_at))
+        if report.finished:
+            with self._connect() as connection:
+                connection.execute(
+                    'UPDATE runs SET finished_at = ? WHERE run_id = ?',
+                    (time.time(), run_id))
+        report.elapsed = time.monotonic() - started
+        report.requests = sum(int(stats['requests']) for stats
+                              in fetcher.http.stats().values())
+        if rate_limiter is not None:
+            report.rate_limited_seconds = rate_limiter.waited_seconds
+        return report
+
+    def schedule(self, phase_id: int) -> Optional[Cbf.Schedule]:
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT schedule FROM phases WHERE phase_id = ? '
+                'AND crawled_at IS NOT NULL', (phase_id,)).fetchone()
+        return self._decode('schedule', row[0]) if row is not None else None
+
+    def standings(self, phase_id: int) -> Optional[Cbf.Standings]:
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT standings FROM phases WHERE phase_id = ? '
+                'AND crawled_at IS NOT NULL', (phase_id,)).fetchone()
+        return self._decode('standings', row[0]) if row is not None else None
+
+    def season(self, year: int, area: int = 0) -> Optional[Cbf.Season]:
+        """
+        The season as crawled (phases never crawled left out), None if it
+        has not been listed.
+        """
+        with self._connect() as connection:
+            if connection.execute(
+                    'SELECT 1 FROM seasons WHERE season = ? AND area = ?',
+                    (year, area)).fetchone() is None:
+                return None
+            rows = connection.execute(
+                'SELECT division_id, division_name, phase_id, phase_name, '
+                'schedule, standings FROM phases WHERE season = ? AND '
+                'area = ? AND crawled_at IS NOT NULL ORDER BY position',
+                (year, area)).fetchall()
+        divisions: Dict[int, Cbf.Division] = {}
+        for division_id, division_name, phase_id, phase_name, schedule, \
+                standings in rows:
+            division = divisions.get(division_id)
+            if division is None:
+                division = divisions[division_id] = Cbf.Division(
+                    division_id, division_name, [])
+            division.phases.append(Cbf.Phase(
+                phase_id, phase_name, self._decode('schedule', schedule),
+                self._decode('standings', standings),
+                division_name=division_name))
+        return Cbf.Season(year, list(divisions.values()))
+
+    def progress(self) -> List[Tuple[int, int, int, int, int]]:
+        """Season, area, phases listed, crawled and failed (last attempt)."""
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT season, area, COUNT(*), COUNT(crawled_at), '
+                'COUNT(error) FROM phases GROUP BY season, area '
+                'ORDER BY season, area').fetchall()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ČBF bulk crawler')
+    parser.add_argument('--db', default=default_crawl_store_path,
+                        help='path of the crawl store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    crawl = commands.add_parser(
+        'crawl', help='crawl (or resume crawling) given seasons and areas')
+    crawl.add_argument('years', type=int, nargs='*',
+                       help='seasons, the current one by default')
+    crawl.add_argument('--area', type=int, action='append',
+                       help='area codes (see Cbf.areas), all by default')
+    crawl.add_argument('--rps', type=float,
+                       default=default_requests_per_second,
+                       help='requests per second to upstream')
+    crawl.add_argument('--workers', type=int, default=default_workers)
+    crawl.add_argument('--time-limit', type=float,
+                       help='stop starting phases after this many minutes')
+    crawl.add_argument('--restart', action='store_true',
+                       help='start over instead of resuming')
+    crawl.add_argument('--local-standings', action='store_true',
+                       help='derive the standings from the schedules')
+    commands.add_parser('status', help='show what is crawled')
+    args = parser.parse_args()
+
+    store = CrawlStore(args.db)
+    if args.command == 'crawl':
+        years = args.years or [
+            int(season.short_name) for season in Cbf.fetch_season_list()
+            if season.current]
+        areas = args.area or list(Cbf.areas.values())
+        report = store.crawl(
+            [(year, area) for year in years for area in areas],
+            requests_per_second=args.rps, workers=args.workers,
+            time_limit=None if args.time_limit is None
+            else args.time_limit * 60,
+            restart=args.restart, local_standings=args.local_standings)
+        for error in report.errors:
+            print('skipped phase', error.phase_id, error.message)
+        print(f'run {report.run_id}'
+              f'{" (resumed)" if report.resumed else ""}: '
+              f'crawled {report.crawled} phases, {report.failed} failed, '
+              f'{report.remaining} remaining '
+              f'({report.unlisted} seasons not listed), {report.requests} requests '
+              f'in {report.elapsed:.1f} s')
+    else:
+        for year, area, listed, crawled, failed in store.progress():
+            print(year, area, f'{crawled}/{listed} phases', f'{failed} failed',
+                  sep='\t')
+
+
+if __name__ == '__main__':
+    main()
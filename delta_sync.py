@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Incremental refreshing of schedules. Content hashes of the matches (and of
+the team.php listing rows they came from) and of the standings tables are
+kept in SQLite, so that a refresh only parses and fetches what changed and
+records it in a feed of changes (added, removed, rescheduled, moved, scored
+or otherwise updated matches and changed standings). Consumers follow the
+feed by its sequence numbers and invalidate just the affected calendars.
+"""
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import pytz
+import Cbf
+from sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+default_delta_sync_path = os.environ.get(
+    'CBF_DELTA_SYNC',
+    os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                 'cbf_delta_sync.sqlite'))
+# matches starting (or started) this close are fetched even when their
+# listing did not change, their result is coming
+default_near_start = timedelta(hours=3)
+# changes older than this are dropped from the feed
+default_change_retention = 30 * 24 * 60 * 60
+
+# kinds of changes
+change_added = 'added'
+change_removed = 'removed'
+change_rescheduled = 'rescheduled'
+change_moved = 'moved'
+change_scored = 'scored'
+change_updated = 'updated'
+change_standings = 'standings'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS phases (
+    phase_id INTEGER PRIMARY KEY,
+    schedule_hash TEXT,
+    standings_hash TEXT,
+    synced_at REAL NOT NULL
+);
+-- team_id is the listed team of team.php syncs, 0 for phase schedules
+CREATE TABLE IF NOT EXISTS matches (
+    phase_id INTEGER NOT NULL,
+    team_id INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    start TEXT,
+    listing_hash TEXT,
+    match_hash TEXT NOT NULL,
+    match TEXT NOT NULL,
+    PRIMARY KEY (phase_id, team_id, match_id)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    phase_id INTEGER NOT NULL,
+    match_id INTEGER,
+    team_ids TEXT NOT NULL,
+    start TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_by_time ON changes (recorded_at);
+'''
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Change:
+    seq: Optional[int]
+    kind: str
+    phase_id: int
+    # None for the standings
+    match_id: Optional[int]
+    team_ids: Tuple[int, ...]
+    # the new start, the previous one of removed matches
+    start: Optional[datetime]
+
+    def calendars(self) -> List[Tuple[int, int]]:
+        """(phase id, team id) of the calendars affected by the change."""
+        return [(self.phase_id, team_id) for team_id in self.team_ids]
+
+
+class StoredMatch:
+    def __init__(self, listing_hash: Optional[str], match_hash: str,
+                 match: Cbf.Match):
+        self.listing_hash = listing_hash
+        self.match_hash = match_hash
+        self.match = match
+
+
+def match_changes(previous: Optional[Cbf.Match],
+                  match: Optional[Cbf.Match]) -> List[str]:
+    """Kinds of changes between two versions of a match (None if missing)."""
+    if previous is None:
+        return [change_added] if match is not None else []
+    if match is None:
+        return [change_removed]
+    kinds = []
+    if match.start != previous.start:
+        kinds.append(change_rescheduled)
+    if (match.location.place, match.location.city) != \
+            (previous.location.place, previous.location.city):
+        kinds.append(change_moved)
+    if match.result != previous.result and match.result is not None:
+        kinds.append(change_scored)
+    if not kinds and match != previous:
+        kinds.append(change_updated)
+    return kinds
+
+
+def is_near_start(match: Cbf.Match, now: datetime,
+                  near_start: timedelta = default_near_start) -> bool:
+    return match.start is not None and abs(match.start - now) <= near_start
+
+
+class DeltaSync(SqliteStore):
+    """
+    Content hashes and last known versions of the matches of the synced
+    phases (v1 schedules) and teams (v2 listings), and the feed of changes
+    found by syncing them again.
+    """
+
+    schema = schema
+
+    def __init__(self, path: str = default_delta_sync_path,
+                 near_start: timedelta = default_near_start,
+                 change_retention: float = default_change_retention):
+        self.near_start = near_start
+        self.change_retention = change_retention
+        super().__init__(path)
+
+    def _stored_matches(self, phase_id: int,
+                        team_id: int = 0) -> Dict[int, StoredMatch]:
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT match_id, listing_hash, match_hash, match '
+                'FROM matches WHERE phase_id = ? AND team_id = ?',
+                (phase_id, team_id)).fetchall()
+        return {match_id: StoredMatch(listing_hash, match_hash,
+                                      Cbf.match_from_dict(json.loads(match)))
+                for match_id, listing_hash, match_hash, match in rows}
+
+    def _phase_hashes(self, phase_id: int) -> Tuple[Optional[str], Optional[str]]:
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT schedule_hash, standings_hash FROM phases '
+                'WHERE phase_id = ?', (phase_id,)).fetchone()
+        return row if row is not None else (None, None)
+
+    def sync_phase(self, phase_id: int,
+                   fetcher: Optional[Cbf.CbfApiFetcher_v1] = None) -> List[Change]:
+        """Syncs the schedule and standings of a phase (sched.php, table.php)."""
+        if fetcher is None:
+            fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint, refresh=True)
+        return self.apply_phase(phase_id, fetcher.fetch_schedule(phase_id),
+                                fetcher.fetch_standings(phase_id))
+
+    def sync_season(self, year: int, area: int = 0,
+                    fetcher: Optional[Cbf.CbfApiFetcher_v1] = None) -> List[Change]:
+        """Syncs all phases of the season."""
+        if fetcher is None:
+            fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint, refresh=True)
+        season = fetcher.fetch_season(year, area)
+        if season is None:
+            return []
+        changes = []
+        for division in season.divisions:
+            for phase in division.phases:
+                changes += self.apply_phase(phase.id, phase.schedule,
+                                            phase.standings)
+        return changes
+
+    def apply_phase(self, phase_id: int, schedule: Optional[Cbf.Schedule],
+                    standings: Optional[Cbf.Standings]) -> List[Change]:
+        """
+        Records the changes of freshly fetched schedule and standings of the
+        phase (parts that failed to load are left as they were).
+        """
+        schedule_hash, standings_hash = self._phase_hashes(phase_id)
+        changes: List[Change] = []
+        matches: Dict[int, Tuple[str, Cbf.Match]] = {}
+        removed: List[int] = []
+        if schedule is not None:
+            matches = {match.id: (Cbf.match_hash(match), match)
+                       for match in schedule.matches}
+            new_schedule_hash = Cbf.content_hash(
+                sorted((match_id, hashed)
+                       for match_id, (hashed, _) in matches.items()))
+            if new_schedule_hash == schedule_hash:
+                matches = {}
+            else:
+                schedule_hash = new_schedule_hash
+                stored = self._stored_matches(phase_id)
+                changes += self._diff(phase_id, stored, matches)
+                removed = [match_id for match_id in stored
+                           if match_id not in matches]
+                changes += [self._change(change_removed, phase_id,
+                                         stored[match_id].match)
+                            for match_id in removed]
+        if standings is not None:
+            new_standings_hash = Cbf.standings_hash(standings)
+            if new_standings_hash != standings_hash:
+                changes.append(Change(
+                    None, change_standings, phase_id, None,
+                    tuple(team_standing.id for team_standing
+                          in standings.team_standings), None))
+                standings_hash = new_standings_hash
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO phases VALUES (?, ?, ?, ?)',
+                (phase_id, schedule_hash, standings_hash, time.time()))
+            self._store(connection, phase_id, 0, {
+                match_id: (None, hashed, match)
+                for match_id, (hashed, match) in matches.items()}, removed)
+            self._record(connection, changes)
+        return changes
+
+    def sync_team(self, team_id: int, comp_id: int,
+                  fetcher: Optional[Cbf.CbfApiFetcher_v2] = None,
+                  now: Optional[datetime] = None) -> List[Change]:
+        """
+        Syncs the matches of a team in a competition (team.php). Only games
+        that are new, whose listing row changed or that are near their start
+        are loaded again (from game.php unless the row is complete).
+        """
+        if fetcher is None:
+            fetcher = Cbf.CbfApiFetcher_v2(Cbf.cbf_api_v2_endpoint,
+                                           refresh=True)
+        if now is None:
+            now = datetime.now(pytz.utc)
+        listing = fetcher.fetch_team_listing(team_id, comp_id)
+        if listing is None:
+            return []
+        stored = self._stored_matches(comp_id, team_id)
+
+        def load(game_id) -> Optional[Tuple[str, str, Cbf.Match]]:
+            listed_game = listing[game_id]
+            listing_hash = Cbf.content_hash(listed_game)
+            previous = stored.get(game_id)
+            if previous is not None and \
+                    previous.listing_hash == listing_hash and \
+                    not is_near_start(previous.match, now, self.near_start):
+                return listing_hash, previous.match_hash, previous.match
+            if fetcher.is_complete_listing(listed_game):
+                match = fetcher.parse_listed_match(listed_game)
+            else:
+                match = fetcher.fetch_match(game_id)
+            if match is None:
+                # keep what is known until it loads again
+                return None
+            return listing_hash, Cbf.match_hash(match), match
+
+        loaded = {game_id: result for game_id, result
+                  in zip(listing, fetcher._map(load, listing))
+                  if result is not None}
+        changes = self._diff(comp_id, stored, {
+            game_id: (match_hash, match)
+            for game_id, (_, match_hash, match) in loaded.items()})
+        removed = [match_id for match_id in stored if match_id not in listing]
+        changes += [self._change(change_removed, comp_id, stored[match_id].match)
+                    for match_id in removed]
+        with self._connect() as connection:
+            self._store(connection, comp_id, team_id, loaded, removed)
+            self._record(connection, changes)
+        return changes
+
+    def _diff(self, phase_id: int, stored: Dict[int, StoredMatch],
+              matches: Dict[int, Tuple[str, Cbf.Match]]) -> List[Change]:
+        changes = []
+        for match_id, (match_hash, match) in matches.items():
+            previous = stored.get(match_id)
+            if previous is not None and previous.match_hash == match_hash:
+                continue
+            for kind in match_changes(
+                    previous.match if previous is not None else None, match):
+                changes.append(self._change(kind, phase_id, match))
+        return changes
+
+    @staticmethod
+    def _change(kind: str, phase_id: int, match: Cbf.Match) -> Change:
+        return Change(None, kind, phase_id, match.id,
+                      (match.home_team.id, match.visiting_team.id),
+                      match.start)
+
+    @staticmethod
+    def _store(connection: sqlite3.Connection, phase_id: int, team_id: int,
+               matches: Dict[int, Tuple[Optional[str], str, Cbf.Match]],
+               removed: List[int]) -> None:
+        connection.executemany(
+            'DELETE FROM matches '
+            'WHERE phase_id = ? AND team_id = ? AND match_id = ?',
+            [(phase_id, team_id, match_id) for match_id in removed])
+        rows = []
+        for match_id, (listing_hash, match_hash, match) in matches.items():
+            data = Cbf.match_to_dict(match)
+            rows.append((phase_id, team_id, match_id, data['start'],
+                         listing_hash, match_hash,
+                         json.dumps(data, ensure_ascii=False)))
+        connection.executemany(
+            'INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows)
+
+    def _record(self, connection: sqlite3.Connection,
+                changes: List[Change]) -> None:
+        now = time.time()
+        connection.executemany(
+            'INSERT INTO changes (recorded_at, kind, phase_id, match_id, '
+            'team_ids, start) VALUES (?, ?, ?, ?, ?, ?)',
+            [(now, change.kind, change.phase_id, change.match_id,
+              json.dumps(change.team_ids),
+              change.start.astimezone(pytz.utc).isoformat()
+              if change.start is not None else None)
+             for change in changes])
+        connection.execute('DELETE FROM changes WHERE recorded_at < ?',
+                           (now - self.change_retention,))
+
+    def changes(self, since: int = 0,
+                limit: Optional[int] = None) -> List[Change]:
+        """Changes recorded after the one numbered since, oldest first."""
+        query = ('SELECT seq, kind, phase_id, match_id, team_ids, start '
+                 'FROM changes WHERE seq > ? ORDER BY seq')
+        params: list = [since]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [Change(seq, kind, phase_id, match_id,
+                       tuple(json.loads(team_ids)),
+                       datetime.fromisoformat(start).astimezone(
+                           Cbf.cz_timezone) if start is not None else None)
+                for seq, kind, phase_id, match_id, team_ids, start in rows]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ČBF incremental sync')
+    parser.add_argument('--db', default=default_delta_sync_path,
+                        help='path of the sync database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync = commands.add_parser('sync', help='sync given seasons')
+    sync.add_argument('years', type=int, nargs='+')
+    sync.add_argument('--area', type=int, action='append',
+                      help='area codes (see Cbf.areas), national by default')
+    team = commands.add_parser(
+        'sync-team', help='sync matches of a team in a competition')
+    team.add_argument('comp_id', type=int)
+    team.add_argument('team_id', type=int)
+    changes = commands.add_parser('changes', help='print the change feed')
+    changes.add_argument('--since', type=int, default=0,
+                         help='sequence number of the last change seen')
+    args = parser.parse_args()
+
+    delta_sync = DeltaSync(args.db)
+    if args.command == 'sync':
+        for year in args.years:
+            for area in args.area or [0]:
+                found = delta_sync.sync_season(year, area)
+                print(f'{year} area {area}: {len(found)} changes')
+    elif args.command == 'sync-team':
+        found = delta_sync.sync_team(args.team_id, args.comp_id)
+        print(f'{len(found)} changes')
+    else:
+        for change in delta_sync.changes(args.since):
+            print(change.seq, change.kind, change.phase_id, change.match_id,
+                  change.start, ','.join(map(str, change.team_ids)), sep='\t')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Minimal Prometheus style metrics (counters, gauges and histograms rendered in
+the text exposition format) and per-request timings for Server-Timing.
+"""
+
+import abc
+import bisect
+import contextlib
+import contextvars
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, \
+    Sequence, Tuple
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30)
+
+LabelValues = Tuple[str, ...]
+# (labels, value) of one sample
+Sample = Tuple[Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n') + '"'
+        for name, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        """(sample name, labels, value) of every sample."""
+
+    def render(self) -> List[str]:
+        lines = ['# HELP ' + self.name + ' ' + self.help,
+                 '# TYPE ' + self.name + ' ' + self.type]
+        for name, labels, value in self.samples():
+            lines.append(name + _format_labels(labels) + ' ' +
+                         _format_value(value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._label_values(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: counts of buckets (last one being +Inf) and sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = [(key, list(counts), total[0])
+                      for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + '_bucket', \
+                    dict(labels, le=_format_value(bound)), cumulative
+            yield self.name + '_count', labels, cumulative
+            yield self.name + '_sum', labels, total
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        # called on every render, to export values kept elsewhere
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str,
+                labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = default_buckets) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for collector in collectors:
+            metrics.extend(collector())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Timings:
+    """Durations spent in named parts of handling a request (thread-safe)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._durations: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._durations[name] = self._durations.get(name, 0) + seconds
+
+    def server_timing(self) -> str:
+        """
+        Value of the Server-Timing header. Parts done concurrently (like
+        upstream fetches) are summed up, so they can exceed the total.
+        """
+        with self._lock:
+            durations = list(self._durations.items())
+        durations.append(('total', time.perf_counter() - self.started))
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}'
+                         for name, seconds in durations)
+
+
+_timings: contextvars.ContextVar[Optional[Timings]] = \
+    contextvars.ContextVar('timings', default=None)
+
+
+def start_timings() -> Tuple[Timings, contextvars.Token]:
+    timings = Timings()
+    return timings, _timings.set(timings)
+
+
+def stop_timings(token: contextvars.Token) -> None:
+    _timings.reset(token)
+
+
+def record_timing(name: str, seconds: float) -> None:
+    """Adds to the timings of the current request, if there is one."""
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextlib.contextmanager
+def timed(name: str, histogram: Optional[Histogram] = None,
+          **labels: str) -> Iterator[None]:
+    """Times the block into the request timings (and given histogram)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        record_timing(name, elapsed)
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import time
+from typing import Iterable, Iterator, List, Optional
+import Cbf
+from sqlite_store import SqliteStore
+
+default_referee_index_path = os.environ.get(
+    'CBF_REFEREE_INDEX',
+    os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                 'cbf_referee_index.sqlite'))
+
+# roles of a referee in a match
+role_referee = 'referee'
+role_supervisor = 'supervisor'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS phases (
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    phase_id INTEGER NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (season, area, phase_id)
+);
+CREATE TABLE IF NOT EXISTS matches (
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    phase_id INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    start TEXT,
+    match TEXT NOT NULL,
+    PRIMARY KEY (season, area, phase_id, match_id)
+);
+CREATE TABLE IF NOT EXISTS referee_matches (
+    referee_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    phase_id INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    PRIMARY KEY (referee_id, season, area, phase_id, match_id, role)
+);
+CREATE INDEX IF NOT EXISTS referee_matches_by_phase
+    ON referee_matches (season, area, phase_id);
+'''
+
+
+class RefereeIndex(SqliteStore):
+    """
+    Persistent (SQLite) inverted index from referees (and supervisors) to the
+    matches they officiate, built from the phase schedules of a season. A
+    referee's matches are then a single indexed lookup.
+    """
+
+    schema = schema
+
+    def __init__(self, path: str = default_referee_index_path):
+        super().__init__(path)
+
+    def refresh(self, year: int, area: int = 0,
+                max_age: Optional[float] = None, full: bool = False,
+                fetcher: Optional[Cbf.CbfApiFetcher_v1] = None) -> int:
+        """
+        Brings the index of given season and area up to date. Only phases not
+        indexed yet (or indexed more than max_age seconds ago) have their
+        schedules fetched, unless full is set. Phases no longer listed are
+        removed. Returns number of phases (re)indexed.
+        """
+        if fetcher is None:
+            fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint)
+        season = fetcher.fetch_season(year, area, prefetch=())
+        if season is None:
+            return 0
+        listed_phases = [phase for division in season.divisions
+                         for phase in division.phases]
+
+        now = time.time()
+        with self._connect() as connection:
+            indexed_at = dict(connection.execute(
+                'SELECT phase_id, indexed_at FROM phases '
+                'WHERE season = ? AND area = ?', (year, area)).fetchall())
+        stale_phases = [
+            phase for phase in listed_phases
+            if full or phase.id not in indexed_at or
+            (max_age is not None and now - indexed_at[phase.id] > max_age)
+        ]
+        loaded = fetcher.prefetch(stale_phases, ('schedule',))
+
+        removed_phase_ids = set(indexed_at) - \
+            {phase.id for phase in listed_phases}
+        for phase_id in removed_phase_ids:
+            self._remove_phase(year, area, phase_id)
+        for phase in loaded:
+            self.index_schedule(year, area, phase.schedule, now)
+        return len(loaded)
+
+    def _remove_phase(self, year: int, area: int, phase_id: int,
+                      connection: Optional[sqlite3.Connection] = None) -> None:
+        with contextlib.ExitStack() as stack:
+            if connection is None:
+                connection = stack.enter_context(self._connect())
+            for table in ('phases', 'matches', 'referee_matches'):
+                connection.execute(
+                    'DELETE FROM ' + table +
+                    ' WHERE season = ? AND area = ? AND phase_id = ?',
+                    (year, area, phase_id))
+
+    def index_schedule(self, year: int, area: int, schedule: Cbf.Schedule,
+                       now: Optional[float] = None) -> None:
+        """(Re)indexes the matches of one phase schedule."""
+        if now is None:
+            now = time.time()
+        with self._connect() as connection:
+            self._remove_phase(year, area, schedule.phase_id, connection)
+            connection.execute(
+                'INSERT INTO phases VALUES (?, ?, ?, ?)',
+                (year, area, schedule.phase_id, now))
+            stored = [Cbf.match_to_dict(match) for match in schedule.matches]
+            # starts are stored in UTC, so that they sort
+            connection.executemany(
+                'INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)',
+                [(year, area, schedule.phase_id, data['id'], data['start'],
+                  json.dumps(data, ensure_ascii=False)) for data in stored])
+            connection.executemany(
+                'INSERT OR IGNORE INTO referee_matches VALUES (?, ?, ?, ?, ?, ?)',
+                [(referee.id, role, year, area, schedule.phase_id, match.id)
+                 for match in schedule.matches
+                 for role, referee in _officials(match)])
+
+    def matches(self, referee_id: int, year: Optional[int] = None,
+                roles: Iterable[str] = (role_referee, role_supervisor)) \
+            -> List[Cbf.Match]:
+        """Matches officiated by the referee in given roles, by start."""
+        roles = list(roles)
+        query = ('SELECT DISTINCT matches.match_id, matches.start, match '
+                 'FROM referee_matches JOIN matches '
+                 'USING (season, area, phase_id, match_id) '
+                 'WHERE referee_id = ? AND role IN (' +
+                 ', '.join(['?'] * len(roles)) + ')')
+        params: list = [referee_id, *roles]
+        if year is not None:
+            query += ' AND referee_matches.season = ?'
+            params.append(year)
+        query += ' ORDER BY matches.start, matches.match_id'
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [Cbf.match_from_dict(json.loads(match)) for _, _, match in rows]
+
+
+def _officials(match: Cbf.Match) -> Iterator[tuple]:
+    """(role, referee) pairs of everyone officiating the match."""
+    for referee in match.refs:
+        yield role_referee, referee
+    if match.supervisor is not None:
+        yield role_supervisor, match.supervisor
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ČBF referee index')
+    parser.add_argument('--db', default=default_referee_index_path,
+                        help='path of the index database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    refresh = commands.add_parser(
+        'refresh', help='index (new or changed phases of) given seasons')
+    refresh.add_argument('years', type=int, nargs='+')
+    refresh.add_argument('--area', type=int, action='append',
+                         help='area codes (see Cbf.areas), national by default')
+    refresh.add_argument('--max-age', type=float,
+                         help='reindex phases older than this many hours')
+    refresh.add_argument('--full', action='store_true',
+                         help='reindex all phases')
+    matches = commands.add_parser('matches', help='matches of a referee')
+    matches.add_argument('referee_id', type=int)
+    matches.add_argument('--year', type=int)
+    args = parser.parse_args()
+
+    index = RefereeIndex(args.db)
+    if args.command == 'refresh':
+        max_age = None if args.max_age is None else args.max_age * 60 * 60
+        for year in args.years:
+            for area in args.area or [0]:
+                indexed = index.refresh(year, area, max_age, args.full)
+                print(f'{year} area {area}: indexed {indexed} phases')
+    else:
+        for match in index.matches(args.referee_id, args.year):
+            print(match.id, match.start, match.home_team.name,
+                  match.visiting_team.name, sep='\t')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+import Cbf
+
+logger = logging.getLogger(__name__)
+
+# (route, phase id, team id), team id None for the routes refreshed per phase
+CalendarKey = Tuple[str, int, Optional[int]]
+# loads matches of a calendar (of the whole phase for team id None), with
+# refresh set bypassing fresh cached data
+CalendarLoader = Callable[[int, Optional[int], bool],
+                          Optional[List[Cbf.Match]]]
+
+# upstream endpoints the calendars of a route are loaded from
+route_endpoints: Dict[str, Tuple[str, ...]] = {
+    'v1': ('sched.php',),
+    'v2': ('team.php', 'game.php'),
+}
+
+
+def refresh_interval_for(endpoints: Tuple[str, ...]) -> float:
+    """Refreshes a bit ahead of the first of the endpoints expiring."""
+    return min((Cbf.default_cache_ttls.get(endpoint, Cbf.default_cache_ttl)
+                for endpoint in endpoints), default=Cbf.default_cache_ttl) * 0.8
+
+
+default_refresh_interval = refresh_interval_for(())
+default_refresh_intervals: Dict[str, float] = {
+    route: refresh_interval_for(endpoints)
+    for route, endpoints in route_endpoints.items()}
+# routes whose calendars of a phase all read the same upstream data (the
+# phase schedule), so they are refreshed once for the whole phase
+default_phase_routes = ('v1',)
+default_match_day_refresh_interval = Cbf.match_day_cache_ttl * 0.8
+default_hot_calendars = 100
+# polls older than this count half
+default_popularity_half_life = 6 * 60 * 60
+default_tick = 10
+
+
+class CalendarStats:
+    __slots__ = ('popularity', 'last_poll', 'last_refresh', 'match_day')
+
+    def __init__(self, now: float):
+        self.popularity = 0.0
+        self.last_poll = now
+        self.last_refresh = now
+        self.match_day = False
+
+
+class RefreshScheduler:
+    """
+    Tracks how often are the calendars polled and keeps the most popular ones
+    warm in the background, refreshing them before their cached upstream data
+    expires (more often on match days). The refresh interval is per route
+    (refresh_intervals), routes missing there use refresh_interval. Calendars
+    of phase_routes are tracked (and refreshed) per phase, popularity of
+    their teams adding up. Meant to run as a daemon thread in the app
+    process.
+    """
+
+    def __init__(self, loaders: Dict[str, CalendarLoader],
+                 hot_calendars: int = default_hot_calendars,
+                 refresh_interval: float = default_refresh_interval,
+                 refresh_intervals: Optional[Dict[str, float]] = None,
+                 match_day_refresh_interval: float = default_match_day_refresh_interval,
+                 popularity_half_life: float = default_popularity_half_life,
+                 phase_routes: Collection[str] = default_phase_routes,
+                 tick: float = default_tick):
+        self.loaders = loaders
+        self.hot_calendars = hot_calendars
+        self.refresh_interval = refresh_interval
+        self.refresh_intervals = dict(default_refresh_intervals
+                                      if refresh_intervals is None
+                                      else refresh_intervals)
+        self.match_day_refresh_interval = match_day_refresh_interval
+        self.popularity_half_life = popularity_half_life
+        self.phase_routes = frozenset(phase_routes)
+        self.tick = tick
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._calendars: Dict[CalendarKey, CalendarStats] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _decay(self, stats: CalendarStats, now: float) -> float:
+        return stats.popularity * \
+            0.5 ** ((now - stats.last_poll) / self.popularity_half_life)
+
+    def record(self, key: CalendarKey,
+               matches: Optional[List[Cbf.Match]] = None) -> None:
+        """Counts a poll of the calendar (with the matches it was served)."""
+        now = time.monotonic()
+        route, phase_id, _ = key
+        per_phase = route in self.phase_routes
+        if per_phase:
+            key = (route, phase_id, None)
+        with self._lock:
+            stats = self._calendars.get(key)
+            if stats is None:
+                stats = self._calendars[key] = CalendarStats(now)
+            stats.popularity = self._decay(stats, now) + 1
+            stats.last_poll = now
+            if matches is not None:
+                # matches of one team tell a match day of the phase, but not
+                # that there is none - that is up to the refresh of the phase
+                stats.match_day = (per_phase and stats.match_day) or \
+                    Cbf.is_match_day(matches)
+            if len(self._calendars) > 10 * self.hot_calendars:
+                self._forget_coldest(now)
+
+    def _forget_coldest(self, now: float) -> None:
+        ranked = sorted(self._calendars.items(),
+                        key=lambda item: self._decay(item[1], now),
+                        reverse=True)
+        self._calendars = dict(ranked[:2 * self.hot_calendars])
+
+    def hottest(self) -> List[CalendarKey]:
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(self._calendars.items(),
+                            key=lambda item: self._decay(item[1], now),
+                            reverse=True)
+        return [key for key, _ in ranked[:self.hot_calendars]]
+
+    def due(self) -> List[CalendarKey]:
+        """Hot calendars whose data should be refreshed now."""
+        now = time.monotonic()
+        due = []
+        for key in self.hottest():
+            with self._lock:
+                stats = self._calendars.get(key)
+                if stats is None:
+                    continue
+                interval = self.match_day_refresh_interval \
+                    if stats.match_day else self.refresh_intervals.get(
+                        key[0], self.refresh_interval)
+                if now - stats.last_refresh >= interval:
+                    due.append(key)
+        return due
+
+    def refresh(self, key: CalendarKey) -> None:
+        route, phase_id, team_id = key
+        failed = False
+        try:
+            matches = self.loaders[route](phase_id, team_id, True)
+        except Exception:
+            failed = True
+            logger.exception('Refreshing calendar %s failed', key)
+            matches = None
+        with self._lock:
+            self.refreshes += 1
+            if failed:
+                self.refresh_errors += 1
+            stats = self._calendars.get(key)
+            if stats is not None:
+                stats.last_refresh = time.monotonic()
+                if matches is not None:
+                    stats.match_day = Cbf.is_match_day(matches)
+
+    def run_once(self) -> None:
+        for key in self.due():
+            if self._stop.is_set():
+                return
+            self.refresh(key)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.tick):
+            self.run_once()
+
+    def start(self) -> None:
+        """Starts the background thread, unless running already."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='calendar-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Parsed upstream data (schedules, standings, match details and the season
+list) shared by all processes of the app through an SQLite file in WAL
+mode, so that e.g. mod_wsgi daemon processes fetch and parse every response
+once between them, and a freshly started process reads the data of the
+others instead of upstream. The fetchers use it once installed as
+Cbf.shared_cache.
+"""
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import Cbf
+
+logger = logging.getLogger(__name__)
+
+default_shared_cache_path = os.environ.get(
+    'CBF_SHARED_CACHE',
+    os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                 'cbf_shared_cache.sqlite'))
+# refreshing fetchers (like the refresh scheduler of every process) take
+# entries stored this recently as refreshed already
+default_refresh_window = 60
+# expired entries are deleted this long after expiring
+default_retention = 24 * 60 * 60
+# deletion of old entries is attempted every this many stores
+prune_every = 100
+
+schema = '''
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS entries_by_expiry ON entries (expires_at);
+'''
+
+
+def _encode_schedule(schedule: Cbf.Schedule):
+    return {'phase_id': schedule.phase_id,
+            'matches': [Cbf.match_to_dict(match) for match in schedule.matches]}
+
+
+def _decode_schedule(data) -> Cbf.Schedule:
+    return Cbf.Schedule(data['phase_id'], [Cbf.match_from_dict(match)
+                                           for match in data['matches']])
+
+
+def _encode_standings(standings: Cbf.Standings):
+    return {'phase_id': standings.phase_id,
+            'team_standings': [dataclasses.asdict(team_standing) for
+                               team_standing in standings.team_standings]}
+
+
+def _decode_standings(data) -> Cbf.Standings:
+    return Cbf.Standings(data['phase_id'], [
+        Cbf.TeamStanding(**team_standing)
+        for team_standing in data['team_standings']])
+
+
+def _encode_season_list(season_list: List[Cbf.SeasonDescription]):
+    return [vars(season_description) for season_description in season_list]
+
+
+def _decode_season_list(data) -> List[Cbf.SeasonDescription]:
+    return [Cbf.SeasonDescription(**season_description)
+            for season_description in data]
+
+
+# kind -> (upstream endpoint the ttl is taken from, encode, decode)
+kinds: Dict[str, Tuple[str, Callable, Callable]] = {
+    'schedule': ('sched.php', _encode_schedule, _decode_schedule),
+    'standings': ('table.php', _encode_standings, _decode_standings),
+    'match': ('game.php', Cbf.match_to_dict, Cbf.match_from_dict),
+    'season_list': ('seasonList.php', _encode_season_list,
+                    _decode_season_list),
+}
+
+
+def _matches_of(kind: str, value) -> List[Cbf.Match]:
+    if kind == 'schedule':
+        return value.matches
+    if kind == 'match':
+        return [value]
+    return []
+
+
+class SharedCache:
+    """
+    Store of parsed upstream data by kind (see kinds) and key, each entry
+    fresh for the ttl of its upstream endpoint (shorter on match days). It
+    is only a cache - failing to read or write it (e.g. when locked for too
+    long) is logged and treated as a miss.
+    """
+
+    def __init__(self, path: str = default_shared_cache_path,
+                 ttls: Optional[Dict[str, float]] = None,
+                 refresh_window: float = default_refresh_window,
+                 retention: float = default_retention):
+        self.path = path
+        self.ttls = dict(Cbf.default_cache_ttls if ttls is None else ttls)
+        self.refresh_window = refresh_window
+        self.retention = retention
+        self._local = threading.local()
+        self._stores = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        connection = self._connection()
+        # WAL lets the processes read while one of them writes
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(schema)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connection of the current thread (of the current process)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _ttl(self, kind: str, value) -> float:
+        endpoint = kinds[kind][0]
+        ttl = self.ttls.get(endpoint, Cbf.default_cache_ttl)
+        if Cbf.is_match_day(_matches_of(kind, value)):
+            ttl = min(ttl, Cbf.match_day_cache_ttl)
+        return ttl
+
+    def get(self, kind: str, key: str, refresh: bool = False):
+        """
+        Fresh value stored under kind and key, None if there is none. With
+        refresh only values stored within refresh_window are returned.
+        """
+        now = time.time()
+        try:
+            row = self._connection().execute(
+                'SELECT stored_at, expires_at, value FROM entries '
+                'WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        except sqlite3.Error:
+            logger.exception('Reading shared cache %s failed', self.path)
+            row = None
+        if row is not None:
+            stored_at, expires_at, value = row
+            if now < expires_at and \
+                    (not refresh or now - stored_at < self.refresh_window):
+                with self._lock:
+                    self.hits += 1
+                return kinds[kind][2](json.loads(value))
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, kind: str, key: str, value) -> None:
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                (kind, key, now, now + self._ttl(kind, value),
+                 json.dumps(kinds[kind][1](value), ensure_ascii=False)))
+            with self._lock:
+                self._stores += 1
+                prune = self._stores % prune_every == 0
+            if prune:
+                self.prune(now)
+        except sqlite3.Error:
+            logger.exception('Writing shared cache %s failed', self.path)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Deletes entries expired more than retention ago, returns how many."""
+        if now is None:
+            now = time.time()
+        return self._connection().execute(
+            'DELETE FROM entries WHERE expires_at < ?',
+            (now - self.retention,)).rowcount
+
+    def clear(self) -> None:
+        self._connection().execute('DELETE FROM entries')
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Fresh and expired entries by kind."""
+        now = time.time()
+        rows = self._connection().execute(
+            'SELECT kind, expires_at > ?, COUNT(*) FROM entries '
+            'GROUP BY kind, expires_at > ?', (now, now)).fetchall()
+        stats: Dict[str, Dict[str, int]] = {}
+        for kind, fresh, count in rows:
+            stats.setdefault(kind, {'fresh': 0, 'expired': 0})[
+                'fresh' if fresh else 'expired'] = count
+        return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ČBF shared cache')
+    parser.add_argument('--path', default=default_shared_cache_path,
+                        help='path of the cache database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('info', help='count the cached entries')
+    commands.add_parser('prune', help='delete long expired entries')
+    commands.add_parser('clear', help='delete all entries')
+    args = parser.parse_args()
+
+    cache = SharedCache(args.path)
+    if args.command == 'prune':
+        print(f'deleted {cache.prune()} entries')
+    elif args.command == 'clear':
+        cache.clear()
+    else:
+        for kind, counts in sorted(cache.stats().items()):
+            print(kind, counts['fresh'], 'fresh', counts['expired'],
+                  'expired', sep='\t')
+
+
+if __name__ == '__main__':
+    main()
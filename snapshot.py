@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Season snapshots - everything the app serves (divisions, phases, schedules
+with teams and referees, standings, the season list) crawled ahead into one
+file, so that the app can answer without calling ČBF at all.
+
+The file is the magic, format version and header length, followed by a
+JSON header (the divisions and phases with offsets of their records and the
+teams for searching) and zlib compressed JSON records of the schedules and
+standings. It is memory-mapped and only the records asked for are decoded.
+"""
+
+import argparse
+import dataclasses
+import functools
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import Cbf
+import crawler
+import team_index
+
+logger = logging.getLogger(__name__)
+
+magic = b'CBFSNAP\0'
+format_version = 1
+# magic, format version, header length
+preamble = struct.Struct('<8sIQ')
+
+default_snapshot_path = os.environ.get(
+    'CBF_SNAPSHOT',
+    os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                 'cbf_snapshot.bin'))
+# how often is the file checked for being replaced by a newer snapshot
+default_check_interval = 1.0
+# decoded schedules and standings kept per snapshot
+default_decoded_records = 256
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_snapshot(path: str, seasons: Iterable[Tuple[int, Cbf.Season]],
+                   season_list: List[Cbf.SeasonDescription]) -> None:
+    """
+    Writes (area, season) pairs into a snapshot at path. The file is written
+    aside and moved in place, so readers see either the old or the new one.
+    """
+    records = bytearray()
+
+    def add_record(data) -> List[int]:
+        compressed = zlib.compress(
+            json.dumps(data, ensure_ascii=False).encode())
+        offset = len(records)
+        records.extend(compressed)
+        return [offset, len(compressed)]
+
+    divisions = []
+    phases: Dict[str, dict] = {}
+    teams = []
+    years = []
+    for area, season in seasons:
+        years.append({'year': season.year, 'area': area})
+        for division in season.divisions:
+            divisions.append({'season': season.year, 'area': area,
+                              'id': division.id, 'name': division.name,
+                              'phases': [phase.id for phase in division.phases]})
+            for phase in division.phases:
+                phases[str(phase.id)] = {
+                    'name': phase.name, 'season': season.year, 'area': area,
+                    'division_id': division.id,
+                    'schedule': add_record(
+                        [Cbf.match_to_dict(match)
+                         for match in phase.schedule.matches]),
+                    'standings': add_record(
+                        [dataclasses.asdict(team_standing) for team_standing
+                         in phase.standings.team_standings]),
+                }
+                teams.extend([season.year, area, phase.id, team_standing.id,
+                              team_standing.name]
+                             for team_standing in phase.standings.team_standings)
+    header = json.dumps({
+        'created': time.time(),
+        'seasons': years,
+        'season_list': [vars(season_description)
+                        for season_description in season_list],
+        'divisions': divisions,
+        'phases': phases,
+        'teams': teams,
+    }, ensure_ascii=False).encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory,
+                                                  suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            # mkstemp makes the file private, the app may run as another user
+            os.fchmod(file.fileno(), 0o644 & ~_umask())
+            file.write(preamble.pack(magic, format_version, len(header)))
+            file.write(header)
+            file.write(records)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+class Snapshot:
+    """Read access to a snapshot file, records are decoded on demand."""
+
+    def __init__(self, path: str,
+                 decoded_records: int = default_decoded_records):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < preamble.size:
+            raise SnapshotError(path + ' is not a snapshot')
+        file_magic, version, header_length = \
+            preamble.unpack_from(self._map, 0)
+        if file_magic != magic:
+            raise SnapshotError(path + ' is not a snapshot')
+        if version != format_version:
+            raise SnapshotError(
+                f'{path} has format {version}, expected {format_version}')
+        header_end = preamble.size + header_length
+        header = json.loads(self._map[preamble.size:header_end])
+        self._records_start = header_end
+        self.created: float = header['created']
+        self.seasons: List[Tuple[int, int]] = [
+            (season['year'], season['area']) for season in header['seasons']]
+        self._season_list = header['season_list']
+        self._divisions = header['divisions']
+        self._phases: Dict[int, dict] = {
+            int(phase_id): phase for phase_id, phase in header['phases'].items()}
+        self._teams = [(season, area, phase_id, team_id, team_name,
+                        Cbf.normalize_team_name(team_name))
+                       for season, area, phase_id, team_id, team_name
+                       in header['teams']]
+        self._cached_load = functools.lru_cache(maxsize=decoded_records)(
+            self._load)
+
+    def _load(self, part: str, phase_id: int):
+        phase = self._phases.get(phase_id)
+        if phase is None:
+            return None
+        offset, length = phase[part]
+        start = self._records_start + offset
+        records = json.loads(zlib.decompress(self._map[start:start + length]))
+        if part == 'schedule':
+            return Cbf.Schedule(phase_id, [Cbf.match_from_dict(match)
+                                           for match in records])
+        return Cbf.Standings(phase_id, [Cbf.TeamStanding(**team_standing)
+                                        for team_standing in records])
+
+    def phase_ids(self) -> List[int]:
+        return list(self._phases)
+
+    def schedule(self, phase_id: int) -> Optional[Cbf.Schedule]:
+        return self._cached_load('schedule', phase_id)
+
+    def standings(self, phase_id: int) -> Optional[Cbf.Standings]:
+        return self._cached_load('standings', phase_id)
+
+    def season(self, year: int, area: int = 0) -> Optional[Cbf.Season]:
+        """The whole season, all phases loaded."""
+        if (year, area) not in self.seasons:
+            return None
+        return Cbf.Season(year, [
+            Cbf.Division(division['id'], division['name'], [
+                Cbf.Phase(phase_id, self._phases[phase_id]['name'],
+                          self.schedule(phase_id), self.standings(phase_id))
+                for phase_id in division['phases']])
+            for division in self._divisions
+            if division['season'] == year and division['area'] == area])
+
+    def find_team(self, year: int, team_name: str,
+                  area: int = 0) -> List[Tuple[int, int]]:
+        """Same as team_index.find_team, from the snapshot."""
+        search_name = Cbf.normalize_team_name(team_name)
+        return [(phase_id, team_id)
+                for season, team_area, phase_id, team_id, _, name in self._teams
+                if season == year and team_area == area and search_name in name]
+
+    def search_teams(self, year: int, team_name: str,
+                     area: int = 0) -> List[team_index.IndexedTeam]:
+        """Same as team_index.TeamIndex.search, from the snapshot."""
+        division_names = {
+            (division['season'], division['area'], division['id']):
+                division['name'] for division in self._divisions}
+        search_name = Cbf.normalize_team_name(team_name)
+        found = []
+        for season, team_area, phase_id, team_id, name, normalized \
+                in self._teams:
+            if season != year or team_area != area or \
+                    search_name not in normalized:
+                continue
+            phase = self._phases[phase_id]
+            found.append(team_index.IndexedTeam(
+                season, team_area, phase['division_id'],
+                division_names[(season, team_area, phase['division_id'])],
+                phase_id, phase['name'], team_id, name))
+        return found
+
+    def season_list(self) -> List[Cbf.SeasonDescription]:
+        return [Cbf.SeasonDescription(**season_description)
+                for season_description in self._season_list]
+
+
+class SnapshotStore:
+    """
+    The snapshot at path, reopened when the file gets replaced by a newer
+    one. Requests holding the previous Snapshot keep using it, it is
+    unmapped once released.
+    """
+
+    def __init__(self, path: str = default_snapshot_path,
+                 check_interval: float = default_check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot: Optional[Snapshot] = None
+        self._identity: Optional[Tuple[int, int, int]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[Snapshot]:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._snapshot
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                if self._snapshot is None:
+                    logger.warning('No snapshot at %s', self.path)
+                return self._snapshot
+            identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+            if identity != self._identity:
+                try:
+                    self._snapshot = Snapshot(self.path)
+                    self._identity = identity
+                except (OSError, ValueError, SnapshotError):
+                    logger.exception('Loading snapshot %s failed', self.path)
+            return self._snapshot
+
+
+def export(path: str, years: List[int], areas: List[int],
+           fetcher: Optional[Cbf.CbfApiFetcher_v1] = None,
+           local_standings: bool = False,
+           crawl_store: Optional[crawler.CrawlStore] = None) -> List[Cbf.FetchError]:
+    """
+    Crawls the seasons (schedules and standings) into a snapshot. With
+    local_standings the standings are derived from the schedules (see
+    Cbf.compute_standings) instead of being fetched. With crawl_store the
+    seasons are taken from it instead (see crawler.py).
+    """
+    if fetcher is None:
+        fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint,
+                                       local_standings=local_standings)
+    seasons = []
+    errors: List[Cbf.FetchError] = []
+    for year in years:
+        for area in areas:
+            season = crawl_store.season(year, area) \
+                if crawl_store is not None else fetcher.fetch_season(year, area)
+            if season is None:
+                errors.append(Cbf.FetchError(
+                    None, f'Failed to fetch season {year} of area {area}'))
+                continue
+            errors.extend(season.errors)
+            seasons.append((area, season))
+    write_snapshot(path, seasons, Cbf.fetch_season_list())
+    return errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ČBF season snapshots')
+    parser.add_argument('--path', default=default_snapshot_path,
+                        help='path of the snapshot file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_command = commands.add_parser(
+        'export', help='crawl given seasons into the snapshot')
+    export_command.add_argument('years', type=int, nargs='+')
+    export_command.add_argument(
+        '--area', type=int, action='append',
+        help='area codes (see Cbf.areas), national by default')
+    export_command.add_argument(
+        '--local-standings', action='store_true',
+        help='derive the standings from the schedules instead of fetching '
+             'them (except divisions with special rules)')
+    export_command.add_argument(
+        '--from-crawl', metavar='DB', nargs='?',
+        const=crawler.default_crawl_store_path,
+        help='take the seasons from the store of crawler.py')
+    commands.add_parser('info', help='describe the snapshot')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        errors = export(args.path, args.years, args.area or [0],
+                        local_standings=args.local_standings,
+                        crawl_store=crawler.CrawlStore(args.from_crawl)
+                        if args.from_crawl else None)
+        for error in errors:
+            print('skipped phase', error.phase_id, error.message)
+    snapshot = Snapshot(args.path)
+    print(f'{args.path}: created {time.ctime(snapshot.created)}, '
+          f'{len(snapshot.phase_ids())} phases, '
+          f'{os.path.getsize(args.path)} bytes')
+    for year, area in snapshot.seasons:
+        print(f'season {year} area {area}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Base of the stores persisted in an SQLite file (the team and referee
+indexes, delta sync and the crawl store).
+"""
+
+import contextlib
+import sqlite3
+from typing import Iterator
+
+
+class SqliteStore:
+    """
+    Store in the SQLite file at path, its schema (a script of CREATE ... IF
+    NOT EXISTS statements) is created on opening. Every operation gets a
+    connection of its own, committed when the operation succeeds.
+    """
+
+    schema = ''
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as connection:
+            connection.executescript(self.schema)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import time
+from typing import List, Optional, Tuple
+import Cbf
+from sqlite_store import SqliteStore
+
+default_team_index_path = os.environ.get(
+    'CBF_TEAM_INDEX',
+    os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                 'cbf_team_index.sqlite'))
+
+schema = '''
+CREATE TABLE IF NOT EXISTS phases (
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    division_id INTEGER NOT NULL,
+    division_name TEXT NOT NULL,
+    phase_id INTEGER NOT NULL,
+    phase_name TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (season, area, phase_id)
+);
+CREATE TABLE IF NOT EXISTS teams (
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    phase_id INTEGER NOT NULL,
+    team_id INTEGER NOT NULL,
+    team_name TEXT NOT NULL,
+    search_name TEXT NOT NULL,
+    PRIMARY KEY (season, area, phase_id, team_id)
+);
+CREATE INDEX IF NOT EXISTS teams_by_name ON teams (season, search_name);
+CREATE TABLE IF NOT EXISTS seasons (
+    season INTEGER NOT NULL,
+    area INTEGER NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (season, area)
+);
+'''
+
+
+class IndexedTeam:
+    def __init__(self, season: int, area: int, division_id: int,
+                 division_name: str, phase_id: int, phase_name: str,
+                 team_id: int, team_name: str):
+        self.season = season
+        self.area = area
+        self.division_id = division_id
+        self.division_name = division_name
+        self.phase_id = phase_id
+        self.phase_name = phase_name
+        self.team_id = team_id
+        self.team_name = team_name
+
+
+class TeamIndex(SqliteStore):
+    """
+    Persistent (SQLite) index of teams playing in the phases of a season,
+    built from the standings. Lets find_team answer without crawling the
+    season from upstream.
+    """
+
+    schema = schema
+
+    def __init__(self, path: str = default_team_index_path):
+        super().__init__(path)
+
+    def has_season(self, year: int, area: int = 0) -> bool:
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT 1 FROM seasons WHERE season = ? AND area = ?',
+                (year, area)).fetchone()
+        return row is not None
+
+    def refresh(self, year: int, area: int = 0,
+                max_age: Optional[float] = None, full: bool = False,
+                fetcher: Optional[Cbf.CbfApiFetcher_v1] = None) -> int:
+        """
+        Brings the index of given season and area up to date. Only phases not
+        indexed yet (or indexed more than max_age seconds ago) have their
+        standings fetched, unless full is set. Phases no longer listed are
+        removed. The season counts as indexed (see has_season) only once all
+        of its listed phases are. Returns number of phases (re)indexed.
+        """
+        if fetcher is None:
+            fetcher = Cbf.CbfApiFetcher_v1(Cbf.cbf_api_endpoint)
+        # just the list of divisions, standings are prefetched below
+        season = fetcher.fetch_season(year, area, prefetch=())
+        if season is None:
+            return 0
+        listed_phases = [(division, phase) for division in season.divisions
+                         for phase in division.phases]
+
+        now = time.time()
+        with self._connect() as connection:
+            indexed_at = dict(connection.execute(
+                'SELECT phase_id, indexed_at FROM phases '
+                'WHERE season = ? AND area = ?', (year, area)).fetchall())
+        stale_phases = [
+            (division, phase) for division, phase in listed_phases
+            if full or phase.id not in indexed_at or
+            (max_age is not None and now - indexed_at[phase.id] > max_age)
+        ]
+        loaded = {phase.id for phase in fetcher.prefetch(
+            [phase for _, phase in stale_phases], ('standings',))}
+
+        removed_phase_ids = set(indexed_at) - \
+            {phase.id for _, phase in listed_phases}
+        with self._connect() as connection:
+            for table in ('phases', 'teams'):
+                connection.executemany(
+                    'DELETE FROM ' + table +
+                    ' WHERE season = ? AND area = ? AND phase_id = ?',
+                    [(year, area, phase_id) for phase_id in removed_phase_ids])
+            indexed = 0
+            for division, phase in stale_phases:
+                if phase.id not in loaded:
+                    # keep what we have, it will be retried on next refresh
+                    continue
+                connection.execute(
+                    'INSERT OR REPLACE INTO phases VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (year, area, division.id, division.name,
+                     phase.id, phase.name, now))
+                connection.execute(
+                    'DELETE FROM teams WHERE season = ? AND area = ? '
+                    'AND phase_id = ?', (year, area, phase.id))
+                connection.executemany(
+                    'INSERT OR REPLACE INTO teams VALUES (?, ?, ?, ?, ?, ?)',
+                    [(year, area, phase.id, team_standing.id,
+                      team_standing.name,
+                      Cbf.normalize_team_name(team_standing.name))
+                     for team_standing in phase.standings.team_standings])
+                indexed += 1
+            if all(phase.id in indexed_at or phase.id in loaded
+                   for _, phase in listed_phases):
+                connection.execute(
+                    'INSERT OR REPLACE INTO seasons VALUES (?, ?, ?)',
+                    (year, area, now))
+        return indexed
+
+    def search(self, team_name: str, year: Optional[int] = None,
+               area: Optional[int] = None) -> List[IndexedTeam]:
+        """Teams whose name contains team_name, ignoring case and diacritics."""
+        query = ('SELECT teams.season, teams.area, division_id, division_name, '
+                 'teams.phase_id, phase_name, team_id, team_name '
+                 'FROM teams JOIN phases USING (season, area, phase_id) '
+                 "WHERE search_name LIKE ? ESCAPE '\\'")
+        params: list = ['%' + _escape_like(
+            Cbf.normalize_team_name(team_name)) + '%']
+        if year is not None:
+            query += ' AND teams.season = ?'
+            params.append(year)
+        if area is not None:
+            query += ' AND teams.area = ?'
+            params.append(area)
+        query += ' ORDER BY teams.season, teams.area, division_id, ' \
+                 'teams.phase_id, team_id'
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [IndexedTeam(*row) for row in rows]
+
+    def find_team(self, year: int, team_name: str,
+                  area: int = 0) -> List[Tuple[int, int]]:
+        return [(team.phase_id, team.team_id)
+                for team in self.search(team_name, year, area)]
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def find_team(year: int, team_name: str,
+              index: Optional[TeamIndex] = None) -> List[Tuple[int, int]]:
+    """
+    Cbf.find_team answered from the index, the season is indexed (standings
+    only) on first use.
+    """
+    if index is None:
+        index = TeamIndex()
+    if not index.has_season(year):
+        index.refresh(year)
+    return index.find_team(year, team_name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ČBF team index')
+    parser.add_argument('--db', default=default_team_index_path,
+                        help='path of the index database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    refresh = commands.add_parser(
+        'refresh', help='index (new or changed phases of) given seasons')
+    refresh.add_argument('years', type=int, nargs='+')
+    refresh.add_argument('--area', type=int, action='append',
+                         help='area codes (see Cbf.areas), national by default')
+    refresh.add_argument('--max-age', type=float,
+                         help='reindex phases older than this many hours')
+    refresh.add_argument('--full', action='store_true',
+                         help='reindex all phases')
+    search = commands.add_parser('search', help='search indexed teams')
+    search.add_argument('name')
+    search.add_argument('--year', type=int)
+    search.add_argument('--area', type=int)
+    args = parser.parse_args()
+
+    index = TeamIndex(args.db)
+    if args.command == 'refresh':
+        max_age = None if args.max_age is None else args.max_age * 60 * 60
+        for year in args.years:
+            for area in args.area or [0]:
+                indexed = index.refresh(year, area, max_age, args.full)
+                print(f'{year} area {area}: indexed {indexed} phases')
+    else:
+        for team in index.search(args.name, args.year, args.area):
+            print(team.season, team.area, team.division_name, team.phase_name,
+                  team.phase_id, team.team_id, team.team_name, sep='\t')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import io
+import types
+import urllib.error
+
+import pytest
+
+import Cbf
+
+reset_timeout = 30
+url = 'http://upstream/xml/sched.php?p=1'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(Cbf, 'time', types.SimpleNamespace(
+        monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def breaker(clock) -> Cbf.CircuitBreaker:
+    return Cbf.CircuitBreaker(failure_threshold=3,
+                              reset_timeout=reset_timeout)
+
+
+def fail(breaker: Cbf.CircuitBreaker, error: Exception) -> None:
+    with pytest.raises(type(error)):
+        with breaker.guard(url):
+            raise error
+
+
+def test_opens_after_failures_in_a_row(breaker):
+    for _ in range(2):
+        fail(breaker, ConnectionResetError())
+    assert breaker.state('sched.php') == 'closed'
+    fail(breaker, ConnectionResetError())
+    assert breaker.state('sched.php') == 'open'
+    with pytest.raises(Cbf.UpstreamUnavailable):
+        breaker.allow('sched.php')
+
+
+def test_success_resets_failure_count(breaker):
+    for _ in range(2):
+        fail(breaker, TimeoutError())
+    with breaker.guard(url):
+        pass
+    for _ in range(2):
+        fail(breaker, TimeoutError())
+    assert breaker.state('sched.php') == 'closed'
+
+
+def test_answers_of_upstream_are_no_failures(breaker):
+    for _ in range(5):
+        fail(breaker, urllib.error.HTTPError(url, 404, 'Not Found', {},
+                                             io.BytesIO()))
+    assert breaker.state('sched.php') == 'closed'
+
+
+def test_other_endpoints_stay_closed(breaker):
+    for _ in range(3):
+        fail(breaker, ConnectionResetError())
+    breaker.allow('table.php')
+    assert breaker.stats() == {'sched.php': 'open', 'table.php': 'closed'}
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    for _ in range(3):
+        fail(breaker, ConnectionResetError())
+    clock.now += reset_timeout
+    assert breaker.state('sched.php') == 'half-open'
+    breaker.allow('sched.php')
+    with pytest.raises(Cbf.UpstreamUnavailable):
+        breaker.allow('sched.php')
+
+
+def test_failed_probe_reopens(breaker, clock):
+    for _ in range(3):
+        fail(breaker, ConnectionResetError())
+    clock.now += reset_timeout
+    fail(breaker, ConnectionResetError())
+    assert breaker.state('sched.php') == 'open'
+    with pytest.raises(Cbf.UpstreamUnavailable):
+        breaker.allow('sched.php')
+
+
+def test_successful_probe_closes(breaker, clock):
+    for _ in range(3):
+        fail(breaker, ConnectionResetError())
+    clock.now += reset_timeout
+    with breaker.guard(url):
+        pass
+    assert breaker.state('sched.php') == 'closed'
+    breaker.allow('sched.php')
+    breaker.allow('sched.php')
+
+
+def test_lost_probe_is_replaced(breaker, clock):
+    for _ in range(3):
+        fail(breaker, ConnectionResetError())
+    clock.now += reset_timeout
+    breaker.allow('sched.php')
+    clock.now += reset_timeout - 1
+    with pytest.raises(Cbf.UpstreamUnavailable):
+        breaker.allow('sched.php')
+    clock.now += 1
+    breaker.allow('sched.php')
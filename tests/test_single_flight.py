@@ -0,0 +1,184 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+import Cbf
+
+waiters = 4
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def run_concurrently(single_flight: Cbf.SingleFlight, function):
+    """Runs waiters + 1 calls of function with the same key at once."""
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(threading.current_thread())
+        release.wait(5)
+        return function()
+
+    with concurrent.futures.ThreadPoolExecutor(waiters + 1) as executor:
+        futures = [executor.submit(single_flight.do, 'key', call)
+                   for _ in range(waiters + 1)]
+        wait_for(lambda: single_flight.coalesced == waiters)
+        release.set()
+        concurrent.futures.wait(futures)
+    return calls, futures
+
+
+def test_waiters_share_one_call():
+    single_flight = Cbf.SingleFlight()
+    calls, futures = run_concurrently(single_flight, lambda: object())
+    assert len(calls) == 1
+    results = {id(future.result()) for future in futures}
+    assert len(results) == 1
+    assert single_flight.executed == 1
+
+
+def test_exception_propagates_to_all_waiters():
+    single_flight = Cbf.SingleFlight()
+
+    def fail():
+        raise ValueError('failed')
+
+    calls, futures = run_concurrently(single_flight, fail)
+    assert len(calls) == 1
+    for future in futures:
+        with pytest.raises(ValueError, match='failed'):
+            future.result()
+
+
+def test_key_released_after_failure():
+    single_flight = Cbf.SingleFlight()
+
+    def fail():
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        single_flight.do('key', fail)
+    assert single_flight.do('key', lambda: 'retried') == 'retried'
+    assert single_flight.executed == 2
+    assert single_flight.coalesced == 0
+
+
+def test_different_keys_are_not_coalesced():
+    single_flight = Cbf.SingleFlight()
+    assert single_flight.do('a', lambda: 1) == 1
+    assert single_flight.do('b', lambda: 2) == 2
+    assert single_flight.executed == 2
+
+
+def test_async_waiters_share_one_call():
+    single_flight = Cbf.SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return object()
+
+    async def main():
+        return await asyncio.gather(*(
+            single_flight.do_async('key', call) for _ in range(waiters + 1)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 1
+
+
+def test_async_exception_propagates_and_releases_key():
+    single_flight = Cbf.SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('failed')
+
+    async def main():
+        return await asyncio.gather(*(
+            single_flight.do_async('key', fail) for _ in range(waiters + 1)),
+            return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.executed == 1
+
+    async def succeed():
+        return 'retried'
+
+    assert asyncio.run(single_flight.do_async('key', succeed)) == 'retried'
+
+
+class Fetcher:
+    api_url = 'http://upstream/'
+    refresh = False
+    cache = None
+    http = None
+
+    def __init__(self, single_flight):
+        self.single_flight = single_flight
+        self.calls = 0
+        self.release = threading.Event()
+
+    @Cbf._coalesced
+    def fetch(self, phase_id: int):
+        self.calls += 1
+        self.release.wait(5)
+        if phase_id < 0:
+            raise ValueError('failed')
+        return [phase_id]
+
+
+def test_coalesced_fetches_share_one_call():
+    single_flight = Cbf.SingleFlight()
+    fetcher = Fetcher(single_flight)
+    with concurrent.futures.ThreadPoolExecutor(waiters + 1) as executor:
+        futures = [executor.submit(fetcher.fetch, 1)
+                   for _ in range(waiters + 1)]
+        wait_for(lambda: single_flight.coalesced == waiters)
+        fetcher.release.set()
+        results = [future.result() for future in futures]
+    assert fetcher.calls == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_coalesced_fetches_of_other_arguments_run_apart():
+    fetcher = Fetcher(Cbf.SingleFlight())
+    fetcher.release.set()
+    assert fetcher.fetch(1) == [1]
+    assert fetcher.fetch(2) == [2]
+    assert fetcher.calls == 2
+
+
+def test_coalesced_failure_reaches_waiters_and_releases_key():
+    single_flight = Cbf.SingleFlight()
+    fetcher = Fetcher(single_flight)
+    with concurrent.futures.ThreadPoolExecutor(waiters + 1) as executor:
+        futures = [executor.submit(fetcher.fetch, -1)
+                   for _ in range(waiters + 1)]
+        wait_for(lambda: single_flight.coalesced == waiters)
+        fetcher.release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+    assert fetcher.calls == 1
+    with pytest.raises(ValueError):
+        fetcher.fetch(-1)
+    assert fetcher.calls == 2
+
+
+def test_coalescing_disabled_without_single_flight():
+    fetcher = Fetcher(None)
+    fetcher.release.set()
+    fetcher.fetch(1)
+    fetcher.fetch(1)
+    assert fetcher.calls == 2
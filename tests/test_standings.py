@@ -0,0 +1,115 @@
+import itertools
+from typing import List, Optional, Tuple
+
+import Cbf
+
+teams = {name: Cbf.Team(team_id, name, name)
+         for team_id, name in enumerate('ABCD', 1)}
+match_ids = itertools.count(1)
+
+
+def match(home: str, visiting: str, score: Optional[Tuple[int, int]],
+          pts: Optional[Tuple[int, int]] = None) -> Cbf.Match:
+    """Match of given teams, pts 2 for a win and 1 for a loss by default."""
+    result = None
+    if score is not None:
+        if pts is None:
+            pts = (2, 1) if score[0] > score[1] else (1, 2)
+        result = Cbf.Match.Result(pts, score, (), '')
+    return Cbf.Match(next(match_ids), teams[home], teams[visiting], None,
+                     Cbf.Match.Location('', ''), (), None, result)
+
+
+def standings(matches: List[Cbf.Match]) -> Optional[Cbf.Standings]:
+    return Cbf.compute_standings(Cbf.Schedule(1, matches))
+
+
+def ranking(matches: List[Cbf.Match]) -> List[Tuple[str, str]]:
+    """(team, points) in the order of the standings."""
+    return [(team_standing.name, team_standing.points)
+            for team_standing in standings(matches).team_standings]
+
+
+def test_ranks_by_points():
+    assert ranking([
+        match('A', 'B', (80, 70)),
+        match('B', 'C', (60, 50)),
+        match('A', 'C', (70, 60)),
+    ]) == [('A', '4'), ('B', '3'), ('C', '2')]
+
+
+def test_two_team_tie_decided_head_to_head():
+    # B has the better point difference, A won their game
+    assert ranking([
+        match('A', 'B', (70, 68)),
+        match('C', 'A', (90, 60)),
+        match('A', 'D', (75, 70)),
+        match('B', 'C', (100, 50)),
+        match('B', 'D', (100, 50)),
+        match('D', 'C', (61, 60)),
+    ]) == [('A', '5'), ('B', '5'), ('D', '4'), ('C', '4')]
+
+
+def test_three_way_tie_decided_by_mutual_point_difference():
+    # equal on mutual points, overall difference would rank them B, C, A
+    assert ranking([
+        match('A', 'B', (80, 70)),
+        match('B', 'C', (75, 70)),
+        match('C', 'A', (71, 70)),
+        match('A', 'D', (61, 60)),
+        match('B', 'D', (100, 60)),
+        match('C', 'D', (80, 60)),
+    ]) == [('A', '5'), ('C', '5'), ('B', '5'), ('D', '3')]
+
+
+def test_tie_without_mutual_games_decided_by_point_difference():
+    assert ranking([
+        match('A', 'C', (80, 70)),
+        match('B', 'D', (90, 70)),
+    ]) == [('B', '2'), ('A', '2'), ('C', '1'), ('D', '1')]
+
+
+def test_tie_on_point_difference_decided_by_points_scored():
+    assert ranking([
+        match('A', 'C', (80, 70)),
+        match('B', 'D', (90, 80)),
+    ]) == [('B', '2'), ('A', '2'), ('D', '1'), ('C', '1')]
+
+
+def test_forfeit_gives_the_loser_no_points():
+    table = standings([
+        match('A', 'B', (20, 0), pts=(2, 0)),
+        match('B', 'C', (70, 60)),
+        match('C', 'A', (65, 60)),
+    ])
+    assert [(team_standing.name, team_standing.points,
+             team_standing.games_won, team_standing.games_lost)
+            for team_standing in table.team_standings] == [
+        ('C', '3', 1, 1), ('A', '3', 1, 1), ('B', '2', 1, 1)]
+
+
+def test_teams_yet_to_play_are_listed_with_zeros():
+    table = standings([
+        match('A', 'B', (80, 70)),
+        match('C', 'D', None),
+        match('C', 'A', (0, 0)),
+    ])
+    assert [team_standing.name for team_standing in table.team_standings] \
+        == ['A', 'B', 'C', 'D']
+    c = table.team_standings[2]
+    assert (c.position, c.games_played, c.points_scored, c.points) == \
+        (3, 0, 0, '0')
+
+
+def test_draw_needs_upstream_standings():
+    assert standings([
+        match('A', 'B', (80, 70)),
+        match('B', 'C', (70, 70), pts=(1, 1)),
+    ]) is None
+
+
+def test_pts_disagreeing_with_score_need_upstream_standings():
+    assert standings([
+        match('A', 'B', (80, 70)),
+        match('B', 'C', (70, 60), pts=(1, 2)),
+    ]) is None